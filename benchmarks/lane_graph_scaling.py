@@ -0,0 +1,32 @@
+"""
+Time to build a LaneGraph for growing maps of parallel lane chains. Before
+successor linking used a spatial hash, it compared every lane end with
+every lane start and dominated this time.
+
+    python benchmarks/lane_graph_scaling.py [lane counts...]
+"""
+import sys
+import time
+
+import numpy as np
+
+from osi_extractor.lanegraph import NO_LANE, LaneGraph
+from synthetic_maps import lane_chains
+
+DEFAULT_LANE_COUNTS = (100, 1000, 10000, 50000)
+
+
+def main():
+    lane_counts = [int(arg) for arg in sys.argv[1:]] or DEFAULT_LANE_COUNTS
+    print(f"{'lanes':>7} {'build':>10} {'successors':>11}")
+    for lane_count in lane_counts:
+        lane_data = lane_chains(lane_count).lane_data()
+        start = time.perf_counter()
+        lane_graph = LaneGraph(lane_data)
+        duration = time.perf_counter() - start
+        linked = int(np.count_nonzero(lane_graph.successor_lanes != NO_LANE))
+        print(f"{lane_count:7d} {duration * 1000:8.1f} ms {linked:11d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Time to build a RoadManager on a staircase map, where every road
+branches off the previous one (the worst case of the former repeated
+scan over all lanes), then check that rebuilding it on map updates does
+not keep old managers alive.
+
+    python benchmarks/road_manager_scaling.py [road counts...]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+import weakref
+
+from osi_extractor.lanegraph import LaneGraph
+from osi_extractor.road import RoadManager
+from synthetic_maps import highway, staircase
+
+DEFAULT_ROAD_COUNTS = (100, 1000, 3000)
+LEAK_CHECK_REBUILDS = 200
+LEAK_CHECK_WARMUP = 20
+
+
+def scaling(road_counts: list[int]):
+    print(f"{'lanes':>7} {'build':>10} {'roads':>6}")
+    for road_count in road_counts:
+        lane_graph = LaneGraph(staircase(road_count).lane_data())
+        gc.disable()
+        start = time.perf_counter()
+        road_manager = RoadManager(lane_graph)
+        duration = time.perf_counter() - start
+        gc.enable()
+        print(f"{len(lane_graph):7d} {duration * 1000:8.1f} ms {len(road_manager.roads):6d}")
+
+
+def leak_check():
+    lane_data = highway(50).lane_data()
+    managers = []
+    tracemalloc.start()
+    for i in range(LEAK_CHECK_REBUILDS):
+        road_manager = RoadManager(LaneGraph(lane_data))
+        managers.append(weakref.ref(road_manager))
+        if i == LEAK_CHECK_WARMUP:
+            gc.collect()
+            baseline = tracemalloc.get_traced_memory()[0]
+    del road_manager
+    gc.collect()
+    growth = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    alive = sum(manager() is not None for manager in managers)
+    print(f"{LEAK_CHECK_REBUILDS} rebuilds: {alive} managers alive, traced memory changed by {growth / 1024:+.0f} KiB")
+
+
+def main():
+    scaling([int(arg) for arg in sys.argv[1:]] or DEFAULT_ROAD_COUNTS)
+    leak_check()
+
+
+if __name__ == "__main__":
+    main()
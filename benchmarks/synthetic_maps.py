@@ -0,0 +1,78 @@
+"""
+Synthetic OSI maps for the benchmarks. Lanes are straight, have no
+boundaries and are only linked through their centerlines and adjacent
+lane ids, which is all LaneGraph and RoadManager need.
+"""
+from osi3.osi_groundtruth_pb2 import GroundTruth
+
+from osi_extractor.lane import LaneData, LaneSubtype, LaneType
+
+LANE_WIDTH = 3.5
+
+
+class MapBuilder:
+    def __init__(self):
+        self.ground_truth = GroundTruth()
+        self._next_id = 1
+
+    def lane(self, points: list[tuple[float, float]], subtype: LaneSubtype = LaneSubtype.NORMAL):
+        lane = self.ground_truth.lane.add()
+        lane.id.value = self._next_id
+        self._next_id += 1
+        lane.classification.type = LaneType.DRIVING.value
+        lane.classification.subtype = subtype.value
+        lane.classification.centerline_is_driving_direction = True
+        for x, y in points:
+            lane.classification.centerline.add(x=x, y=y, z=0.0)
+        return lane
+
+    def straight(self, x0: float, x1: float, y: float, subtype: LaneSubtype = LaneSubtype.NORMAL,
+                 step: float = 10.0):
+        n = max(2, round((x1 - x0) / step) + 1)
+        return self.lane([(x0 + (x1 - x0) * i / (n - 1), y) for i in range(n)], subtype)
+
+    def section(self, x0: float, x1: float, subtypes: list[LaneSubtype], y0: float = 0.0):
+        """Parallel lanes from right (subtypes[0]) to left, linked as neighbours."""
+        lanes = [self.straight(x0, x1, y0 + i * LANE_WIDTH, subtype) for i, subtype in enumerate(subtypes)]
+        for right, left in zip(lanes, lanes[1:]):
+            right.classification.left_adjacent_lane_id.add(value=left.id.value)
+            left.classification.right_adjacent_lane_id.add(value=right.id.value)
+        return lanes
+
+    def lane_data(self) -> dict[int, LaneData]:
+        return {lane.id.value: LaneData(self.ground_truth, lane) for lane in self.ground_truth.lane}
+
+
+def lane_chains(lane_count: int, chain_length: int = 10, lane_length: float = 50.0) -> MapBuilder:
+    """Parallel chains of chain_length consecutive lanes."""
+    builder = MapBuilder()
+    for i in range(lane_count):
+        chain, k = divmod(i, chain_length)
+        builder.straight(k * lane_length, (k + 1) * lane_length, chain * LANE_WIDTH, step=lane_length)
+    return builder
+
+
+def staircase(road_count: int) -> MapBuilder:
+    """
+    Roads that each branch off the previous one: road j continues in lane
+    Q_j, while lane D_j leaves sideways from the end of P_j into P_{j+1}.
+    """
+    builder = MapBuilder()
+    for j in reversed(range(road_count)):
+        x, y = j * 100.0, j * 20.0
+        builder.straight(x, x + 100, y, step=50.0)
+        builder.straight(x + 100, x + 200, y, step=50.0)
+        builder.lane([(x + 100, y), (x + 100, y + 10), (x + 100, y + 20)])
+    return builder
+
+
+def highway(section_count: int, section_length: float = 50.0) -> MapBuilder:
+    """Three lane highway, every fourth section has an additional exit lane on the right."""
+    builder = MapBuilder()
+    for k in range(section_count):
+        if k % 4 == 0:
+            subtypes, y0 = [LaneSubtype.EXIT] + [LaneSubtype.NORMAL] * 3, -LANE_WIDTH
+        else:
+            subtypes, y0 = [LaneSubtype.NORMAL] * 3, 0.0
+        builder.section(k * section_length, (k + 1) * section_length, subtypes, y0)
+    return builder
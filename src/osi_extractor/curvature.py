@@ -12,6 +12,11 @@ class Curvature():
         self._curvature_change_list = self._calc_curvature_change_list(
             self._curvature_list, distances)
 
+    @property
+    def curvatures(self) -> np.ndarray:
+        """Curvature at every centerline point."""
+        return self._curvature_list
+
     def get_road_curvature(self, segment_index: int, segment_progress: float):
         return self._curvature_list[segment_index]*(1-segment_progress) + self._curvature_list[segment_index+1]*segment_progress
 
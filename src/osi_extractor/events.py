@@ -0,0 +1,134 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import Optional
+
+import numpy as np
+
+from .lanegraph import NO_LANE
+from .road import NO_ROAD
+from .state import State
+
+# a lane change starts when the object is this close to a lane boundary
+# (as fraction of the lane width) and moving towards it
+LANE_CHANGE_START_MARGIN = 0.2
+CUT_IN_DISTANCE = 50.0  # maximum distance ahead of the ego
+TRACK_CAPACITY = 64
+
+
+class LaneEventType(Enum):
+    LANE_CHANGE_START = 0
+    LANE_CHANGE_ABORT = 1
+    LANE_CHANGE_COMPLETE = 2
+    CUT_IN = 3
+
+
+@dataclass(frozen=True)
+class LaneEvent:
+    event_type: LaneEventType
+    simulator_id: int
+    from_lane_id: int
+    to_lane_id: Optional[int]  # None until the lane change is complete
+    side: Optional[str]  # "left" or "right", None if no start was seen
+
+
+class LaneEventDetector:
+    """
+    Lane change and cut-in events from consecutive states. Every object has
+    a track (lane, lane position, side of a started lane change) in arrays
+    indexed by slot, a new state is compared with the tracks in one batch
+    and only objects whose track changed are looked at in Python. Objects
+    missing from a state lose their track.
+    """
+    def __init__(self, start_margin: float = LANE_CHANGE_START_MARGIN, cut_in_distance: float = CUT_IN_DISTANCE):
+        self.start_margin = start_margin
+        self.cut_in_distance = cut_in_distance
+        self._slots: dict[int, int] = {}
+        self._allocate(TRACK_CAPACITY)
+
+    def _allocate(self, capacity: int):
+        self._tracked = np.zeros(capacity, dtype=bool)
+        self._lane = np.full(capacity, NO_LANE, dtype=np.int64)
+        self._lane_position = np.full(capacity, np.nan)
+        self._side = np.zeros(capacity, dtype=np.int8)  # -1 left, 1 right, 0 no lane change
+
+    def _grow(self, capacity: int):
+        tracked, lane, lane_position, side = self._tracked, self._lane, self._lane_position, self._side
+        self._allocate(capacity)
+        for old, new in ((tracked, self._tracked), (lane, self._lane),
+                         (lane_position, self._lane_position), (side, self._side)):
+            new[:len(old)] = old
+
+    def _assign_slots(self, ids: list[int]) -> np.ndarray:
+        current = set(ids)
+        for simulator_id in [id for id in self._slots if id not in current]:
+            slot = self._slots.pop(simulator_id)
+            self._tracked[slot] = False
+        new_ids = [id for id in ids if id not in self._slots]
+        if len(new_ids) > 0:
+            free = np.flatnonzero(~self._tracked)
+            if len(free) < len(new_ids):
+                self._grow(max(2 * len(self._tracked), len(self._slots) + len(new_ids)))
+                free = np.flatnonzero(~self._tracked)
+            for simulator_id, slot in zip(new_ids, free.tolist()):
+                self._slots[simulator_id] = slot
+                self._lane[slot] = NO_LANE
+                self._lane_position[slot] = np.nan
+                self._side[slot] = 0
+        return np.array([self._slots[id] for id in ids], dtype=np.int64)
+
+    def update(self, state: State) -> list[LaneEvent]:
+        objects = state.moving_objects
+        ids = [mo.simulator_id for mo in objects]
+        slots = self._assign_slots(ids)
+        lanes = np.array([mo.lane_ids[0] if len(mo.lane_ids) > 0 else NO_LANE for mo in objects], dtype=np.int64)
+        lane_positions = np.array([mo.road_state.lane_position if mo.road_state is not None else np.nan
+                                   for mo in objects], dtype=np.float64)
+
+        was_tracked = self._tracked[slots]
+        previous_lanes = self._lane[slots]
+        sides = self._side[slots]
+        moving = lane_positions - self._lane_position[slots]
+        lane_changed = was_tracked & (lanes != previous_lanes) & (lanes != NO_LANE) & (previous_lanes != NO_LANE)
+        near_left = (lane_positions < self.start_margin) & (moving < 0)
+        near_right = (lane_positions > 1 - self.start_margin) & (moving > 0)
+        starting = was_tracked & ~lane_changed & (sides == 0) & (lanes == previous_lanes) & (near_left | near_right)
+        centered = ((lane_positions >= self.start_margin) & (lane_positions <= 1 - self.start_margin))
+        aborted = ~lane_changed & (sides != 0) & ((lanes == previous_lanes) & centered | (lanes == NO_LANE))
+
+        events = []
+        for row in np.flatnonzero(starting).tolist():
+            side = -1 if near_left[row] else 1
+            events.append(LaneEvent(LaneEventType.LANE_CHANGE_START, ids[row], int(lanes[row]), None,
+                                    _side_name(side)))
+            self._side[slots[row]] = side
+        for row in np.flatnonzero(aborted).tolist():
+            events.append(LaneEvent(LaneEventType.LANE_CHANGE_ABORT, ids[row], int(previous_lanes[row]), None,
+                                    _side_name(int(sides[row]))))
+            self._side[slots[row]] = 0
+        changed_rows = np.flatnonzero(lane_changed).tolist()
+        ego = objects[0] if len(objects) > 0 else None
+        for row in changed_rows:
+            event = LaneEvent(LaneEventType.LANE_CHANGE_COMPLETE, ids[row], int(previous_lanes[row]),
+                              int(lanes[row]), _side_name(int(sides[row])))
+            events.append(event)
+            self._side[slots[row]] = 0
+            if row != 0 and ego is not None and self._is_cut_in(objects[row], ego):
+                events.append(LaneEvent(LaneEventType.CUT_IN, event.simulator_id, event.from_lane_id,
+                                        event.to_lane_id, event.side))
+
+        self._tracked[slots] = True
+        self._lane[slots] = lanes
+        self._lane_position[slots] = lane_positions
+        return events
+
+    def _is_cut_in(self, mo, ego) -> bool:
+        # the object just arrived on the ego lane, ahead of the ego
+        if len(ego.lane_ids) == 0 or mo.lane_ids[0] != ego.lane_ids[0]:
+            return False
+        if mo.road_s is None or ego.road_s is None or mo.road_id in (None, NO_ROAD) or mo.road_id != ego.road_id:
+            return False
+        return 0 < mo.road_s[0] - ego.road_s[0] <= self.cut_in_distance
+
+
+def _side_name(side: int) -> Optional[str]:
+    return {-1: "left", 1: "right"}.get(side)
@@ -85,6 +85,75 @@ def closest_projected_point(
     )
 
 
+def group_argmin(values: np.ndarray, group_starts: np.ndarray) -> np.ndarray:
+    """
+    Index of the first minimum in every group of values. The groups are the
+    non-empty, contiguous ranges of values beginning at group_starts.
+    """
+    if len(group_starts) == 0:
+        return np.empty(0, dtype=np.int64)
+    sizes = np.diff(np.append(group_starts, len(values)))
+    minima = np.minimum.reduceat(values, group_starts)
+    candidates = np.flatnonzero(values == np.repeat(minima, sizes))
+    candidate_groups = np.repeat(np.arange(len(group_starts)), sizes)[candidates]
+    first = np.ones(len(candidates), dtype=bool)
+    first[1:] = candidate_groups[1:] != candidate_groups[:-1]
+    return candidates[first]
+
+
+def closest_projected_points(
+    points: np.ndarray,
+    vertices: np.ndarray,
+    first: np.ndarray,
+    last: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Batched closest_projected_point: point i is projected onto the polyline
+    vertices[first[i]:last[i]], all polylines are packed into one array.
+
+    Returns 2 ndarrays of shape (n,)
+    - the index (into vertices) of the start of the chosen segment, -1 for
+      polylines with less than 2 vertices
+    - the segment progress, NaN for polylines with less than 2 vertices
+    """
+    counts = np.maximum(last - first - 1, 0)
+    n_pairs = int(counts.sum())
+    pair_point = np.repeat(np.arange(len(points)), counts)
+    pair_offsets = np.zeros(len(points), dtype=np.int64)
+    np.cumsum(counts[:-1], out=pair_offsets[1:])
+    pair_segment = first[pair_point] + np.arange(n_pairs) - pair_offsets[pair_point]
+
+    start = vertices[pair_segment]
+    v = vertices[pair_segment + 1] - start
+    d = points[pair_point] - start
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.einsum("ij,ij->i", v, d) / np.einsum("ij,ij->i", v, v)
+    relevant = (0 <= t) & (t <= 1)
+    offset = d - np.expand_dims(np.where(relevant, t, 0.0), axis=-1) * v
+    projected_distance_squared = np.where(relevant, np.einsum("ij,ij->i", offset, offset), np.inf)
+    start_distance_squared = np.einsum("ij,ij->i", d, d)
+
+    has_pairs = counts > 0
+    group_starts = pair_offsets[has_pairs]
+    best_projected = group_argmin(projected_distance_squared, group_starts)
+    best_start = group_argmin(start_distance_squared, group_starts)
+
+    segment_index = np.full(len(points), -1, dtype=np.int64)
+    segment_progress = np.full(len(points), np.nan)
+    projected = np.isfinite(projected_distance_squared[best_projected])
+    segment_index[has_pairs] = np.where(
+        projected, pair_segment[best_projected], pair_segment[best_start])
+    segment_progress[has_pairs] = np.where(projected, t[best_projected], 0.0)
+    # p could not be projected onto any segment and the final segment end is closest
+    last_segment = last[has_pairs] - 2
+    last_d = vertices[last_segment + 1] - points[has_pairs]
+    use_end = ~projected & (np.einsum("ij,ij->i", last_d, last_d)
+                            < start_distance_squared[best_start])
+    segment_index[np.flatnonzero(has_pairs)[use_end]] = last_segment[use_end]
+    segment_progress[np.flatnonzero(has_pairs)[use_end]] = 1.0
+    return segment_index, segment_progress
+
+
 def closest_segment_start_or_end(p, segment_starts, segment_ends):
     d = segment_starts - p
     """
@@ -109,6 +178,30 @@ def closest_segment_start_or_end(p, segment_starts, segment_ends):
         )
 
 
+def rotation_matrices(
+    yaw: Union[float, np.ndarray],
+    pitch: Union[float, np.ndarray],
+    roll: Union[float, np.ndarray],
+) -> np.ndarray:
+    """
+    Rotation matrices for (arrays of) OSI orientations, shape (..., 3, 3).
+    """
+    # matrix construction is based on:
+    # https://opensimulationinterface.github.io/osi-documentation/#_coordinate_systems_and_reference_points
+    sin_yaw = np.sin(yaw)
+    sin_pitch = np.sin(pitch)
+    sin_roll = np.sin(roll)
+    cos_yaw = np.cos(yaw)
+    cos_pitch = np.cos(pitch)
+    cos_roll = np.cos(roll)
+    matrices = np.array([
+        [cos_pitch*cos_yaw, cos_pitch*sin_yaw, -sin_pitch],
+        [sin_roll*sin_pitch*cos_yaw - cos_roll*sin_yaw, sin_roll*sin_pitch*sin_yaw + cos_roll*cos_yaw, sin_roll*cos_pitch],
+        [cos_roll*sin_pitch*cos_yaw + sin_roll*sin_yaw, cos_roll*sin_pitch*sin_yaw - sin_roll*cos_yaw, cos_roll*cos_pitch],
+    ])
+    return np.moveaxis(matrices, (0, 1), (-2, -1))
+
+
 class Orientation:
     _matrix: np.ndarray
 
@@ -117,19 +210,7 @@ class Orientation:
         return Orientation(yaw=osi_obj.yaw, pitch=osi_obj.pitch, roll=osi_obj.roll)
 
     def __init__(self, yaw: float, pitch: float, roll: float):
-        # matrix construction is based on:
-        # https://opensimulationinterface.github.io/osi-documentation/#_coordinate_systems_and_reference_points
-        sin_yaw = np.sin(yaw)
-        sin_pitch = np.sin(pitch)
-        sin_roll = np.sin(roll)
-        cos_yaw = np.cos(yaw)
-        cos_pitch = np.cos(pitch)
-        cos_roll = np.cos(roll)
-        self._matrix = np.array([
-            [cos_pitch*cos_yaw, cos_pitch*sin_yaw, -sin_pitch],
-            [sin_roll*sin_pitch*cos_yaw - cos_roll*sin_yaw, sin_roll*sin_pitch*sin_yaw + cos_roll*cos_yaw, sin_roll*cos_pitch],
-            [cos_roll*sin_pitch*cos_yaw + sin_roll*sin_yaw, cos_roll*sin_pitch*sin_yaw - sin_roll*cos_yaw, cos_roll*cos_pitch],
-        ])
+        self._matrix = rotation_matrices(yaw, pitch, roll)
 
     def rotate_vector(self, vector: np.ndarray) -> np.ndarray:
         return self._matrix @ vector
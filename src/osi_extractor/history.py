@@ -0,0 +1,150 @@
+from typing import Optional
+
+import numpy as np
+
+from .state import State
+
+HISTORY_LENGTH = 32
+HISTORY_CAPACITY = 64
+NO_OBJECT = -1
+SCALAR_FIELDS = ("yaw", "lane_position", "road_s")
+VECTOR_FIELDS = ("position", "velocity")
+
+
+class StateHistory:
+    """
+    The last `length` samples of every moving object, in ring buffers that
+    are allocated once (and grown when more objects are tracked than fit).
+
+    All objects of a state are written at the same ring position, so every
+    accessor works on all tracked objects at once and returns one value per
+    slot (see ids), NaN where an object has too few samples. Objects that
+    are missing from a recorded state are evicted and their slot is reused.
+    """
+    def __init__(self, length: int = HISTORY_LENGTH, capacity: int = HISTORY_CAPACITY):
+        if length < 3:
+            raise ValueError("A history needs at least 3 samples for second derivatives")
+        self.length = length
+        self._head = 0  # ring position of the next sample
+        self._slots: dict[int, int] = {}
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int):
+        self.ids = np.full(capacity, NO_OBJECT, dtype=np.int64)
+        self._count = np.zeros(capacity, dtype=np.int64)
+        self._time = np.full(self.length, np.nan)
+        self._buffers = {field: np.full((capacity, self.length), np.nan) for field in SCALAR_FIELDS}
+        self._buffers.update({field: np.full((capacity, self.length, 3), np.nan) for field in VECTOR_FIELDS})
+
+    def _grow(self, capacity: int):
+        ids, count, buffers = self.ids, self._count, self._buffers
+        time = self._time
+        self._allocate(capacity)
+        self.ids[:len(ids)] = ids
+        self._count[:len(count)] = count
+        self._time[:] = time
+        for field, buffer in buffers.items():
+            self._buffers[field][:len(buffer)] = buffer
+
+    def record(self, state: State, timestamp: float):
+        objects = state.moving_objects
+        current = {mo.simulator_id for mo in objects}
+        for simulator_id in [id for id in self._slots if id not in current]:
+            slot = self._slots.pop(simulator_id)
+            self.ids[slot] = NO_OBJECT
+            self._count[slot] = 0
+        new_ids = [mo.simulator_id for mo in objects if mo.simulator_id not in self._slots]
+        if len(new_ids) > 0:
+            free = np.flatnonzero(self.ids == NO_OBJECT)
+            if len(free) < len(new_ids):
+                self._grow(max(2 * len(self.ids), len(self._slots) + len(new_ids)))
+                free = np.flatnonzero(self.ids == NO_OBJECT)
+            for simulator_id, slot in zip(new_ids, free.tolist()):
+                self._slots[simulator_id] = slot
+                self.ids[slot] = simulator_id
+        slots = [self._slots[mo.simulator_id] for mo in objects]
+
+        head = self._head
+        self._time[head] = timestamp
+        self._buffers["position"][slots, head] = [(mo.location.x, mo.location.y, mo.location.z) for mo in objects]
+        self._buffers["velocity"][slots, head] = [(mo.velocity.x_mps, mo.velocity.y_mps, mo.velocity.z_mps)
+                                                  for mo in objects]
+        self._buffers["yaw"][slots, head] = [mo.orientation.yaw for mo in objects]
+        self._buffers["lane_position"][slots, head] = [
+            mo.road_state.lane_position if mo.road_state is not None else np.nan for mo in objects]
+        self._buffers["road_s"][slots, head] = [mo.road_s[0] if mo.road_s is not None else np.nan
+                                                for mo in objects]
+        self._count[slots] = np.minimum(self._count[slots] + 1, self.length)
+        self._head = (head + 1) % self.length
+
+    def slot(self, simulator_id: int) -> Optional[int]:
+        return self._slots.get(simulator_id)
+
+    def _position(self, age: int) -> int:
+        # ring position of the sample recorded `age` states ago
+        return (self._head - 1 - age) % self.length
+
+    def series(self, simulator_id: int, field: str) -> np.ndarray:
+        """Samples of one object, oldest first."""
+        slot = self._slots[simulator_id]
+        ages = np.arange(self._count[slot])[::-1]
+        return self._buffers[field][slot, self._position(ages)]
+
+    def latest(self, field: str) -> np.ndarray:
+        return np.where(self._mask(self._count >= 1, field), self._buffers[field][:, self._position(0)], np.nan)
+
+    def rate(self, field: str, order: int = 1) -> np.ndarray:
+        """
+        Backward finite difference of the given order (1 or 2) over time at
+        the latest sample. Yaw differences are wrapped to [-pi, pi).
+        """
+        if order not in (1, 2):
+            raise ValueError(f"Unsupported derivative order {order}")
+        buffer = self._buffers[field]
+        rates = [self._difference(field, buffer[:, self._position(age)], buffer[:, self._position(age + 1)])
+                 / self._elapsed(age) for age in range(order)]
+        rate = rates[0] if order == 1 else (rates[0] - rates[1]) / (self._elapsed(0, 2) / 2)
+        return np.where(self._mask(self._count > order, field), rate, np.nan)
+
+    def window_mean(self, field: str, n: int) -> np.ndarray:
+        """Mean over the last n samples, NaN for objects with less than n samples."""
+        window = self._window(field, n)
+        return np.where(self._mask(self._count >= n, field), window.mean(axis=1), np.nan)
+
+    def window_std(self, field: str, n: int) -> np.ndarray:
+        """Standard deviation over the last n samples, NaN for objects with less than n samples."""
+        window = self._window(field, n)
+        return np.where(self._mask(self._count >= n, field), window.std(axis=1), np.nan)
+
+    def lateral_velocity(self) -> np.ndarray:
+        """Latest velocity perpendicular to the heading, positive to the left."""
+        velocity = self.latest("velocity")
+        yaw = self.latest("yaw")
+        return velocity[:, 1] * np.cos(yaw) - velocity[:, 0] * np.sin(yaw)
+
+    def yaw_rate(self) -> np.ndarray:
+        return self.rate("yaw")
+
+    def lane_position_rate(self) -> np.ndarray:
+        return self.rate("lane_position")
+
+    def jerk(self) -> np.ndarray:
+        """Second derivative of the velocity vector, shape (capacity, 3)."""
+        return self.rate("velocity", order=2)
+
+    def _window(self, field: str, n: int) -> np.ndarray:
+        if not 1 <= n <= self.length:
+            raise ValueError(f"Window of {n} samples does not fit into a history of {self.length}")
+        return self._buffers[field][:, self._position(np.arange(n))]
+
+    def _difference(self, field: str, newer: np.ndarray, older: np.ndarray) -> np.ndarray:
+        difference = newer - older
+        if field == "yaw":
+            difference = (difference + np.pi) % (2*np.pi) - np.pi
+        return difference
+
+    def _elapsed(self, age: int, steps: int = 1) -> float:
+        return self._time[self._position(age)] - self._time[self._position(age + steps)]
+
+    def _mask(self, has_samples: np.ndarray, field: str) -> np.ndarray:
+        return has_samples[:, np.newaxis] if field in VECTOR_FIELDS else has_samples
@@ -0,0 +1,102 @@
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+
+import osi_extractor.speedlimit_logic as speedlimit_logic
+from .lane import LaneSubtype
+from .lanegraph import LaneGraph
+from .road import RoadManager
+
+HORIZON_DISTANCE = 300.0
+HORIZON_STEP = 5.0
+
+
+@dataclass
+class Horizon:
+    """
+    Lane attributes ahead of a position, sampled every step metres along
+    the successor chain (or route) of the current lane. All arrays have
+    one entry per sample, the horizon ends early if the lane chain does.
+    """
+    s: np.ndarray  # distance ahead of the position
+    lane_id: np.ndarray
+    curvature: np.ndarray
+    lane_width: np.ndarray
+    speed_limit: np.ndarray  # NaN where no speed limit applies
+    lane_type: np.ndarray  # LaneType values
+    lane_subtype: np.ndarray  # LaneSubtype values
+    lane_count: np.ndarray  # parallel lanes in the same driving direction
+
+
+def compute_horizon(
+    lane_graph: LaneGraph,
+    road_manager: RoadManager,
+    lane_id: int,
+    position: np.ndarray,
+    distance: float = HORIZON_DISTANCE,
+    step: float = HORIZON_STEP,
+    route: Optional[Sequence[int]] = None,
+    target_lane_id: Optional[int] = None,
+) -> Optional[Horizon]:
+    """
+    Horizon from position on lane_id, None if the lane is not in the lane
+    graph or has no centerline.
+    """
+    data = lane_graph.get_lane_data(lane_id)
+    if data is None or data.centerline_len == 0:
+        return None
+    projection = data.project_onto_centerline(position)
+    start_s = data.centerline_total_distance - data.distance_to_end(projection)
+    indices = lane_graph.lanes_ahead(lane_id, start_s + distance, route, target_lane_id)
+    lanes = [lane_graph.node_at(i).data for i in indices.tolist()]
+    # the static per lane profiles are concatenated once, the samples are
+    # then interpolated in a single vectorized pass
+    lane_starts = np.zeros(len(lanes) + 1)
+    np.cumsum(lane_graph.lengths[indices], out=lane_starts[1:])
+    profile_s = np.concatenate([offset + lane.centerline_s
+                                for offset, lane in zip(lane_starts, lanes)])
+    curvatures = np.concatenate([lane.curvature.curvatures for lane in lanes])
+    widths = np.concatenate([lane.centerline_widths for lane in lanes])
+
+    chain_s = start_s + np.arange(0.0, distance + step / 2, step)
+    chain_s = chain_s[chain_s <= lane_starts[-1]]
+    lane_in_chain = np.minimum(
+        np.searchsorted(lane_starts[1:], chain_s, side="right"), len(lanes) - 1)
+    sample_indices = indices[lane_in_chain]
+
+    return Horizon(
+        s=chain_s - start_s,
+        lane_id=lane_graph.ids[sample_indices],
+        curvature=np.interp(chain_s, profile_s, curvatures),
+        lane_width=np.interp(chain_s, profile_s, widths),
+        speed_limit=_speed_limits(lane_graph, road_manager, indices, lane_starts,
+                                  lane_in_chain, chain_s),
+        lane_type=lane_graph.lane_types[sample_indices],
+        lane_subtype=lane_graph.lane_subtypes[sample_indices],
+        lane_count=lane_graph.lane_counts[sample_indices],
+    )
+
+
+def _speed_limits(
+    lane_graph: LaneGraph,
+    road_manager: RoadManager,
+    indices: np.ndarray,
+    lane_starts: np.ndarray,
+    lane_in_chain: np.ndarray,
+    chain_s: np.ndarray,
+) -> np.ndarray:
+    speed_limits = np.full(chain_s.shape, np.nan)
+    for k, index in enumerate(indices.tolist()):
+        samples = lane_in_chain == k
+        lane = lane_graph.node_at(index)
+        road = road_manager.get_road(lane)
+        if road is None or not samples.any() or lane.data.start_point() is None:
+            continue
+        road_s_at_lane_start, _ = road.object_road_s(lane, lane.data.start_point())
+        road_s = road_s_at_lane_start + chain_s[samples] - lane_starts[k]
+        ignore_exit_speed_signs = (road.on_highway
+                                   and lane.data.lane_subtype != LaneSubtype.EXIT)
+        speed_limits[samples] = speedlimit_logic.calculate_speedlimits(
+            road, road_s, ignore_exit_speed_signs)
+    return speed_limits
@@ -1,5 +1,6 @@
 from __future__ import annotations
 from enum import Enum
+from functools import cached_property
 
 from typing import Iterable, Optional, Sequence
 
@@ -85,10 +86,10 @@ def boundaries_to_ndarray(
 
 
 class LaneData:
-    _last_position_for_boundaries_projection: Optional[np.ndarray] = np.array(
-        [float("nan"), float("nan"), float("nan")])
-    _cached_boundaries_projections: tuple[Optional[ProjectionResult],
-                                          Optional[ProjectionResult]] = (None, None)
+    # position and result in one tuple, so that threads sharing a lane never mix them up
+    _cached_boundaries_projections: tuple[np.ndarray, tuple[Optional[ProjectionResult],
+                                                            Optional[ProjectionResult]]] = (
+        np.array([float("nan"), float("nan"), float("nan")]), (None, None))
 
     def __init__(self, gt: GroundTruth, osi_lane: Lane):
         self.osi_lane = osi_lane
@@ -148,14 +149,15 @@ class LaneData:
         self,
         position: np.ndarray
     ) -> tuple[Optional[ProjectionResult], Optional[ProjectionResult]]:
-        if np.array_equal(self._last_position_for_boundaries_projection, position):
-            return self._cached_boundaries_projections
-        self._last_position_for_boundaries_projection = position
-        self._cached_boundaries_projections = (
+        last_position, projections = self._cached_boundaries_projections
+        if np.array_equal(last_position, position):
+            return projections
+        projections = (
             closest_projected_point(position, self.left_boundary_matrix),
             closest_projected_point(position, self.right_boundary_matrix),
         )
-        return self._cached_boundaries_projections
+        self._cached_boundaries_projections = (position, projections)
+        return projections
 
     def boundary_points_for_position(
         self,
@@ -178,6 +180,25 @@ class LaneData:
         )
         return distance
 
+    @cached_property
+    def centerline_s(self) -> np.ndarray:
+        """Distance along the centerline at each centerline point."""
+        s = np.zeros(self.centerline_len)
+        np.cumsum(self.centerline_distances, out=s[1:])
+        return s
+
+    @cached_property
+    def centerline_widths(self) -> np.ndarray:
+        """Lane width at each centerline point."""
+        widths = np.full(self.centerline_len, np.nan)
+        if len(self.left_boundary_matrix) < 2 or len(self.right_boundary_matrix) < 2:
+            return widths
+        for i, point in enumerate(self.centerline_matrix):
+            left = closest_projected_point(point, self.left_boundary_matrix)
+            right = closest_projected_point(point, self.right_boundary_matrix)
+            widths[i] = np.linalg.norm(left.projected_point - right.projected_point)
+        return widths
+
     def start_point(self) -> Optional[np.array]:
         if self.centerline_matrix.shape[0] == 0:
             return None
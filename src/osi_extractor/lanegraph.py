@@ -1,30 +1,83 @@
+import heapq
+import itertools
 from dataclasses import dataclass
-from typing import Generic, Iterable, Optional, TypeVar
+from functools import cached_property, lru_cache
+from typing import Callable, Generic, Iterable, Optional, Sequence, TypeVar
 
 import numpy as np
 
 from .lane import LaneData, LaneSubtype, LaneType
+from .spatial import PointGrid, SegmentGrid
 
 
 SUCCESSOR_MAX_DISTANCE = 0.1
+RAMP_SUBTYPES = (LaneSubtype.OFFRAMP, LaneSubtype.CONNECTINGRAMP)
+ROUTE_CACHE_SIZE = 256
+NO_LANE = -1
 
 
-@dataclass
 class LaneGraphNode:
-    id: int
-    data: LaneData
-    right: Optional['LaneGraphNode'] = None
-    left: Optional['LaneGraphNode'] = None
-    predecessor: Optional['LaneGraphNode'] = None
-    successor: Optional['LaneGraphNode'] = None
+    """
+    Lightweight view of a single lane of a LaneGraph.
+
+    Nodes are created on demand and only hold the graph and the dense lane
+    index, all topology is stored in the arrays of the graph.
+    """
+    __slots__ = ("_graph", "index")
+
+    def __init__(self, graph: 'LaneGraph', index: int):
+        self._graph = graph
+        self.index = index
+
+    @property
+    def id(self) -> int:
+        return int(self._graph._ids[self.index])
+
+    @property
+    def data(self) -> LaneData:
+        return self._graph._data[self.index]
+
+    @property
+    def left(self) -> Optional['LaneGraphNode']:
+        return self._graph.node_at(self._graph._left[self.index])
+
+    @property
+    def right(self) -> Optional['LaneGraphNode']:
+        return self._graph.node_at(self._graph._right[self.index])
+
+    # the most natural continuation (same subtype, smallest heading change) comes first
+    @property
+    def successors(self) -> list['LaneGraphNode']:
+        return [LaneGraphNode(self._graph, i)
+                for i in self._graph._successor_indices_of(self.index)]
+
+    @property
+    def predecessors(self) -> list['LaneGraphNode']:
+        return [LaneGraphNode(self._graph, i)
+                for i in self._graph._predecessor_indices_of(self.index)]
+
+    @property
+    def successor(self) -> Optional['LaneGraphNode']:
+        return self._graph.node_at(self._graph._successor[self.index])
+
+    @property
+    def predecessor(self) -> Optional['LaneGraphNode']:
+        return self._graph.node_at(self._graph._predecessor[self.index])
+
+    def __eq__(self, other: object) -> bool:
+        return (isinstance(other, LaneGraphNode) and other._graph is self._graph
+                and other.index == self.index)
+
+    def __hash__(self) -> int:
+        return hash((id(self._graph), self.index))
 
     def __repr__(self) -> str:
         right = self.right.id if self.right is not None else None
         left = self.left.id if self.left is not None else None
-        pre = self.predecessor.id if self.predecessor is not None else None
-        succ = self.successor.id if self.successor is not None else None
+        pre = [node.id for node in self.predecessors]
+        succ = [node.id for node in self.successors]
         return (f"LaneGraphNode(id={self.id}, right={right}, left={left}"
-                f", predecessor={pre}, successor={succ})")
+                f", predecessors={pre}, successors={succ})")
 
 
 class MultipleNeighborsError(Exception):
@@ -48,223 +101,604 @@ class NeighboringLaneSignal(Generic[T]):
 
 
 class LaneGraph:
+    """
+    Topology of all lanes that allow for driving.
+
+    OSI lane ids are mapped to dense indices. Neighbors, successors and
+    predecessors (as CSR adjacency, since lanes may split and merge), lane
+    types and lengths are stored in numpy arrays over these indices.
+    """
     def __init__(self, lane_dict: dict[int, LaneData]):
-        self._nodes = {id: LaneGraphNode(id=id, data=data) for id, data
-                       in lane_dict.items() if data.lane_type.allows_for_driving()}
-        for id, lane in lane_dict.items():
-            if lane.lane_type.allows_for_driving():
-                self._add_lane_neighbours(id)
+        self._data: list[LaneData] = [data for data in lane_dict.values()
+                                      if data.lane_type.allows_for_driving()]
+        self._ids = np.array([id for id, data in lane_dict.items()
+                              if data.lane_type.allows_for_driving()], dtype=np.int64)
+        self._index: dict[int, int] = {id: i for i, id in enumerate(self._ids.tolist())}
+        n = len(self._data)
+        self._lane_type = np.array([data.lane_type.value for data in self._data], dtype=np.int8)
+        self._lane_subtype = np.array([data.lane_subtype.value for data in self._data],
+                                      dtype=np.int8)
+        self._lengths = np.array([data.centerline_total_distance for data in self._data],
+                                 dtype=np.float64)
+        self._start_points = np.full((n, 3), np.nan)
+        self._end_points = np.full((n, 3), np.nan)
+        for i, data in enumerate(self._data):
+            if data.centerline_len > 0:
+                self._start_points[i] = data.start_point()
+                self._end_points[i] = data.end_point()
+        # all centerlines packed into one array, lane i owns the points
+        # _centerline_indptr[i]:_centerline_indptr[i + 1]
+        self._centerline_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.array([data.centerline_len for data in self._data], dtype=np.int64),
+                  out=self._centerline_indptr[1:])
+        self._centerline_points = np.concatenate(
+            [data.centerline_matrix for data in self._data] + [np.empty((0, 3))])
+        self._centerline_s = np.concatenate(
+            [data.centerline_s for data in self._data] + [np.empty(0)])
+        # every centerline segment by its first point, segments never span two lanes
+        point_lanes = np.repeat(np.arange(n), np.diff(self._centerline_indptr))
+        is_segment_start = np.ones(len(self._centerline_points), dtype=bool)
+        is_segment_start[self._centerline_indptr[1:][np.diff(self._centerline_indptr) > 0] - 1] = False
+        self._segment_starts = np.flatnonzero(is_segment_start)
+        self._segment_lanes = point_lanes[self._segment_starts]
+        self._segment_grids: dict[float, SegmentGrid] = {}
+        self._compute_neighbours()
         self._compute_successors()
+        self._rightmost = self._compute_rightmost()
+        self._lane_count = self._compute_lane_count()
+        self._default_distance_tables = _DistanceTables(self, self._successor.__getitem__)
+        self._default_distance_tables.compute_all()
+        self._cached_route = lru_cache(maxsize=ROUTE_CACHE_SIZE)(self._find_route)
+        self._route_distance_tables = lru_cache(maxsize=ROUTE_CACHE_SIZE)(
+            self._compute_route_distance_tables)
 
     def __str__(self) -> str:
-        return str(self._nodes)
-
-    def _add_lane_neighbours(self, id: int):
-        node = self._nodes[id]
-        classification = node.data.osi_lane.classification
-        left_ids: Iterable[int] = (id.value for id
-                                   in classification.left_adjacent_lane_id)
-        for left_id in left_ids:
-            if left_id not in self._nodes:
-                continue
-            left_node = self._nodes[left_id]
-            if node.left is None:
-                node.left = left_node
-            elif node.left.id != left_id:
-                raise MultipleNeighborsError(id, "left")
-            if left_node.right is None:
-                left_node.right = node
-            elif left_node.right.id != id:
-                raise MultipleNeighborsError(left_id, "right")
-        right_ids: Iterable[int] = (id.value for id
-                                    in classification.right_adjacent_lane_id)
-        for right_id in right_ids:
-            if right_id not in self._nodes:
-                continue
-            right_node = self._nodes[right_id]
-            if node.right is None:
-                node.right = right_node
-            elif node.right.id != right_id:
-                raise MultipleNeighborsError(id, "right")
-            if right_node.left is None:
-                right_node.left = node
-            elif right_node.left.id != id:
-                raise MultipleNeighborsError(right_id, "left")
+        return str({node.id: node for node in self.iterate_nodes()})
+
+    def segment_grid(self, max_distance: float) -> SegmentGrid:
+        """
+        Spatial index over all centerline segments (see _segment_starts),
+        built on first use for every max_distance.
+        """
+        if max_distance not in self._segment_grids:
+            self._segment_grids[max_distance] = SegmentGrid(
+                self._centerline_points[self._segment_starts],
+                self._centerline_points[self._segment_starts + 1], max_distance)
+        return self._segment_grids[max_distance]
+
+    @property
+    def segment_lanes(self) -> np.ndarray:
+        """Dense lane index of every segment of segment_grid."""
+        return self._segment_lanes
+
+    @cached_property
+    def boundaries(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Left and right boundary lines of all lanes, packed like the
+        centerlines: (left indptr, left points, right indptr, right points).
+        """
+        packed = []
+        for matrices in ([data.left_boundary_matrix for data in self._data],
+                         [data.right_boundary_matrix for data in self._data]):
+            indptr = np.zeros(len(self._data) + 1, dtype=np.int64)
+            np.cumsum(np.array([len(matrix) for matrix in matrices], dtype=np.int64), out=indptr[1:])
+            packed += [indptr, np.concatenate(matrices + [np.empty((0, 3))])]
+        return tuple(packed)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    # Arrays over the dense lane indices (see index_of), they must not be modified.
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return self._lengths
+
+    @property
+    def lane_types(self) -> np.ndarray:  # LaneType values
+        return self._lane_type
+
+    @property
+    def lane_subtypes(self) -> np.ndarray:  # LaneSubtype values
+        return self._lane_subtype
+
+    @property
+    def lane_counts(self) -> np.ndarray:  # parallel lanes in the same driving direction
+        return self._lane_count
+
+    # neighbours and the most natural successor / predecessor, NO_LANE where there is none
+    @property
+    def left_lanes(self) -> np.ndarray:
+        return self._left
+
+    @property
+    def right_lanes(self) -> np.ndarray:
+        return self._right
+
+    @property
+    def successor_lanes(self) -> np.ndarray:
+        return self._successor
+
+    @property
+    def predecessor_lanes(self) -> np.ndarray:
+        return self._predecessor
+
+    @property
+    def centerline_indptr(self) -> np.ndarray:  # lane i owns centerline_points[indptr[i]:indptr[i + 1]]
+        return self._centerline_indptr
+
+    @property
+    def centerline_points(self) -> np.ndarray:
+        return self._centerline_points
+
+    @property
+    def centerline_s(self) -> np.ndarray:
+        return self._centerline_s
+
+    def index_of(self, lane_id: int) -> Optional[int]:
+        """Dense index of a lane, None if the lane is not in the graph."""
+        return self._index.get(lane_id)
+
+    def indices_of(self, lane_ids: Iterable[int]) -> np.ndarray:
+        """Dense indices of lanes, NO_LANE for lanes that are not in the graph."""
+        return np.array([self._index.get(lane_id, NO_LANE) for lane_id in lane_ids], dtype=np.int64)
+
+    def node_at(self, index: int) -> Optional[LaneGraphNode]:
+        return LaneGraphNode(self, int(index)) if index != NO_LANE else None
+
+    def node(self, lane_id: int) -> Optional[LaneGraphNode]:
+        index = self._index.get(lane_id)
+        return LaneGraphNode(self, index) if index is not None else None
+
+    def _compute_neighbours(self):
+        self._left = np.full(len(self._data), NO_LANE, dtype=np.int64)
+        self._right = np.full(len(self._data), NO_LANE, dtype=np.int64)
+        for i, data in enumerate(self._data):
+            classification = data.osi_lane.classification
+            for left_id in (id.value for id in classification.left_adjacent_lane_id):
+                self._link_neighbours(i, self._index.get(left_id), "left")
+            for right_id in (id.value for id in classification.right_adjacent_lane_id):
+                self._link_neighbours(i, self._index.get(right_id), "right")
+
+    def _link_neighbours(self, index: int, neighbour: Optional[int], side: str):
+        if neighbour is None:
+            return
+        if side == "left":
+            own_side, other_side, opposite = self._left, self._right, "right"
+        else:
+            own_side, other_side, opposite = self._right, self._left, "left"
+        if own_side[index] == NO_LANE:
+            own_side[index] = neighbour
+        elif own_side[index] != neighbour:
+            raise MultipleNeighborsError(int(self._ids[index]), side)
+        if other_side[neighbour] == NO_LANE:
+            other_side[neighbour] = index
+        elif other_side[neighbour] != index:
+            raise MultipleNeighborsError(int(self._ids[neighbour]), opposite)
 
     def _compute_successors(self):
-        for id, node in self._nodes.items():
-            end = node.data.end_point()
-            if end is None:
+        pairs: list[tuple[int, int]] = []
+        has_points, = np.nonzero(~np.isnan(self._start_points[:, 0]))
+        if len(has_points) > 0:
+            start_grid = PointGrid(self._start_points[has_points],
+                                   cell_size=SUCCESSOR_MAX_DISTANCE)
+            for pre in has_points.tolist():
+                for i in start_grid.query(self._end_points[pre], SUCCESSOR_MAX_DISTANCE):
+                    succ = int(has_points[i])
+                    if succ != pre:
+                        pairs.append((pre, succ))
+        pre_indices = np.array([pre for pre, _ in pairs], dtype=np.int64)
+        succ_indices = np.array([succ for _, succ in pairs], dtype=np.int64)
+        changes_subtype, angle = self._continuation_rank(pre_indices, succ_indices)
+        # np.lexsort is stable, equally ranked lanes keep the order they were found in
+        by_pre = np.lexsort((angle, changes_subtype, pre_indices))
+        self._successor_indptr, self._successor_indices = self._csr(
+            pre_indices[by_pre], succ_indices[by_pre])
+        by_succ = np.lexsort((angle, changes_subtype, succ_indices))
+        self._predecessor_indptr, self._predecessor_indices = self._csr(
+            succ_indices[by_succ], pre_indices[by_succ])
+        self._successor = self._first_of(self._successor_indptr, self._successor_indices)
+        self._predecessor = self._first_of(self._predecessor_indptr, self._predecessor_indices)
+
+    def _csr(self, rows: np.ndarray, columns: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        indptr = np.zeros(len(self._data) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self._data)), out=indptr[1:])
+        return indptr, columns
+
+    @staticmethod
+    def _first_of(indptr: np.ndarray, indices: np.ndarray) -> np.ndarray:
+        first = np.full(len(indptr) - 1, NO_LANE, dtype=np.int64)
+        non_empty = indptr[1:] > indptr[:-1]
+        first[non_empty] = indices[indptr[:-1][non_empty]]
+        return first
+
+    def _continuation_rank(self, pre: np.ndarray, succ: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        changes_subtype = self._lane_subtype[pre] != self._lane_subtype[succ]
+        angle = np.zeros(len(pre))
+        for k, (i, j) in enumerate(zip(pre.tolist(), succ.tolist())):
+            pre_line = self._data[i].centerline_matrix
+            succ_line = self._data[j].centerline_matrix
+            if len(pre_line) < 2 or len(succ_line) < 2:
                 continue
-            for other_id, other_node in self._nodes.items():
-                if id == other_id:
-                    continue
-                start = other_node.data.start_point()
-                if start is None:
-                    continue
-                if np.linalg.norm(start - end) <= SUCCESSOR_MAX_DISTANCE:
-                    self._add_successor(pre=node, succ=other_node)
-
-    def _add_successor(self, pre: LaneGraphNode, succ: LaneGraphNode):
-        if pre.successor is not None:
-            raise MultipleNeighborsError(pre.id, "successor")
-        if succ.predecessor is not None:
-            raise MultipleNeighborsError(succ.id, "predecessor")
-        pre.successor = succ
-        succ.predecessor = pre
+            pre_direction = pre_line[-1] - pre_line[-2]
+            succ_direction = succ_line[1] - succ_line[0]
+            cosine = np.dot(pre_direction, succ_direction) / (
+                np.linalg.norm(pre_direction) * np.linalg.norm(succ_direction))
+            angle[k] = np.arccos(np.clip(cosine, -1.0, 1.0))
+        return changes_subtype, angle
+
+    def _compute_rightmost(self) -> np.ndarray:
+        # pointer jumping: after k steps every lane points up to 2^k lanes to the right
+        rightmost = np.arange(len(self._data), dtype=np.int64)
+        for _ in range(max(1, len(self._data)).bit_length() + 1):
+            right = self._right[rightmost]
+            has_right = right != NO_LANE
+            if not has_right.any():
+                break
+            rightmost[has_right] = right[has_right]
+        return rightmost
+
+    def _compute_lane_count(self) -> np.ndarray:
+        # number of neighbouring lanes (including the lane itself) with the same driving direction
+        lane_count = np.zeros(len(self._data), dtype=np.int64)
+        for index in range(len(self._data)):
+            right = self._right[index]
+            if right != NO_LANE and self._are_parallel(right, index):
+                continue
+            lanes = [index]
+            while (self._left[lanes[-1]] != NO_LANE and len(lanes) <= len(self._data)
+                   and self._are_parallel(self._left[lanes[-1]], lanes[-1])):
+                lanes.append(int(self._left[lanes[-1]]))
+            lane_count[lanes] = len(lanes)
+        return lane_count
+
+    def _successor_indices_of(self, index: int) -> np.ndarray:
+        return self._successor_indices[self._successor_indptr[index]:self._successor_indptr[index + 1]]
+
+    def _predecessor_indices_of(self, index: int) -> np.ndarray:
+        return self._predecessor_indices[self._predecessor_indptr[index]:self._predecessor_indptr[index + 1]]
 
     def get_lane_data(self, id: int) -> Optional[LaneData]:
-        if id not in self._nodes:
+        if id not in self._index:
+            return None
+        return self._data[self._index[id]]
+
+    def _are_parallel(self, index1: int, index2: int) -> bool:
+        if np.isnan(self._start_points[index1, 0]) or np.isnan(self._start_points[index2, 0]):
+            return False
+        return self.are_parallel_lanes_in_same_direction(LaneGraphNode(self, index1),
+                                                         LaneGraphNode(self, index2))
+
+    def route(self, from_lane_id: int, to_lane_id: int) -> Optional[tuple[int, ...]]:
+        """
+        Shortest sequence of lane ids leading from the start of one lane to the
+        start of another lane by following successors. Returns None if the
+        target lane cannot be reached. Recent routes are cached.
+        """
+        return self._cached_route(from_lane_id, to_lane_id)
+
+    def _find_route(self, from_lane_id: int, to_lane_id: int) -> Optional[tuple[int, ...]]:
+        if from_lane_id not in self._index or to_lane_id not in self._index:
             return None
-        return self._nodes[id].data
-
-    def _distance_to_lane_end(self, node: LaneGraphNode, position: np.ndarray) -> float:
-        projection = node.data.project_onto_centerline(position)
-        distance = node.data.distance_to_end(projection)
-        while node.successor is not None:
-            node = node.successor
-            distance += node.data.centerline_total_distance
-        return distance
-
-    def distance_to_lane_end(self, lane_id: int, position: np.ndarray) -> NeighboringLaneSignal[float]:
-        node = self._nodes[lane_id]
+        start = self._index[from_lane_id]
+        goal = self._index[to_lane_id]
+        # A*: the straight line distance between lane starts never
+        # overestimates the distance driven along the lanes
+        heuristic = np.linalg.norm(self._start_points - self._start_points[goal], axis=1)
+        heuristic[np.isnan(heuristic)] = 0.0
+
+        tie_breaker = itertools.count()
+        distances: dict[int, float] = {start: 0.0}
+        came_from: dict[int, int] = {}
+        queue = [(heuristic[start], next(tie_breaker), start)]
+        while len(queue) > 0:
+            _, _, index = heapq.heappop(queue)
+            if index == goal:
+                route = [index]
+                while route[-1] in came_from:
+                    route.append(came_from[route[-1]])
+                return tuple(int(self._ids[i]) for i in reversed(route))
+            distance = distances[index] + self._lengths[index]
+            for succ in self._successor_indices_of(index).tolist():
+                if distance < distances.get(succ, float("inf")):
+                    distances[succ] = distance
+                    came_from[succ] = index
+                    heapq.heappush(queue, (distance + heuristic[succ], next(tie_breaker), succ))
+        return None
+
+    def _compute_route_distance_tables(self, route: tuple[int, ...]) -> '_DistanceTables':
+        route_successors = {self._index[pre]: self._index[succ]
+                            for pre, succ in zip(route, route[1:])
+                            if pre in self._index and succ in self._index}
+        return _DistanceTables(
+            self, lambda index: route_successors.get(index, self._successor[index]))
+
+    def _distance_tables(
+        self,
+        lane_id: int,
+        route: Optional[Sequence[int]],
+        target_lane_id: Optional[int],
+    ) -> '_DistanceTables':
+        if route is None and target_lane_id is not None:
+            route = self.route(lane_id, target_lane_id)
+        if route is None or len(route) < 2:
+            return self._default_distance_tables
+        return self._route_distance_tables(tuple(route))
+
+    def lanes_ahead(
+        self,
+        lane_id: int,
+        distance: float,
+        route: Optional[Sequence[int]] = None,
+        target_lane_id: Optional[int] = None,
+    ) -> np.ndarray:
+        """
+        Dense indices of the lanes that are driven along when following the
+        successors (or the route) for the given distance from the start of
+        the lane, beginning with the lane itself.
+        """
+        successor_of = self._distance_tables(lane_id, route, target_lane_id)._successor_of
+        index = self._index[lane_id]
+        indices = [index]
+        covered = self._lengths[index]
+        while covered < distance:
+            index = successor_of(index)
+            if index == NO_LANE or self._lengths[index] <= 0.0:
+                break
+            indices.append(int(index))
+            covered += self._lengths[index]
+        return np.array(indices, dtype=np.int64)
+
+    def _distance_to_lane_end(self, tables: '_DistanceTables', index: int,
+                              position: np.ndarray) -> float:
+        data = self._data[index]
+        projection = data.project_onto_centerline(position)
+        return data.distance_to_end(projection) + tables.lane_end(index)
+
+    # The distance queries follow the given route (sequence of lane ids) or the
+    # route to the given target lane. Beyond the route, and when neither is
+    # given, the most natural successor of each lane is followed.
+    def distance_to_lane_end(
+        self,
+        lane_id: int,
+        position: np.ndarray,
+        route: Optional[Sequence[int]] = None,
+        target_lane_id: Optional[int] = None,
+    ) -> NeighboringLaneSignal[float]:
+        index = self._index[lane_id]
+        tables = self._distance_tables(lane_id, route, target_lane_id)
         result = NeighboringLaneSignal(
-            current_lane=self._distance_to_lane_end(node, position),
+            current_lane=self._distance_to_lane_end(tables, index, position),
         )
-        if node.left is not None:
-            result.left_lane = self._distance_to_lane_end(node.left, position)
-        if node.right is not None:
-            result.right_lane = self._distance_to_lane_end(node.right, position)
+        if self._left[index] != NO_LANE:
+            result.left_lane = self._distance_to_lane_end(tables, self._left[index], position)
+        if self._right[index] != NO_LANE:
+            result.right_lane = self._distance_to_lane_end(tables, self._right[index], position)
         return result
 
     def _get_rightmost_lane(self, node: LaneGraphNode) -> LaneGraphNode:
-        while node.right is not None:
-            node = node.right
-        return node
-
-    def _next_lane_node(self, current_node: LaneGraphNode) -> Optional[LaneGraphNode]:
-        while current_node is not None:
-            if current_node.successor is not None:
-                return self._get_rightmost_lane(current_node.successor)
-            current_node = current_node.left
-        return None
-
-    def distance_to_next_exit(self, lane_id: int, position: np.ndarray) -> Optional[float]:
-        node = self._nodes[lane_id]
-        projection = node.data.project_onto_centerline(position)
-        distance = node.data.distance_to_end(projection)
-        node = self._get_rightmost_lane(node)
-        node = self._next_lane_node(node)
-        while node is not None and node.data.lane_subtype != LaneSubtype.EXIT:
-            distance += node.data.centerline_total_distance
-            node = self._next_lane_node(node)
-        return None if node is None else distance
-
-    def distance_to_ramp(self, lane_id: int, position: np.ndarray) -> NeighboringLaneSignal[Optional[float]]:
-        node_center = self._nodes[lane_id]
-        if node_center.data.lane_subtype in (LaneSubtype.OFFRAMP, LaneSubtype.CONNECTINGRAMP):
+        return LaneGraphNode(self, int(self._rightmost[node.index]))
+
+    def distance_to_next_exit(
+        self,
+        lane_id: int,
+        position: np.ndarray,
+        route: Optional[Sequence[int]] = None,
+        target_lane_id: Optional[int] = None,
+    ) -> Optional[float]:
+        index = self._index[lane_id]
+        distance = self._distance_tables(lane_id, route, target_lane_id).next_exit(index)
+        if np.isnan(distance):
+            return None
+        data = self._data[index]
+        projection = data.project_onto_centerline(position)
+        return data.distance_to_end(projection) + distance
+
+    def distance_to_ramp(
+        self,
+        lane_id: int,
+        position: np.ndarray,
+        route: Optional[Sequence[int]] = None,
+        target_lane_id: Optional[int] = None,
+    ) -> NeighboringLaneSignal[Optional[float]]:
+        index = self._index[lane_id]
+        data = self._data[index]
+        if data.lane_subtype in RAMP_SUBTYPES:
             return NeighboringLaneSignal(current_lane=None)
-        projection = node_center.data.project_onto_centerline(position)
-        initial_distance = node_center.data.distance_to_end(projection)
-        distances = NeighboringLaneSignal(initial_distance, None, None)
-        moved_left = False
-        moved_right = False
-        if node_center.left != None:
-            moved_left = True
-            if self.are_parallel_lanes_in_same_direction(node_center.left, node_center):
-                node_left = node_center.left
-                distances.left_lane = initial_distance
-            else:
-                node_left = None
-                distances.left_lane = None
-        else:
-            node_left = None
-            distances.left_lane = None
-
-        if node_center.right != None:
-            moved_right = True
-            node_right = node_center.right
-            distances.right_lane = initial_distance
-        else:
-            node_right = None
-            distances.right_lane = None
-        node_left = self.get_sucessor_if_not_beginn_of_entry(node_left)
-        if node_left == None:
-            distances.left_lane = None
-        node_right = self.get_sucessor_if_not_beginn_of_entry(node_right)
-        if node_right == None:
-            distances.right_lane = None
-        node_center = self.get_sucessor_if_not_beginn_of_entry(node_center)
-        if node_center == None:
-            distances.current_lane = None
-        while node_left != None or node_right != None or node_center != None:
-            if node_center != None:
-                if not moved_left and node_center.left != None:
-                    moved_left = True
-                    if self.are_parallel_lanes_in_same_direction(node_center.left, node_center):
-                        node_left = node_center.left
-                        distances.left_lane = distances.current_lane
-                    else:
-                        node_left = None
-                        distances.left_lane = None
-
-                if not moved_right and node_center.right != None:
-                    moved_right = True
-                    node_right = node_center.right
-                    distances.right_lane = distances.current_lane
-
-            if node_left != None:
-                if node_left.data.lane_subtype in (LaneSubtype.OFFRAMP, LaneSubtype.CONNECTINGRAMP):
-                    node_left = None
-                else:
-                    distances.left_lane += node_left.data.centerline_total_distance
-                    node_left = self.get_sucessor_if_not_beginn_of_entry(node_left)
-                    if node_left == None:
-                        distances.left_lane = None 
-
-            if node_right != None:
-                if node_right.data.lane_subtype in (LaneSubtype.OFFRAMP, LaneSubtype.CONNECTINGRAMP):
-                    node_right = None
-                else:
-                    distances.right_lane += node_right.data.centerline_total_distance
-                    node_right = self.get_sucessor_if_not_beginn_of_entry(node_right)
-                    if node_right == None:
-                        distances.right_lane = None 
-
-            if node_center != None:
-                if node_center.data.lane_subtype in (LaneSubtype.OFFRAMP, LaneSubtype.CONNECTINGRAMP):
-                    node_center = None
-                else:
-                    distances.current_lane += node_center.data.centerline_total_distance
-                    node_center = self.get_sucessor_if_not_beginn_of_entry(node_center)
-                    if node_center == None:
-                        distances.current_lane = None
-        return distances
+        table = self._distance_tables(lane_id, route, target_lane_id).ramp(index)
+        projection = data.project_onto_centerline(position)
+        initial_distance = data.distance_to_end(projection)
+        return NeighboringLaneSignal(*(
+            None if np.isnan(distance) else initial_distance + distance
+            for distance in table
+        ))
 
     def get_sucessor_if_not_beginn_of_entry(self, node: LaneGraphNode):
-        if node != None:
-            successor = node.successor
-            if node.data.lane_subtype != LaneSubtype.ENTRY and (successor == None or successor.data.lane_subtype == LaneSubtype.ENTRY):
-                node = None
-            else:
-                node = successor
-        return node
+        if node is None:
+            return None
+        return self.node_at(self._next_track_index(node.index, self._successor[node.index]))
 
+    def _next_track_index(self, index: int, successor: int) -> int:
+        # a track along the successors ends before an entry lane begins
+        if self._lane_subtype[index] != LaneSubtype.ENTRY.value and (
+                successor == NO_LANE or self._lane_subtype[successor] == LaneSubtype.ENTRY.value):
+            return NO_LANE
+        return successor
 
     def neighbor_lane_types(self, lane_id: int) -> NeighboringLaneSignal[tuple[LaneType, LaneSubtype]]:
-        node = self._nodes[lane_id]
+        node = self.node(lane_id)
         return NeighboringLaneSignal(
             current_lane=node.data.type_info(),
             left_lane=node.left.data.type_info() if node.left is not None else None,
             right_lane=node.right.data.type_info() if node.right is not None else None,
         )
-    
+
     def are_parallel_lanes_in_same_direction(self, node1: LaneGraphNode, node2: LaneGraphNode) -> bool:
         same_direction_distance = np.linalg.norm(node1.data.centerline_matrix[0] - node2.data.centerline_matrix[0])
-        same_direction_distance += np.linalg.norm(node1.data.centerline_matrix[-1] - node2.data.centerline_matrix[-1]) 
+        same_direction_distance += np.linalg.norm(node1.data.centerline_matrix[-1] - node2.data.centerline_matrix[-1])
         opposite_direction_distance = np.linalg.norm(node1.data.centerline_matrix[0] - node2.data.centerline_matrix[-1])
-        opposite_direction_distance += np.linalg.norm(node1.data.centerline_matrix[-1] - node2.data.centerline_matrix[0]) 
+        opposite_direction_distance += np.linalg.norm(node1.data.centerline_matrix[-1] - node2.data.centerline_matrix[0])
         return same_direction_distance < opposite_direction_distance
 
     def iterate_nodes(self) -> Iterable[LaneGraphNode]:
-        return self._nodes.values()
+        return (LaneGraphNode(self, i) for i in range(len(self._data)))
+
+
+class _ChainDistances:
+    # Distance from the start of a lane to the first target lane that is
+    # reached by repeatedly following next_index (NaN if none is reached).
+    # Results are memoized, so every lane is walked over at most once.
+    def __init__(
+        self,
+        graph: LaneGraph,
+        next_index: Callable[[int], int],
+        is_target: Callable[[int], bool],
+        target_distance: Callable[[int], float] = lambda index: 0.0,
+        dead_end: float = np.nan,
+        on_cycle: float = np.nan,
+    ):
+        self._lengths: list[float] = graph._lengths.tolist()
+        self._next_index = next_index
+        self._is_target = is_target
+        self._target_distance = target_distance
+        self._dead_end = dead_end
+        self._on_cycle = on_cycle
+        self._distances: dict[int, float] = {}
+
+    def __getitem__(self, start: int) -> float:
+        if start in self._distances:
+            return self._distances[start]
+        path: list[int] = []
+        on_path: set[int] = set()
+        index = start
+        while True:
+            if index in self._distances:
+                rest = self._distances[index]
+                break
+            if index in on_path:
+                rest = self._on_cycle
+                break
+            if self._is_target(index):
+                rest = self._target_distance(index)
+                self._distances[index] = rest
+                break
+            path.append(index)
+            on_path.add(index)
+            index = self._next_index(index)
+            if index == NO_LANE:
+                rest = self._dead_end
+                break
+        for index in reversed(path):
+            rest = rest + self._lengths[index]
+            self._distances[index] = rest
+        return self._distances[start]
+
+
+class _DistanceTables:
+    # Downstream distances from the end of each lane that only depend on the
+    # static lane topology and on which successor is taken at branches. Per
+    # object queries only add the remaining distance within the current lane.
+    # Unreachable targets are NaN.
+    def __init__(self, graph: LaneGraph, successor_of: Callable[[int], int]):
+        self._graph = graph
+        self._successor_of = successor_of
+        self._lane_end = _ChainDistances(
+            graph,
+            next_index=successor_of,
+            is_target=lambda index: False,
+            dead_end=0.0,
+            on_cycle=float("inf"),
+        )
+        self._exit = _ChainDistances(
+            graph,
+            next_index=self._next_lane_index,
+            is_target=lambda index: graph._lane_subtype[index] == LaneSubtype.EXIT.value,
+        )
+        self._ramp = _ChainDistances(
+            graph,
+            next_index=self._next_track_index,
+            is_target=self._is_ramp,
+        )
+        # The neighboring lanes are only tracked from the first lane on which
+        # a neighbor exists, starting with the distance driven up to there.
+        left, right = graph._left, graph._right
+        self._left_ramp = _ChainDistances(
+            graph,
+            next_index=self._next_track_index,
+            is_target=lambda index: left[index] != NO_LANE or self._is_ramp(index),
+            target_distance=lambda index: (
+                self._ramp[left[index]]
+                if left[index] != NO_LANE and graph._are_parallel(left[index], index)
+                else np.nan
+            ),
+        )
+        self._right_ramp = _ChainDistances(
+            graph,
+            next_index=self._next_track_index,
+            is_target=lambda index: right[index] != NO_LANE or self._is_ramp(index),
+            target_distance=lambda index: (
+                self._ramp[right[index]] if right[index] != NO_LANE else np.nan
+            ),
+        )
+        self._next_exit_distances: dict[int, float] = {}
+        self._ramp_distances: dict[int, tuple[float, float, float]] = {}
+
+    def compute_all(self):
+        for index in range(len(self._graph)):
+            self.lane_end(index)
+            self.next_exit(index)
+            self.ramp(index)
+
+    _RAMP_SUBTYPE_VALUES = tuple(subtype.value for subtype in RAMP_SUBTYPES)
+
+    def _is_ramp(self, index: int) -> bool:
+        return self._graph._lane_subtype[index] in self._RAMP_SUBTYPE_VALUES
+
+    def _next_track_index(self, index: int) -> int:
+        return self._graph._next_track_index(index, self._successor_of(index))
+
+    def _next_lane_index(self, index: int) -> int:
+        while index != NO_LANE:
+            successor = self._successor_of(index)
+            if successor != NO_LANE:
+                return int(self._graph._rightmost[successor])
+            index = self._graph._left[index]
+        return NO_LANE
+
+    def _after_lane(self, index: int, chain: _ChainDistances) -> float:
+        next_index = self._next_track_index(index)
+        return chain[next_index] if next_index != NO_LANE else np.nan
+
+    def lane_end(self, index: int) -> float:
+        return self._lane_end[index] - self._graph._lengths[index]
+
+    def next_exit(self, index: int) -> float:
+        if index not in self._next_exit_distances:
+            next_index = self._next_lane_index(int(self._graph._rightmost[index]))
+            self._next_exit_distances[index] = (self._exit[next_index]
+                                                if next_index != NO_LANE else np.nan)
+        return self._next_exit_distances[index]
+
+    def ramp(self, index: int) -> tuple[float, float, float]:
+        """Ramp distances for the current, left and right lane."""
+        if index not in self._ramp_distances:
+            self._ramp_distances[index] = self._compute_ramp(index)
+        return self._ramp_distances[index]
+
+    def _compute_ramp(self, index: int) -> tuple[float, float, float]:
+        left = self._graph._left[index]
+        right = self._graph._right[index]
+        if left == NO_LANE:
+            left_distance = self._after_lane(index, self._left_ramp)
+        elif self._graph._are_parallel(left, index):
+            left_distance = self._after_lane(left, self._ramp)
+        else:
+            left_distance = np.nan
+        if right == NO_LANE:
+            right_distance = self._after_lane(index, self._right_ramp)
+        else:
+            right_distance = self._after_lane(right, self._ramp)
+        return self._after_lane(index, self._ramp), left_distance, right_distance
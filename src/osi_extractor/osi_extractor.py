@@ -1,29 +1,56 @@
 import math
 import sys
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from os import environ
+from typing import Iterable, Optional, Union
 
 from osi3.osi_groundtruth_pb2 import GroundTruth
 
 import osi_extractor.signals as signals
+from .events import LaneEventDetector
+from .geometry import osi_vector_to_ndarray
+from .history import StateHistory
+from .horizon import HORIZON_DISTANCE, HORIZON_STEP, Horizon, compute_horizon
 from .lane import LaneData
 from .lanegraph import LaneGraph
 from .osi_iterator import UDPGroundTruthIterator
+from .region_of_interest import RegionOfInterest
 from .output.esmini_update import DriverInputUpdate, XYHSpeedSteeringUpdate
 from .output.esmini_output_sender import EsminiOutputSender
 from .road import RoadManager
-from .state import State
-from .state_builder import create_state
+from .state import ColumnarState, MovingObjectState, ProgressiveState, State
+from .state_builder import (IncrementalStateBuilder, create_columnar_state, create_multi_ego_states,
+                            create_progressive_state, create_state)
 
 class SynchronOSI3Extractor:
-    def __init__(self, rec_ip_addr: str, rec_port: int = 48198, ego_id: int = 0, esmini_ip_addr: str = None, esmini_port: int = None):
+    def __init__(self, rec_ip_addr: str, rec_port: int = 48198, ego_id: int = 0, esmini_ip_addr: str = None, esmini_port: int = None,
+                 road_state_fields: Iterable[str] = (), region_of_interest: Optional[RegionOfInterest] = None,
+                 movement_threshold: Optional[float] = None, history_length: Optional[int] = None,
+                 detect_lane_events: bool = False, ego_ids: Optional[Iterable[int]] = None):
         self.ground_truth_iterator = UDPGroundTruthIterator(rec_ip_addr, rec_port)
         self.ego_id = ego_id
+        # the vehicles get_next_states builds a State for
+        self.ego_ids = tuple(ego_ids) if ego_ids is not None else (ego_id,)
+        # RoadState fields computed for every object even if they are not read (see RoadState.FIELDS)
+        self.road_state_fields = tuple(road_state_fields)
+        # objects outside get no road context, None means every object is inside
+        self.region_of_interest = region_of_interest
+        # with a movement threshold, lane related road state is carried over between frames
+        self.incremental_state_builder = (
+            None if movement_threshold is None
+            else IncrementalStateBuilder(movement_threshold, self.road_state_fields, region_of_interest))
+        # samples of the last history_length states returned by get_next_state
+        self.history = StateHistory(history_length) if history_length is not None else None
+        # fills State.events of the states returned by get_next_state
+        self.lane_event_detector = LaneEventDetector() if detect_lane_events else None
         self.lane_data: dict[int, LaneData] = {}
         self.lane_graph = LaneGraph(self.lane_data)
         self.road_manager = RoadManager(self.lane_graph)
         self.signal_assignment_builder = signals.RoadAssignmentBuilder(self.lane_graph, self.road_manager)
         self._current_state: State = None
+        self._progressive_state: Optional[ProgressiveState] = None
+        self._progressive_executor: Optional[ThreadPoolExecutor] = None
         if environ.get('OUTPUT_FILE') is not None:
             raise NotImplementedError("Output to file is not implemented yet")
             # self.output = OsiTraceOutputSender(environ['OUTPUT_FILE'])
@@ -41,20 +68,66 @@ class SynchronOSI3Extractor:
 
     def __exit__(self, exc_type, *args) -> bool:
         self.ground_truth_iterator.close()
+        if self._progressive_executor is not None:
+            if self._progressive_state is not None:
+                self._progressive_state.cancel_remaining()
+            self._progressive_executor.shutdown()
         if self.output is not None:
             self.output.close()
         return exc_type is None
 
-    def get_next_state(self) -> State:
+    def _next_ground_truth(self) -> GroundTruth:
         ground_truth = self._ground_truth_iter.__next__()
         if len(ground_truth.lane) != 0:
             self.update_lane_data(ground_truth)
         self.host_vehicle_id = ground_truth.host_vehicle_id.value
-        state = create_state(ground_truth, self.lane_graph,
-                                           self.road_manager, self.ego_id)
+        return ground_truth
+
+    def get_next_state(self) -> State:
+        ground_truth = self._next_ground_truth()
+        if self.incremental_state_builder is not None:
+            state = self.incremental_state_builder.create_state(ground_truth, self.lane_graph,
+                                                                self.road_manager, self.ego_id)
+        else:
+            state = create_state(ground_truth, self.lane_graph,
+                                               self.road_manager, self.ego_id, self.road_state_fields,
+                                               self.region_of_interest)
+        if self.history is not None:
+            self.history.record(state, ground_truth.timestamp.seconds + ground_truth.timestamp.nanos * 1e-9)
+        if self.lane_event_detector is not None:
+            state.events = self.lane_event_detector.update(state)
         vehicle = state.moving_objects[0]
         return state
 
+    def get_next_states(self) -> dict[int, State]:
+        """
+        One State per id in ego_ids, built from one parse and one set of
+        moving object states (see create_multi_ego_states).
+        """
+        ground_truth = self._next_ground_truth()
+        return create_multi_ego_states(ground_truth, self.lane_graph, self.road_manager, self.ego_ids,
+                                       self.road_state_fields, self.region_of_interest)
+
+    def get_next_progressive_state(self) -> ProgressiveState:
+        """
+        State with only the ego vehicle built, the other objects follow on a
+        background thread or on request. The background work of the previous
+        progressive state is stopped.
+        """
+        ground_truth = self._next_ground_truth()
+        if self._progressive_state is not None:
+            self._progressive_state.cancel_remaining()
+        if self._progressive_executor is None:
+            self._progressive_executor = ThreadPoolExecutor(max_workers=1)
+        self._progressive_state = create_progressive_state(
+            ground_truth, self.lane_graph, self.road_manager, self.ego_id, self.road_state_fields,
+            self.region_of_interest, self._progressive_executor)
+        return self._progressive_state
+
+    def get_next_columnar_state(self) -> ColumnarState:
+        ground_truth = self._next_ground_truth()
+        return create_columnar_state(ground_truth, self.lane_graph, self.road_manager, self.ego_id)
+
     def update_lane_data(self, gt: GroundTruth):
         for lane in gt.lane:
             id: int = lane.id.value
@@ -66,6 +139,14 @@ class SynchronOSI3Extractor:
             self.road_manager,
         )
         self.signal_assignment_builder.assign_signs_to_roads(gt)
+        self.signal_assignment_builder.assign_traffic_lights_to_roads(gt)
+
+    def get_horizon(self, moving_object: MovingObjectState, distance: float = HORIZON_DISTANCE,
+                    step: float = HORIZON_STEP) -> Optional[Horizon]:
+        if moving_object.road_state is None:
+            return None
+        return compute_horizon(self.lane_graph, self.road_manager, moving_object.lane_ids[0],
+                               osi_vector_to_ndarray(moving_object.location), distance, step)
 
     def send_driver_update(self, driver_input_update: DriverInputUpdate):
         if self.output is None:
@@ -77,6 +158,11 @@ class SynchronOSI3Extractor:
             raise RuntimeError("No output sender defined")
         self.output.send_xyh_speed_steering_update(xyh_speed_steering_update)
 
+    def send_updates(self, updates: Iterable[Union[DriverInputUpdate, XYHSpeedSteeringUpdate]]):
+        if self.output is None:
+            raise RuntimeError("No output sender defined")
+        self.output.send_updates(updates)
+
     def send_empty_update(self, object_id: int):
         if self.output is None:
             raise RuntimeError("No output sender defined") 
@@ -85,8 +171,13 @@ class SynchronOSI3Extractor:
 
 class AsynchronOSI3Extractor(SynchronOSI3Extractor):
 
-    def __init__(self, ip_addr: str, port: int = 48198, ego_id: int = 0, esmini_ip_addr: str = None, esmini_port: int = None):
-        super(AsynchronOSI3Extractor, self).__init__(ip_addr, port, ego_id, esmini_ip_addr, esmini_port)
+    def __init__(self, ip_addr: str, port: int = 48198, ego_id: int = 0, esmini_ip_addr: str = None, esmini_port: int = None,
+                 road_state_fields: Iterable[str] = (), region_of_interest: Optional[RegionOfInterest] = None,
+                 movement_threshold: Optional[float] = None, history_length: Optional[int] = None,
+                 detect_lane_events: bool = False, ego_ids: Optional[Iterable[int]] = None):
+        super(AsynchronOSI3Extractor, self).__init__(ip_addr, port, ego_id, esmini_ip_addr, esmini_port,
+                                                     road_state_fields, region_of_interest, movement_threshold,
+                                                     history_length, detect_lane_events, ego_ids)
         self._current_state: State = None
         self.thread = threading.Thread(target=self._thread_target)
 
@@ -17,6 +17,45 @@ from osi3.osi_groundtruth_pb2 import GroundTruth
 # - this describes the length of the actual payload
 #   - seemingly, this is 8192 for everything but the last datagram
 
+class GroundTruthReassembler:
+    """
+    Joins the datagrams of one sender into messages as described above.
+    feed returns the message bytes once the last datagram of a message
+    arrived, None otherwise. A datagram out of sequence discards the
+    message collected so far.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._expected_slice_id = 1
+        self._slices: list[bytes] = []
+
+    def feed(self, udp_package: bytes) -> Optional[bytes]:
+        slice_id: int = int.from_bytes(udp_package[0:4], byteorder='little', signed=True)
+        last_slice = (slice_id == -self._expected_slice_id)
+        slice_id = abs(slice_id)
+        if slice_id != self._expected_slice_id:
+            print("throwing away current groundtruth bytes")
+            print("received slice id:" + str(slice_id) +
+                  "  expected:" + str(self._expected_slice_id))
+            self.reset()
+            return None
+        slice_length: int = int.from_bytes(udp_package[4:8], byteorder='little', signed=True)
+        if slice_length + 8 != len(udp_package):
+            print("throwing away current groundtruth bytes")
+            print("length field does not conform with udp length")
+            self.reset()
+            return None
+        self._slices.append(udp_package[8:])
+        if last_slice:
+            message_bytes = b"".join(self._slices)
+            self.reset()
+            return message_bytes
+        self._expected_slice_id += 1
+        return None
+
+
 class OSI3GroundTruthIterator(abc.ABC):
 
     @abc.abstractmethod
@@ -46,40 +85,21 @@ class UDPGroundTruthIterator(OSI3GroundTruthIterator):
         os.close(self.pipe_write)
 
     def __iter__(self) -> Iterator[GroundTruth]:
+        reassembler = GroundTruthReassembler()
         while True:
-            expected_slice_id: int = 1
-            message_bytes = b""
-            while True:
-                ready, _, _ = select.select(
-                    [self.socket, self.pipe_read], [], [])
-                if self.pipe_read in ready:
-                    os.close(self.pipe_read)
-                    self.socket.close()
-                    return
-                elif self.socket not in ready:
-                    continue
-                udp_package = self.read()
-                slice_id: int = self.parse_int(udp_package[0:4])
-                last_slice = (slice_id == -expected_slice_id)
-                slice_id = abs(slice_id)
-                if slice_id == expected_slice_id:
-                    slice_length: int = self.parse_int(udp_package[4:8])
-                    if slice_length + 8 != len(udp_package):
-                        print("throwing away current groundtruth bytes")
-                        print("length field does not conform with udp length")
-                        break
-                    message_bytes += udp_package[8:]
-                else:
-                    print("throwing away current groundtruth bytes")
-                    print("received slice id:" + str(slice_id) +
-                          "  expected:" + str(expected_slice_id))
-                    break
-                if last_slice:
-                    message = GroundTruth()
-                    message.ParseFromString(message_bytes)
-                    yield message
-                    break
-                expected_slice_id += 1
+            ready, _, _ = select.select(
+                [self.socket, self.pipe_read], [], [])
+            if self.pipe_read in ready:
+                os.close(self.pipe_read)
+                self.socket.close()
+                return
+            elif self.socket not in ready:
+                continue
+            message_bytes = reassembler.feed(self.read())
+            if message_bytes is not None:
+                message = GroundTruth()
+                message.ParseFromString(message_bytes)
+                yield message
 
 
 class FileGroundTruthIterator(OSI3GroundTruthIterator):
@@ -2,6 +2,7 @@
 
 import socket
 import struct
+from typing import Optional
 
 from .esmini_update import DriverInputUpdate, XYHSpeedSteeringUpdate
 from .output_sender import OutputSender
@@ -13,35 +14,57 @@ input_modes = {
     'stateXYH': 3,
 }
 
+EMPTY_MESSAGE = struct.Struct('ii')  # version, message type = 'NO_INPUT'
+DRIVER_INPUT_MESSAGE = struct.Struct('iiiiddd')  # version, message type, object ID, frame, throttle, brake, steer
+# version, message type, object ID, frame, x, y, h, speed, steering wheel angle, dead reckon
+XYH_SPEED_STEERING_MESSAGE = struct.Struct('iiiidddddB')
+
 
 class EsminiOutputSender(OutputSender):
     def __init__(self, address: str, baseport: int):
-        self.frame_nrs = None
+        self.frame_nrs: Optional[dict[int, int]] = None  # by object id
         self.address = address
         self.baseport = baseport
+        self.socket: Optional[socket.socket] = None
+        # (ip, port) by object id, the address is resolved once in open so sendto does not look it up
+        self.destinations: dict[int, tuple[str, int]] = {}
+        self._ip: Optional[str] = None
+        self._buffer = bytearray(max(EMPTY_MESSAGE.size, DRIVER_INPUT_MESSAGE.size, XYH_SPEED_STEERING_MESSAGE.size))
+        self._empty_message = memoryview(self._buffer)[:EMPTY_MESSAGE.size]
+        self._driver_input_message = memoryview(self._buffer)[:DRIVER_INPUT_MESSAGE.size]
+        self._xyh_speed_steering_message = memoryview(self._buffer)[:XYH_SPEED_STEERING_MESSAGE.size]
 
     def open(self):
+        # one unconnected socket for all objects: an unreachable esmini port
+        # does not make later sends fail and the number of fds stays fixed
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._ip = socket.gethostbyname(self.address)
+        self.destinations = {}
         self.frame_nrs = {}
 
     def close(self):
         if self.socket is not None:
             self.socket.close()
-    
+            self.socket = None
+
+    def _destination(self, object_id: int) -> tuple[str, int]:
+        destination = self.destinations.get(object_id)
+        if destination is None:
+            destination = (self._ip, self.baseport + object_id)
+            self.destinations[object_id] = destination
+        return destination
+
     def send_empty_update(self, object_id: int):
         # This function can be used, to trigger the next timestep in esmini, without sending payload
-        message = struct.pack(
-            'ii',
-            1,    # version
-            0,    # message type = 'NO_INPUT'
-        )
-        self.socket.sendto(
-            message, (self.address, self.baseport + object_id))
+        destination = self._destination(object_id)
+        EMPTY_MESSAGE.pack_into(self._buffer, 0, 1, 0)
+        self.socket.sendto(self._empty_message, destination)
 
     def send_driver_input_update(self, driver_input_update: DriverInputUpdate):
+        destination = self._destination(driver_input_update.id)
         frame_nr = self.frame_nrs.get(driver_input_update.id, 0)
-        message = struct.pack(
-            'iiiiddd',
+        DRIVER_INPUT_MESSAGE.pack_into(
+            self._buffer, 0,
             1,    # version
             1,    # message type = 'driverInput'
             driver_input_update.id,    # object ID
@@ -50,14 +73,14 @@ class EsminiOutputSender(OutputSender):
             driver_input_update.brake,
             driver_input_update.steer
         )
-        self.socket.sendto(
-            message, (self.address, self.baseport + driver_input_update.id))
+        self.socket.sendto(self._driver_input_message, destination)
         self.frame_nrs[driver_input_update.id] = frame_nr + 1
 
     def send_xyh_speed_steering_update(self, xyh_speed_steering_update: XYHSpeedSteeringUpdate):
+        destination = self._destination(xyh_speed_steering_update.id)
         frame_nr = self.frame_nrs.get(xyh_speed_steering_update.id, 0)
-        message = struct.pack(
-            'iiiidddddB',
+        XYH_SPEED_STEERING_MESSAGE.pack_into(
+            self._buffer, 0,
             1,    # version
             input_modes["stateXYH"],
             xyh_speed_steering_update.id,    # object ID
@@ -69,7 +92,5 @@ class EsminiOutputSender(OutputSender):
             xyh_speed_steering_update.steering_wheel_angle,
             1 if xyh_speed_steering_update.dead_reckon else 0
         )
-        self.socket.sendto(
-            message, (self.address, self.baseport + xyh_speed_steering_update.id))
+        self.socket.sendto(self._xyh_speed_steering_message, destination)
         self.frame_nrs[xyh_speed_steering_update.id] = frame_nr + 1
-
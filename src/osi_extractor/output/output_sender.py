@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from typing import Iterable, Union
 
 from .esmini_update import DriverInputUpdate, XYHSpeedSteeringUpdate
 
@@ -13,3 +14,10 @@ class OutputSender(ABC):
     @abstractmethod
     def send_xyh_speed_steering_update(self, xyh_speed_steering_update: XYHSpeedSteeringUpdate):
         pass
+
+    def send_updates(self, updates: Iterable[Union[DriverInputUpdate, XYHSpeedSteeringUpdate]]):
+        for update in updates:
+            if isinstance(update, XYHSpeedSteeringUpdate):
+                self.send_xyh_speed_steering_update(update)
+            else:
+                self.send_driver_input_update(update)
@@ -0,0 +1,50 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from osi3.osi_object_pb2 import MovingObject
+
+from .deprecated_handler import get_all_assigned_lane_ids
+from .lanegraph import NO_LANE, LaneGraph
+from .road import NO_ROAD, RoadManager
+
+
+@dataclass(frozen=True)
+class RegionOfInterest:
+    """
+    Objects that get full road context in create_state, all other objects
+    only get their kinematic fields. Every criterion that is set narrows
+    the region, the ego vehicle is always part of it.
+    """
+    max_distance: Optional[float] = None  # to the ego vehicle, in the x/y plane
+    same_road_as_ego: bool = False
+    k_nearest: Optional[int] = None  # applied after the other criteria
+
+    def select(self, ego: MovingObject, others: list[MovingObject], lane_graph: LaneGraph,
+               road_manager: RoadManager) -> np.ndarray:
+        """Boolean mask over others, True for the objects inside the region."""
+        inside = np.ones(len(others), dtype=bool)
+        if self.max_distance is None and not self.same_road_as_ego and self.k_nearest is None:
+            return inside
+        positions = np.array([(o.base.position.x, o.base.position.y) for o in others]).reshape(-1, 2)
+        distances = np.hypot(*(positions - (ego.base.position.x, ego.base.position.y)).T)
+        if self.max_distance is not None:
+            inside &= distances <= self.max_distance
+        if self.same_road_as_ego:
+            ego_road_id, = _road_ids([ego], lane_graph, road_manager)
+            inside &= (_road_ids(others, lane_graph, road_manager) == ego_road_id) & (ego_road_id != NO_ROAD)
+        if self.k_nearest is not None:
+            candidates = np.flatnonzero(inside)
+            if len(candidates) > self.k_nearest:
+                nearest = np.argpartition(distances[candidates], self.k_nearest)[:self.k_nearest] \
+                    if self.k_nearest > 0 else []
+                inside[:] = False
+                inside[candidates[nearest]] = True
+        return inside
+
+
+def _road_ids(objects: list[MovingObject], lane_graph: LaneGraph, road_manager: RoadManager) -> np.ndarray:
+    # road of the first assigned lane of every object, NO_ROAD if there is none
+    lanes = lane_graph.indices_of(lane_ids[0] if len(lane_ids) > 0 else NO_LANE
+                                  for lane_ids in map(get_all_assigned_lane_ids, objects))
+    return np.where(lanes != NO_LANE, road_manager.lane_road_ids[lanes], NO_ROAD)
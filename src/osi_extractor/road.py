@@ -1,13 +1,21 @@
+import bisect
+import heapq
 from dataclasses import dataclass
-from typing import Optional
+from functools import cached_property
+from typing import TYPE_CHECKING, Optional, Union
 
 import numpy as np
 import osi3.osi_lane_pb2 as lane_pb2
 
 from osi3.osi_trafficsign_pb2 import TrafficSign
+from .geometry import closest_projected_points
 from .lane import LaneSubtype
 
-from .lanegraph import LaneGraph, LaneGraphNode
+from .lanegraph import NO_LANE, LaneGraph, LaneGraphNode
+from .traffic_lights import TrafficLightStates
+
+if TYPE_CHECKING:
+    from .speedlimit_logic import SpeedLimitTable
 
 SUBTYPE_ENTRY = lane_pb2._LANE_CLASSIFICATION_SUBTYPE.values_by_name["SUBTYPE_ENTRY"].number
 SUBTYPE_EXIT = lane_pb2._LANE_CLASSIFICATION_SUBTYPE.values_by_name["SUBTYPE_EXIT"].number
@@ -18,6 +26,32 @@ SUBTYPE_OFFRAMP = lane_pb2._LANE_CLASSIFICATION_SUBTYPE.values_by_name[
 SUBTYPE_CONNECTINGRAMP = lane_pb2._LANE_CLASSIFICATION_SUBTYPE.values_by_name[
     "SUBTYPE_CONNECTINGRAMP"].number
 
+NO_ROAD = -1
+# points farther away from every lane centerline have no road coordinates
+FRENET_MAX_DISTANCE = 10.0
+
+
+@dataclass
+class FrenetCoordinates:
+    """
+    Road coordinates of a batch of points, one entry per point.
+    """
+    road_id: np.ndarray  # NO_ROAD if the point is not close to any lane
+    lane_id: np.ndarray  # the lane with the closest centerline
+    s: np.ndarray  # distance along the road
+    t: np.ndarray  # lateral offset from the road reference line, positive to the left
+    heading: np.ndarray  # yaw of the road reference line at s
+
+
+@dataclass(frozen=True)
+class StationaryLocation:
+    road_id: int  # NO_ROAD if the object is not close to any lane
+    lane_id: int  # the lane with the closest centerline, NO_LANE if there is none
+    s: float
+    t: float
+    lane_distance: float  # from the centerline of lane_id
+    lane_width: float  # at the closest centerline point
+
 
 @dataclass(frozen=True)
 class RoadSignal:
@@ -27,41 +61,94 @@ class RoadSignal:
     osi_signal: TrafficSign
 
 
+@dataclass(frozen=True)
+class RoadTrafficLight:
+    road_id: int
+    road_s: tuple[float, float]
+    closest_lane: LaneGraphNode
+    traffic_light_id: int
+    slot: int  # in RoadManager.traffic_light_states
+
+
 class Road:
     road_id: int
     _rightmost_lanes: list[LaneGraphNode]
     _rightmost_lanes_lengths: np.ndarray
+    _rightmost_lanes_offsets: np.ndarray  # s at the start of each rightmost lane (and at the road end)
     _total_distance: float
+    _road_manager: 'RoadManager'
     on_highway: bool
     signals: list[RoadSignal]
+    # compiled from signals by speedlimit_logic, keyed by ignore_exit_speed_signs
+    speed_limit_tables: dict[bool, 'SpeedLimitTable']
+    traffic_lights: list[RoadTrafficLight]
+    # the traffic lights of lanes with / against the road direction and their road s, sorted by road s
+    _directed_traffic_lights: dict[bool, tuple[list[RoadTrafficLight], list[float]]]
 
     def __init__(self):
         self.signals = []
+        self.speed_limit_tables = {}
+        self.traffic_lights = []
+        self._directed_traffic_lights = {False: ([], []), True: ([], [])}
 
-    def _get_rightmost_roadlane(self, lane: LaneGraphNode) -> LaneGraphNode:
-        current_lane = lane
-        while current_lane not in self._rightmost_lanes:
-            current_lane = current_lane.right
-            if current_lane is None:
-                raise Exception(
-                    f"Lane with id:{lane.id} seems to be not part of road with id: {self.road_id}")
-        return current_lane
+    @property
+    def total_distance(self) -> float:
+        return self._total_distance
+
+    def _road_position(self, lane: LaneGraphNode) -> int:
+        if self._road_manager.get_road(lane) is not self:
+            raise Exception(
+                f"Lane with id:{lane.id} seems to be not part of road with id: {self.road_id}")
+        return int(self._road_manager._lane_road_position[lane.index])
 
     def object_road_s(self, lane: LaneGraphNode, position: np.ndarray) -> tuple[float, float]:
-        rightmost_lane: LaneGraphNode = self._get_rightmost_roadlane(lane)
-        index = self._rightmost_lanes.index(rightmost_lane)
+        index = self._road_position(lane)
+        rightmost_lane = self._rightmost_lanes[index]
         projection = rightmost_lane.data.project_onto_centerline(position)
-        distance = np.sum(self._rightmost_lanes_lengths[:index + 1]).item()
+        distance = float(self._rightmost_lanes_offsets[index + 1])
         distance -= rightmost_lane.data.distance_to_end(projection)
         return distance, self._total_distance
 
+    def index_traffic_lights(self):
+        """
+        Sort traffic_lights by road s for next_traffic_light. Must be called
+        again whenever traffic_lights changes.
+        """
+        self.traffic_lights.sort(key=lambda light: light.road_s[0])
+        self._directed_traffic_lights = {False: ([], []), True: ([], [])}
+        for light in self.traffic_lights:
+            lights, light_s = self._directed_traffic_lights[
+                bool(self._road_manager._lane_against_road[light.closest_lane.index])]
+            lights.append(light)
+            light_s.append(light.road_s[0])
+
+    def next_traffic_light(self, lane: LaneGraphNode, road_s: float) \
+            -> tuple[Optional[RoadTrafficLight], Optional[float]]:
+        """
+        The next traffic light ahead of road_s for traffic on lane and the
+        distance to it. Only lights of lanes with the same driving direction
+        (along or against the road s) are considered.
+        """
+        against_road = bool(self._road_manager._lane_against_road[lane.index])
+        lights, light_s = self._directed_traffic_lights[against_road]
+        if against_road:
+            i = bisect.bisect_right(light_s, road_s) - 1
+            if i < 0:
+                return None, None
+            return lights[i], road_s - light_s[i]
+        i = bisect.bisect_left(light_s, road_s)
+        if i == len(lights):
+            return None, None
+        return lights[i], light_s[i] - road_s
+
     def calculate_s_of_exit_end(self, exit_lane: LaneGraphNode) -> Optional[float]:
         if exit_lane.data.lane_subtype != LaneSubtype.EXIT:
             return None
-        if exit_lane not in self._rightmost_lanes:
+        if (self._road_manager.get_road(exit_lane) is not self
+                or self._road_manager._lane_rightmost[exit_lane.index] != exit_lane.index):
             return None
-        index = self._rightmost_lanes.index(exit_lane)
-        result = np.sum(self._rightmost_lanes_lengths[:index]).item()
+        index = self._road_position(exit_lane)
+        result = float(self._rightmost_lanes_offsets[index])
         current_lane = exit_lane
         while current_lane.data.lane_subtype == LaneSubtype.EXIT:
             result += current_lane.data.centerline_total_distance
@@ -73,74 +160,170 @@ class Road:
 
 
 class RoadManager:
-    lane_id_to_road_map: dict[int, Road] = {}
+    roads: list[Road]
+    traffic_light_states: TrafficLightStates
 
     def __init__(self, lane_graph: LaneGraph) -> None:
+        self.roads = []
+        self._lane_graph = lane_graph
+        # for every lane (by dense lane index): its road, the rightmost lane
+        # of its lane section, the position of that lane along the road and
+        # the road s at the start of that lane section
+        self._lane_road: list[Optional[Road]] = [None] * len(lane_graph)
+        self._lane_road_id = np.full(len(lane_graph), NO_ROAD, dtype=np.int64)
+        self._lane_rightmost = np.full(len(lane_graph), NO_LANE, dtype=np.int64)
+        self._lane_road_position = np.full(len(lane_graph), -1, dtype=np.int64)
+        self._lane_section_s = np.full(len(lane_graph), np.nan)
         self._create_roads(lane_graph)
+        # by road id, fixed once the roads are built
+        self.road_lengths = np.array([road._total_distance for road in self.roads], dtype=np.float64)
+        self.road_on_highway = np.array([road.on_highway for road in self.roads], dtype=bool)
+        # lanes whose driving direction is opposite to the rightmost lane of their section
+        directions = lane_graph._end_points - lane_graph._start_points
+        self._lane_against_road = np.einsum(
+            "ij,ij->i", directions, directions[np.maximum(self._lane_rightmost, 0)]) < 0
+        self.traffic_light_states = TrafficLightStates([])
+        # by stationary object id: the position it was located at and the result
+        self._stationary_locations: dict[int, tuple[tuple[float, float, float], StationaryLocation]] = {}
+
+    @staticmethod
+    def _lane_sections(lane_graph: LaneGraph) -> list[list[int]]:
+        """
+        Group the lanes into sections: maximal chains of left/right neighbours
+        with the same lane type, each listed from its rightmost lane to the left.
+        Sections are ordered by the index of their rightmost lane, rings of
+        neighbours (without a rightmost lane) come last.
+        """
+        lane_types = lane_graph.lane_types.tolist()
+        left = lane_graph._left.tolist()
+        right = lane_graph._right.tolist()
+        in_section = [False] * len(lane_graph)
+        sections = []
+
+        def add_section(rightmost: int):
+            lanes = []
+            lane = rightmost
+            while lane != NO_LANE and not in_section[lane] and lane_types[lane] == lane_types[rightmost]:
+                in_section[lane] = True
+                lanes.append(lane)
+                lane = left[lane]
+            sections.append(lanes)
+
+        for index in range(len(lane_graph)):
+            if right[index] == NO_LANE or lane_types[right[index]] != lane_types[index]:
+                add_section(index)
+        # lanes in a ring of neighbours have no rightmost lane
+        for index in range(len(lane_graph)):
+            if not in_section[index]:
+                add_section(index)
+        return sections
+
+    def _create_roads(self, lane_graph: LaneGraph):
+        sections = self._lane_sections(lane_graph)
+        section_of = [0] * len(lane_graph)
+        for section, lanes in enumerate(sections):
+            for lane in lanes:
+                section_of[lane] = section
+        classifications = [data.osi_lane.classification for data in lane_graph._data]
+        successor_indptr = lane_graph._successor_indptr.tolist()
+        successor_indices = lane_graph._successor_indices.tolist()
+        predecessor_indptr = lane_graph._predecessor_indptr.tolist()
+        predecessor_indices = lane_graph._predecessor_indices.tolist()
+
+        # continuations: the sections a road may continue into, in order of
+        # preference (lanes from right to left, successors in graph order).
+        # pending: the number of other sections a section continues from; a
+        # section can only begin a road once all of them have been assigned.
+        continuations: list[list[int]] = []
+        dependents: list[list[int]] = [[] for _ in sections]
+        pending = []
+        for section, lanes in enumerate(sections):
+            successors = []
+            predecessors = set()
+            for lane in lanes:
+                for successor in successor_indices[successor_indptr[lane]:successor_indptr[lane + 1]]:
+                    if section_of[successor] != section and self._are_successing_lanes_same_road(
+                            classifications[lane], classifications[successor]):
+                        successors.append(section_of[successor])
+                for predecessor in predecessor_indices[predecessor_indptr[lane]:predecessor_indptr[lane + 1]]:
+                    if self._are_successing_lanes_same_road(
+                            classifications[predecessor], classifications[lane]):
+                        predecessors.add(section_of[predecessor])
+            continuations.append(successors)
+            for predecessor in predecessors:
+                dependents[predecessor].append(section)
+            pending.append(len(predecessors))
+
+        # Roads are started in sweeps over the sections in lane order. A
+        # section that becomes a beginning while a sweep is still before it is
+        # started in the same sweep, otherwise in the next one. Sections that
+        # never become a beginning (roads closing on themselves) are started
+        # at their first section once nothing else is left.
+        assigned = [False] * len(sections)
+        current_sweep = [section for section in range(len(sections)) if pending[section] == 0]
+        next_sweep: list[int] = []
+        first_unassigned = 0
+        while True:
+            if current_sweep:
+                start = heapq.heappop(current_sweep)
+                if assigned[start]:
+                    continue
+            elif next_sweep:
+                current_sweep, next_sweep = next_sweep, []
+                heapq.heapify(current_sweep)
+                continue
+            else:
+                while first_unassigned < len(sections) and assigned[first_unassigned]:
+                    first_unassigned += 1
+                if first_unassigned == len(sections):
+                    break
+                start = first_unassigned
+            road_sections = self._create_new_road_starting_with(
+                lane_graph, sections, continuations, assigned, start)
+            for section in road_sections:
+                for dependent in dependents[section]:
+                    pending[dependent] -= 1
+                    if pending[dependent] == 0 and not assigned[dependent]:
+                        if dependent > start:
+                            heapq.heappush(current_sweep, dependent)
+                        else:
+                            next_sweep.append(dependent)
 
-    def _get_next_mostright_lane(self, old_level_lane: LaneGraphNode) -> Optional[LaneGraphNode]:
-        current_old_level_lane = old_level_lane
-        while current_old_level_lane is not None:
-            successor = self._same_road_successor(current_old_level_lane)
-            if successor is not None:
-                current_new_level_lane = successor
-                while True:
-                    next_new_level_lane = self._same_road_right_neighbor(
-                        current_new_level_lane)
-                    if next_new_level_lane is None:
-                        return current_new_level_lane
-                    current_new_level_lane = next_new_level_lane
-            current_old_level_lane = self._same_road_left_neighbor(
-                current_old_level_lane)
-        return None
-
-    def _add_all_parallel_lanes_to_road(self, rightmost_lane: LaneGraphNode, road: Road):
-        lane = rightmost_lane
-        while lane is not None:
-            if lane.id in self.lane_id_to_road_map:
-                return
-            self.lane_id_to_road_map[lane.id] = road
-            lane = self._same_road_left_neighbor(lane)
-
-    def _create_new_road_starting_with(self, lane: LaneGraphNode, road_id: int):
+    def _create_new_road_starting_with(self, lane_graph: LaneGraph, sections: list[list[int]],
+                                       continuations: list[list[int]], assigned: list[bool],
+                                       section: int) -> list[int]:
         new_road = Road()
+        new_road._road_manager = self
         new_road.on_highway = False
-        new_road.road_id = road_id
+        new_road.road_id = len(self.roads)
         new_road._rightmost_lanes = []
-        new_road._total_distance = 0.0
-        current_lane = lane
-        while current_lane is not None:
-            if current_lane.data.lane_subtype in (LaneSubtype.ENTRY, LaneSubtype.EXIT):
+        road_sections = []
+        road_lanes = []
+        while section is not None:
+            assigned[section] = True
+            road_sections.append(section)
+            lanes = sections[section]
+            rightmost_lane = lane_graph.node_at(lanes[0])
+            if rightmost_lane.data.lane_subtype in (LaneSubtype.ENTRY, LaneSubtype.EXIT):
                 new_road.on_highway = True
-            self._add_all_parallel_lanes_to_road(current_lane, new_road)
-            new_road._rightmost_lanes.append(current_lane)
-            current_lane = self._get_next_mostright_lane(current_lane)
-        temp_length = []
-        for lane in new_road._rightmost_lanes:
-            temp_length.append(lane.data.centerline_total_distance)
-        new_road._rightmost_lanes_lengths = np.array(temp_length)
-        new_road._total_distance = np.sum(new_road._rightmost_lanes_lengths)
-
-    def _same_road_right_neighbor(self, lane: LaneGraphNode) -> Optional[LaneGraphNode]:
-        road_independent_neighbor = lane.right
-        if road_independent_neighbor is None:
-            return None
-        elif road_independent_neighbor.data.osi_lane.classification.type != lane.data.osi_lane.classification.type:
-            return None
-        elif road_independent_neighbor.id in self.lane_id_to_road_map:
-            return None
-        return road_independent_neighbor
-
-    def _same_road_left_neighbor(self, lane: LaneGraphNode) -> Optional[LaneGraphNode]:
-        road_independent_neighbor = lane.left
-        if road_independent_neighbor is None:
-            return None
-        elif road_independent_neighbor.data.osi_lane.classification.type != lane.data.osi_lane.classification.type:
-            return None
-        elif road_independent_neighbor.id in self.lane_id_to_road_map and lane.id not in self.lane_id_to_road_map:
-            raise Exception("This should not happen, since roads are created from right to left")
-            #return None
-        return road_independent_neighbor
+            for lane in lanes:
+                self._lane_road[lane] = new_road
+            road_lanes.extend(lanes)
+            self._lane_rightmost[lanes] = lanes[0]
+            self._lane_road_position[lanes] = len(new_road._rightmost_lanes)
+            new_road._rightmost_lanes.append(rightmost_lane)
+            section = next((successor for successor in continuations[section]
+                            if not assigned[successor]), None)
+        new_road._rightmost_lanes_lengths = lane_graph.lengths[
+            [lane.index for lane in new_road._rightmost_lanes]]
+        new_road._rightmost_lanes_offsets = np.zeros(len(new_road._rightmost_lanes) + 1)
+        np.cumsum(new_road._rightmost_lanes_lengths, out=new_road._rightmost_lanes_offsets[1:])
+        new_road._total_distance = new_road._rightmost_lanes_offsets[-1]
+        self._lane_road_id[road_lanes] = new_road.road_id
+        self._lane_section_s[road_lanes] = new_road._rightmost_lanes_offsets[
+            self._lane_road_position[road_lanes]]
+        self.roads.append(new_road)
+        return road_sections
 
     @staticmethod
     def _are_successing_lanes_same_road(predecessor, successor) -> bool:
@@ -169,55 +352,163 @@ class RoadManager:
             return True
         return False
 
-    def _same_road_successor(self, lane: LaneGraphNode) -> Optional[LaneGraphNode]:
-        road_independent_successor = lane.successor
-        if road_independent_successor is None:
-            return None
-        if road_independent_successor.id in self.lane_id_to_road_map:
-            return None
-        if self._are_successing_lanes_same_road(lane.data.osi_lane.classification,
-                                                road_independent_successor.data.osi_lane.classification):
-            return road_independent_successor
-        else:
-            return None
+    @property
+    def lane_road_ids(self) -> np.ndarray:
+        """Road id of every lane by dense lane index, NO_ROAD for lanes without a road."""
+        return self._lane_road_id
 
-    def _same_road_predecessor(self, lane: LaneGraphNode) -> Optional[LaneGraphNode]:
-        road_independent_predecessor = lane.predecessor
-        if road_independent_predecessor is None:
-            return None
-        elif road_independent_predecessor.id in self.lane_id_to_road_map:
-            return None
-        elif self._are_successing_lanes_same_road(road_independent_predecessor.data.osi_lane.classification,
-                                                lane.data.osi_lane.classification):
-            return road_independent_predecessor
-        else:
-            return None
+    @property
+    def lane_against_road(self) -> np.ndarray:
+        """Whether a lane (by dense lane index) runs against the direction of its road."""
+        return self._lane_against_road
 
-    def _is_rightmost_beginning_lane(self, lane: LaneGraphNode) -> bool:
-        if self._same_road_right_neighbor(lane) is not None:
-            return False
-        current_lane = lane
-        while current_lane is not None:
-            if self._same_road_predecessor(current_lane) is not None:
-                return False
-            current_lane = self._same_road_left_neighbor(current_lane)
-        return True
+    def get_road(self, lane: LaneGraphNode) -> Optional[Road]:
+        return self._lane_road[lane.index]
 
-    def _create_roads(self, lane_graph: LaneGraph):
-        last_next_road_id = -1
-        next_road_id = 0
-        while next_road_id != last_next_road_id:
-            last_next_road_id = next_road_id
-            for lane_id, lane in lane_graph._nodes.items():
-                if lane.id in self.lane_id_to_road_map:
-                    continue
-                if self._is_rightmost_beginning_lane(lane):
-                    self._create_new_road_starting_with(lane, next_road_id)
-                    next_road_id += 1
+    def project_onto_sections(self, lanes: np.ndarray, points: np.ndarray) \
+            -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Batched Road.object_road_s: point i is projected onto the rightmost
+        lane of the section of lane index lanes[i]. Returns the road s, the
+        index of the first centerline point of the segment projected onto
+        (-1 if that lane has no segments) and the segment progress.
+        """
+        graph = self._lane_graph
+        rightmost = self._lane_rightmost[lanes]
+        vertex, progress = closest_projected_points(
+            points, graph.centerline_points,
+            graph.centerline_indptr[rightmost], graph.centerline_indptr[rightmost + 1])
+        segment_s = graph.centerline_s[vertex]
+        segment_length = graph.centerline_s[vertex + 1] - segment_s
+        road_s = np.where(vertex >= 0, self._lane_section_s[lanes] + segment_s + progress * segment_length,
+                          np.nan)
+        return road_s, vertex, progress
 
+    def to_frenet(self, points: np.ndarray) -> FrenetCoordinates:
+        """
+        Road coordinates of a batch of points (shape (n, 3)).
 
-    def get_road(self, lane: LaneGraphNode) -> Optional[Road]:
-        if lane.id in self.lane_id_to_road_map:
-            return self.lane_id_to_road_map[lane.id]
-        else:
-            return None
+        Every point is assigned to the lane with the closest centerline and
+        then projected onto the reference line of that lane's road section
+        (the centerline of its rightmost lane), exactly like
+        Road.object_road_s. Points farther than FRENET_MAX_DISTANCE from
+        every centerline get road id NO_ROAD.
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        graph = self._lane_graph
+        nearest_segment, _ = graph.segment_grid(FRENET_MAX_DISTANCE).nearest(points)
+        matched = np.flatnonzero(nearest_segment >= 0)
+        lanes = graph._segment_lanes[nearest_segment[matched]]
+        road_s, vertex, progress = self.project_onto_sections(lanes, points[matched])
+        projected = vertex >= 0
+        matched, lanes, road_s, vertex, progress = (matched[projected], lanes[projected], road_s[projected],
+                                                    vertex[projected], progress[projected])
+
+        start = graph.centerline_points[vertex]
+        v = graph.centerline_points[vertex + 1] - start
+        offset = points[matched] - start - np.expand_dims(progress, axis=-1) * v
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.nan_to_num((v[:, 0] * offset[:, 1] - v[:, 1] * offset[:, 0])
+                              / np.hypot(v[:, 0], v[:, 1]))
+
+        result = FrenetCoordinates(
+            road_id=np.full(len(points), NO_ROAD, dtype=np.int64),
+            lane_id=np.full(len(points), NO_LANE, dtype=np.int64),
+            s=np.full(len(points), np.nan),
+            t=np.full(len(points), np.nan),
+            heading=np.full(len(points), np.nan),
+        )
+        result.road_id[matched] = self._lane_road_id[lanes]
+        result.lane_id[matched] = graph.ids[lanes]
+        result.s[matched] = road_s
+        result.t[matched] = t
+        result.heading[matched] = np.arctan2(v[:, 1], v[:, 0])
+        return result
+
+    @cached_property
+    def _reference_lines(self) -> list[tuple[np.ndarray, np.ndarray]]:
+        # per road: the concatenated centerlines of its rightmost lanes and the road s of their points
+        graph = self._lane_graph
+        reference_lines = []
+        for road in self.roads:
+            ranges = [np.arange(graph.centerline_indptr[lane.index],
+                                graph.centerline_indptr[lane.index + 1])
+                      for lane in road._rightmost_lanes]
+            offsets = [np.full(len(r), offset) for r, offset in
+                       zip(ranges, road._rightmost_lanes_offsets)]
+            vertices = np.concatenate(ranges + [np.empty(0, dtype=np.int64)])
+            reference_lines.append((graph.centerline_points[vertices],
+                                    np.concatenate(offsets + [np.empty(0)])
+                                    + graph.centerline_s[vertices]))
+        return reference_lines
+
+    def locate_stationary_objects(self, ids: list[int], positions: np.ndarray) -> list[StationaryLocation]:
+        """
+        Road coordinates (see to_frenet) of stationary objects. Results are
+        kept per object id and only recomputed when the object moved, ids
+        that are not passed are forgotten.
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        keys = [tuple(position) for position in positions.tolist()]
+        cached = self._stationary_locations
+        missing = [i for i, (id, key) in enumerate(zip(ids, keys))
+                   if id not in cached or cached[id][0] != key]
+        if len(missing) > 0:
+            graph = self._lane_graph
+            points = positions[missing]
+            frenet = self.to_frenet(points)
+            lanes = graph.indices_of(frenet.lane_id.tolist())
+            lane_distance = np.full(len(missing), np.nan)
+            lane_width = np.full(len(missing), np.nan)
+            found = np.flatnonzero(lanes != NO_LANE)
+            vertex, progress = closest_projected_points(
+                points[found], graph.centerline_points,
+                graph.centerline_indptr[lanes[found]], graph.centerline_indptr[lanes[found] + 1])
+            start = graph.centerline_points[vertex]
+            projected = start + progress[:, np.newaxis] * (graph.centerline_points[vertex + 1] - start)
+            lane_distance[found] = np.linalg.norm(points[found] - projected, axis=1)
+            for i, lane, point in zip(found.tolist(), lanes[found].tolist(), vertex.tolist()):
+                lane_width[i] = graph.node_at(lane).data.centerline_widths[point - graph.centerline_indptr[lane]]
+            for i, row in enumerate(missing):
+                cached[ids[row]] = (keys[row], StationaryLocation(
+                    int(frenet.road_id[i]), int(frenet.lane_id[i]), float(frenet.s[i]), float(frenet.t[i]),
+                    float(lane_distance[i]), float(lane_width[i])))
+        if len(cached) > len(ids):
+            current = set(ids)
+            for id in [id for id in cached if id not in current]:
+                del cached[id]
+        return [cached[id][1] for id in ids]
+
+    def from_frenet(self, road_id: Union[int, np.ndarray], s: np.ndarray, t: np.ndarray) -> np.ndarray:
+        """
+        Inverse of to_frenet: the points (shape (n, 3)) at road coordinates
+        s/t of the given road(s). Points with an unknown road id or with s
+        outside of the road are NaN.
+        """
+        s, t = np.broadcast_arrays(np.asarray(s, dtype=np.float64), np.asarray(t, dtype=np.float64))
+        s = np.atleast_1d(s)
+        t = np.atleast_1d(t)
+        road_id = np.broadcast_to(np.asarray(road_id, dtype=np.int64), s.shape)
+        points = np.full((len(s), 3), np.nan)
+        for road in np.unique(road_id).tolist():
+            if not 0 <= road < len(self.roads):
+                continue
+            reference_points, reference_s = self._reference_lines[road]
+            if len(reference_points) < 2:
+                continue
+            selected = np.flatnonzero((road_id == road) & (s >= 0)
+                                      & (s <= self.roads[road]._total_distance))
+            # the segment starting at the last point with reference s <= s
+            # (zero length segments between consecutive lanes are skipped)
+            segment = np.clip(np.searchsorted(reference_s, s[selected], side="right") - 1,
+                              0, len(reference_s) - 2)
+            start = reference_points[segment]
+            v = reference_points[segment + 1] - start
+            segment_length = reference_s[segment + 1] - reference_s[segment]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                progress = np.nan_to_num((s[selected] - reference_s[segment]) / segment_length)
+                left = np.nan_to_num(np.stack([-v[:, 1], v[:, 0], np.zeros(len(v))], axis=1)
+                                     / np.hypot(v[:, 0], v[:, 1])[:, np.newaxis])
+            points[selected] = (start + progress[:, np.newaxis] * v
+                                + t[selected][:, np.newaxis] * left)
+        return points
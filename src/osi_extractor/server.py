@@ -0,0 +1,235 @@
+import hashlib
+import os
+import selectors
+import socket
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Optional
+
+from osi3.osi_groundtruth_pb2 import GroundTruth
+
+import osi_extractor.signals as signals
+from .lane import LaneData
+from .lanegraph import LaneGraph
+from .osi_iterator import GroundTruthReassembler
+from .region_of_interest import RegionOfInterest
+from .road import RoadManager
+from .state import State
+from .state_builder import create_state
+
+MAX_DATAGRAM_SIZE = 2**14
+
+
+class SharedMap:
+    """Lane data and lane graph of one map, shared by all simulations driving on it."""
+    def __init__(self, fingerprint: bytes, lane_fingerprints: dict[int, bytes], lane_data: dict[int, LaneData]):
+        self.fingerprint = fingerprint
+        self.lane_fingerprints = lane_fingerprints
+        self.lane_data = lane_data
+        self.lane_graph = LaneGraph(lane_data)
+
+
+class MapCache:
+    """
+    Maps by fingerprint, a hash over every lane and its boundaries. A map is
+    kept as long as a simulation uses it.
+    """
+    def __init__(self):
+        self._maps: weakref.WeakValueDictionary[bytes, SharedMap] = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._maps)
+
+    def get(self, gt: GroundTruth, previous: Optional[SharedMap] = None) -> SharedMap:
+        """
+        The map of previous with the lanes of gt added or replaced, as
+        SynchronOSI3Extractor.update_lane_data does.
+        """
+        lane_fingerprints = dict(previous.lane_fingerprints) if previous is not None else {}
+        lane_fingerprints.update(_lane_fingerprints(gt))
+        fingerprint = hashlib.blake2b(b"".join(
+            lane_id.to_bytes(8, byteorder='little', signed=True) + lane_fingerprint
+            for lane_id, lane_fingerprint in sorted(lane_fingerprints.items()))).digest()
+        with self._lock:
+            shared_map = self._maps.get(fingerprint)
+            if shared_map is None:
+                lane_data = dict(previous.lane_data) if previous is not None else {}
+                for lane in gt.lane:
+                    id: int = lane.id.value
+                    if previous is None or previous.lane_fingerprints.get(id) != lane_fingerprints[id]:
+                        lane_data[id] = LaneData(gt, lane)
+                shared_map = SharedMap(fingerprint, lane_fingerprints, lane_data)
+                self._maps[fingerprint] = shared_map
+            return shared_map
+
+
+def _lane_fingerprints(gt: GroundTruth) -> dict[int, bytes]:
+    boundaries = {boundary.id.value: boundary for boundary in gt.lane_boundary}
+    fingerprints = {}
+    for lane in gt.lane:
+        digest = hashlib.blake2b(lane.SerializeToString(deterministic=True))
+        for id in list(lane.classification.left_lane_boundary_id) + list(lane.classification.right_lane_boundary_id):
+            boundary = boundaries.get(id.value)
+            if boundary is not None:
+                digest.update(boundary.SerializeToString(deterministic=True))
+        fingerprints[lane.id.value] = digest.digest()
+    return fingerprints
+
+
+class Simulation:
+    """
+    Everything the server keeps per receive port. Ground truths are built
+    one at a time in arrival order; while a state is being built only the
+    newest complete message is kept, older ones are dropped.
+    """
+    def __init__(self, port: int, ego_id: int):
+        self.port = port
+        self.ego_id = ego_id
+        self.socket: Optional[socket.socket] = None
+        self.reassembler = GroundTruthReassembler()
+        self.map: Optional[SharedMap] = None
+        self.road_manager: Optional[RoadManager] = None
+        self.latest_state: Optional[State] = None
+        self.states_built = 0
+        self.dropped_messages = 0
+        self.last_error: Optional[Exception] = None
+        self._building: Optional[Future] = None
+        self._queued: Optional[bytes] = None
+        self._lock = threading.Lock()
+
+    def update_map(self, gt: GroundTruth, map_cache: MapCache):
+        self.map = map_cache.get(gt, self.map)
+        # the road manager holds the traffic light states of this simulation, so it is not shared
+        self.road_manager = RoadManager(self.map.lane_graph)
+        signal_assignment_builder = signals.RoadAssignmentBuilder(self.map.lane_graph, self.road_manager)
+        signal_assignment_builder.assign_signs_to_roads(gt)
+        signal_assignment_builder.assign_traffic_lights_to_roads(gt)
+
+
+class ExtractorServer:
+    """
+    One selector loop receiving the ground truth of many simulations, one
+    UDP port each (egos_by_port maps the ports to the ego vehicle ids).
+    Datagrams are reassembled on the loop thread, parsing and state building
+    run on a thread pool. Simulations on the same map share lane data and
+    lane graph through a MapCache.
+
+    on_state is called on a worker thread with the port and the new state.
+    """
+    def __init__(self, bind_address: str, egos_by_port: dict[int, int], max_workers: Optional[int] = None,
+                 road_state_fields: Iterable[str] = (), region_of_interest: Optional[RegionOfInterest] = None,
+                 on_state: Optional[Callable[[int, State], None]] = None):
+        self.bind_address = bind_address
+        self.simulations: dict[int, Simulation] = {
+            port: Simulation(port, ego_id) for port, ego_id in egos_by_port.items()}
+        self.max_workers = max_workers
+        self.road_state_fields = tuple(road_state_fields)
+        self.region_of_interest = region_of_interest
+        self.on_state = on_state
+        self.map_cache = MapCache()
+        # created by open
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.pipe_read: Optional[int] = None
+        self.pipe_write: Optional[int] = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, *args) -> bool:
+        self.close()
+        return exc_type is None
+
+    def open(self):
+        self._selector = selectors.DefaultSelector()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.pipe_read, self.pipe_write = os.pipe()
+        self._selector.register(self.pipe_read, selectors.EVENT_READ)
+        for simulation in self.simulations.values():
+            simulation.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            simulation.socket.bind((self.bind_address, simulation.port))
+            simulation.socket.setblocking(False)
+            self._selector.register(simulation.socket, selectors.EVENT_READ, simulation)
+
+    def close(self):
+        """Release what open created, also after a failed open or a second close."""
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+        for simulation in self.simulations.values():
+            if simulation.socket is not None:
+                simulation.socket.close()
+                simulation.socket = None
+        if self.pipe_read is not None:
+            os.close(self.pipe_read)
+            os.close(self.pipe_write)
+            self.pipe_read = self.pipe_write = None
+
+    def stop(self):
+        """Make serve return, can be called from any thread."""
+        os.write(self.pipe_write, b"\0")
+
+    def serve(self):
+        while self.poll(None):
+            pass
+
+    def poll(self, timeout: Optional[float] = 0) -> bool:
+        """One round of the selector loop, False once stop was called."""
+        for key, _ in self._selector.select(timeout):
+            if key.data is None:
+                os.read(self.pipe_read, 1)
+                return False
+            self._receive(key.data)
+        return True
+
+    def state(self, port: int) -> Optional[State]:
+        return self.simulations[port].latest_state
+
+    def _receive(self, simulation: Simulation):
+        while True:
+            try:
+                udp_package = simulation.socket.recv(MAX_DATAGRAM_SIZE)
+            except BlockingIOError:
+                return
+            message_bytes = simulation.reassembler.feed(udp_package)
+            if message_bytes is not None:
+                self._schedule(simulation, message_bytes)
+
+    def _schedule(self, simulation: Simulation, message_bytes: bytes):
+        with simulation._lock:
+            if simulation._building is not None:
+                if simulation._queued is not None:
+                    simulation.dropped_messages += 1
+                simulation._queued = message_bytes
+                return
+            simulation._building = self._executor.submit(self._build, simulation, message_bytes)
+
+    def _build(self, simulation: Simulation, message_bytes: bytes):
+        while message_bytes is not None:
+            try:
+                ground_truth = GroundTruth()
+                ground_truth.ParseFromString(message_bytes)
+                if len(ground_truth.lane) != 0:
+                    simulation.update_map(ground_truth, self.map_cache)
+                if simulation.map is None:
+                    raise RuntimeError(f"No map received on port {simulation.port} yet")
+                state = create_state(ground_truth, simulation.map.lane_graph, simulation.road_manager,
+                                     simulation.ego_id, self.road_state_fields, self.region_of_interest)
+                simulation.latest_state = state
+                simulation.states_built += 1
+                if self.on_state is not None:
+                    self.on_state(simulation.port, state)
+            except Exception as error:
+                simulation.last_error = error
+                print(f"WARNING: Could not build state for port {simulation.port}: {error}")
+            with simulation._lock:
+                message_bytes = simulation._queued
+                simulation._queued = None
+                if message_bytes is None:
+                    simulation._building = None
@@ -0,0 +1,190 @@
+from multiprocessing import parent_process, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+
+import numpy as np
+
+from .state import MOVING_OBJECT_DTYPE, ColumnarState
+
+DEFAULT_CAPACITY = 256  # moving objects per frame
+DEFAULT_SLOT_COUNT = 4
+MAX_READ_ATTEMPTS = 1000
+ALIGNMENT = 64
+
+# shared memory created by writers of this process, see SharedStateReader
+_written_names: set[str] = set()
+
+HEADER_DTYPE = np.dtype([
+    ("slot_count", np.int64),
+    ("capacity", np.int64),
+    ("row_size", np.int64),  # MOVING_OBJECT_DTYPE.itemsize of the writer
+    ("latest_frame", np.int64),  # 0 until the first frame is published
+])
+SLOT_HEADER_DTYPE = np.dtype([
+    ("sequence", np.int64),  # odd while the slot is written
+    ("frame", np.int64),
+    ("object_count", np.int64),
+    ("host_vehicle_id", np.int64),
+])
+
+
+def _aligned(size: int) -> int:
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+class _Layout:
+    """
+    Views on a shared memory block: one header, then slot_count slots of a
+    slot header and capacity rows of MOVING_OBJECT_DTYPE each.
+    """
+    def __init__(self, buffer: memoryview, slot_count: int, capacity: int):
+        self.slot_count = slot_count
+        self.capacity = capacity
+        self.header = np.ndarray((), HEADER_DTYPE, buffer, 0)
+        slot_size = _aligned(SLOT_HEADER_DTYPE.itemsize + capacity * MOVING_OBJECT_DTYPE.itemsize)
+        offsets = [_aligned(HEADER_DTYPE.itemsize) + slot * slot_size for slot in range(slot_count)]
+        self.slot_headers = [np.ndarray((), SLOT_HEADER_DTYPE, buffer, offset) for offset in offsets]
+        self.slot_objects = [np.ndarray((capacity,), MOVING_OBJECT_DTYPE, buffer, offset + SLOT_HEADER_DTYPE.itemsize)
+                             for offset in offsets]
+        # the same rows as bytes, copying them is about 10 times faster than copying the structured rows
+        self.slot_bytes = [objects.view(np.uint8) for objects in self.slot_objects]
+
+    @staticmethod
+    def size(slot_count: int, capacity: int) -> int:
+        return (_aligned(HEADER_DTYPE.itemsize)
+                + slot_count * _aligned(SLOT_HEADER_DTYPE.itemsize + capacity * MOVING_OBJECT_DTYPE.itemsize))
+
+
+class SharedStateWriter:
+    """
+    Publishes ColumnarStates into a ring of slots in shared memory for
+    readers in other processes (see SharedStateReader). Every slot is
+    guarded by a sequence counter that is odd while the slot is written,
+    so readers detect a frame that changed under them. Publishing never
+    waits for readers and costs the same for any number of them.
+
+    Only the moving objects and the host vehicle id are published. The
+    sequence counters rely on stores becoming visible in program order,
+    as on x86.
+    """
+    def __init__(self, name: Optional[str] = None, capacity: int = DEFAULT_CAPACITY,
+                 slot_count: int = DEFAULT_SLOT_COUNT):
+        if slot_count < 2:
+            raise ValueError("A ring needs at least 2 slots")
+        self._memory = SharedMemory(name, create=True, size=_Layout.size(slot_count, capacity))
+        _written_names.add(self._memory.name)
+        self._layout = _Layout(self._memory.buf, slot_count, capacity)
+        self._layout.header["slot_count"] = slot_count
+        self._layout.header["capacity"] = capacity
+        self._layout.header["row_size"] = MOVING_OBJECT_DTYPE.itemsize
+        self._layout.header["latest_frame"] = 0
+        self.frame = 0
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args) -> bool:
+        self.close()
+        return exc_type is None
+
+    def publish(self, state: ColumnarState) -> int:
+        """Write state into the next slot and return its frame number."""
+        object_count = len(state.objects)
+        if object_count > self._layout.capacity:
+            raise ValueError(f"{object_count} moving objects do not fit into a capacity of {self._layout.capacity}")
+        frame = self.frame + 1
+        slot = frame % self._layout.slot_count
+        slot_header = self._layout.slot_headers[slot]
+        sequence = int(slot_header["sequence"])
+        slot_header["sequence"] = sequence + 1
+        self._layout.slot_bytes[slot][:object_count * MOVING_OBJECT_DTYPE.itemsize] = np.ascontiguousarray(
+            state.objects, dtype=MOVING_OBJECT_DTYPE).view(np.uint8)
+        slot_header["frame"] = frame
+        slot_header["object_count"] = object_count
+        slot_header["host_vehicle_id"] = state.host_vehicle_id
+        slot_header["sequence"] = sequence + 2
+        self._layout.header["latest_frame"] = frame
+        self.frame = frame
+        return frame
+
+    def close(self):
+        self._layout = None
+        self._memory.close()
+        self._memory.unlink()
+        _written_names.discard(self._memory.name)
+
+
+class SharedStateReader:
+    """
+    Reads the latest frame of a SharedStateWriter by name.
+
+    latest(copy=True) copies the objects out of the slot and retries until
+    the copy is untorn. latest(copy=False) returns a view into the shared
+    memory without copying; the writer reuses the slot after slot_count - 1
+    further frames, check still_valid() after using such a view. Views
+    must be dropped before close.
+    """
+    def __init__(self, name: str):
+        try:
+            self._memory = SharedMemory(name, track=False)
+        except TypeError:
+            # before Python 3.13 attaching registers the block, so the
+            # resource tracker of an unrelated process would unlink it when
+            # that process exits. The writer's process and its children
+            # share one tracker, there the registration is the writer's.
+            self._memory = SharedMemory(name)
+            if parent_process() is None and self._memory.name not in _written_names:
+                resource_tracker.unregister(self._memory._name, "shared_memory")
+        header = np.ndarray((), HEADER_DTYPE, self._memory.buf, 0)
+        if int(header["row_size"]) != MOVING_OBJECT_DTYPE.itemsize:
+            raise RuntimeError(f"Shared state {name} was written with a different object layout")
+        self._layout = _Layout(self._memory.buf, int(header["slot_count"]), int(header["capacity"]))
+        self.frame = 0  # frame of the last latest() call
+        self._slot = 0
+        self._sequence = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args) -> bool:
+        self.close()
+        return exc_type is None
+
+    @property
+    def latest_frame(self) -> int:
+        return int(self._layout.header["latest_frame"])
+
+    def latest(self, copy: bool = True) -> Optional[ColumnarState]:
+        """The latest published frame, None if nothing was published yet."""
+        for _ in range(MAX_READ_ATTEMPTS):
+            frame = self.latest_frame
+            if frame == 0:
+                return None
+            slot = frame % self._layout.slot_count
+            slot_header = self._layout.slot_headers[slot]
+            sequence = int(slot_header["sequence"])
+            if sequence % 2 == 1 or int(slot_header["frame"]) != frame:
+                continue
+            object_count = int(slot_header["object_count"])
+            host_vehicle_id = int(slot_header["host_vehicle_id"])
+            if copy:
+                objects = self._layout.slot_bytes[slot][:object_count * MOVING_OBJECT_DTYPE.itemsize].copy().view(
+                    MOVING_OBJECT_DTYPE)
+            else:
+                objects = self._layout.slot_objects[slot][:object_count]
+            if int(slot_header["sequence"]) == sequence:
+                self.frame, self._slot, self._sequence = frame, slot, sequence
+                return ColumnarState(objects, [], host_vehicle_id)
+        raise RuntimeError(f"No consistent frame after {MAX_READ_ATTEMPTS} attempts")
+
+    def still_valid(self) -> bool:
+        """Whether the slot of the last latest() call was not written since."""
+        return int(self._layout.slot_headers[self._slot]["sequence"]) == self._sequence
+
+    def close(self):
+        self._layout = None
+        self._memory.close()
@@ -4,23 +4,20 @@ from typing import Optional
 
 import math
 import numpy as np
+from osi3.osi_common_pb2 import BaseStationary
 from osi3.osi_groundtruth_pb2 import GroundTruth
 
-from .geometry import Orientation, ProjectionResult, angle_between_vectors, osi_vector_to_ndarray
-from .lanegraph import LaneGraphNode, LaneGraph
-from .road import RoadManager, RoadSignal
+import osi_extractor.speedlimit_logic as speedlimit_logic
+from .geometry import closest_projected_points, group_argmin, osi_vector_to_ndarray, rotation_matrices
+from .lanegraph import NO_LANE, LaneGraph
+from .road import RoadManager, RoadSignal, RoadTrafficLight
+from .traffic_lights import TrafficLightStates
 
 SIGN_VIEW_NORMAL = np.array([1, 0, 0])
 SIGN_MAX_ANGLE = math.pi / 4.0  # 45 degrees
 MAX_SIGN_DISTANCE = 10.0
 
 
-def lane_check_sign_orientation(lane: LaneGraphNode, orientation: Orientation, projection: ProjectionResult) -> bool:
-    lane_point1, lane_point2 = lane.data.segment_points(projection.segment_index)
-    lane_reverse_direction = orientation.rotate_vector(lane_point1 - lane_point2)
-    return angle_between_vectors(lane_reverse_direction, SIGN_VIEW_NORMAL) <= SIGN_MAX_ANGLE
-
-
 class RoadAssignmentBuilder:
     lane_graph: LaneGraph
     road_manager: RoadManager
@@ -30,11 +27,10 @@ class RoadAssignmentBuilder:
         self.road_manager = road_manager
 
     def assign_signs_to_roads(self, gt: GroundTruth):
-        for osi_sign in gt.traffic_sign:
-            main_sign_base = osi_sign.main_sign.base
-            position = osi_vector_to_ndarray(main_sign_base.position)
-            orientation = Orientation.from_osi(main_sign_base.orientation)
-            lane = self._find_closest_lane(position, orientation, max_distance=MAX_SIGN_DISTANCE)
+        osi_signs = list(gt.traffic_sign)
+        closest_lanes, road_s = self._locate([osi_sign.main_sign.base for osi_sign in osi_signs])
+        for osi_sign, sign_road_s, lane_index in zip(osi_signs, road_s.tolist(), closest_lanes.tolist()):
+            lane = self.lane_graph.node_at(lane_index)
             if lane is None:
                 print(f'WARNING: Could not assign traffic sign {osi_sign.id.value} to a lane')
                 continue
@@ -44,24 +40,107 @@ class RoadAssignmentBuilder:
                 continue
             road_signal = RoadSignal(
                 road_id=road.road_id,
-                road_s=road.object_road_s(lane, position),
+                road_s=(sign_road_s, road.total_distance),
                 closest_lane=lane,
                 osi_signal=osi_sign,
             )
             road.signals.append(road_signal)
+        for road in self.road_manager.roads:
+            speedlimit_logic.compile_speedlimits(road)
 
-    def _find_closest_lane(self, position: np.ndarray, orientation: Orientation, max_distance: float = float('inf')) \
-            -> Optional[LaneGraphNode]:
-        closest_lane = None
-        closest_distance = max_distance
-        for lane in self.lane_graph.iterate_nodes():
-            if lane.data.centerline_len < 2:
+    def assign_traffic_lights_to_roads(self, gt: GroundTruth):
+        """
+        Assign the traffic lights of the map to lanes and roads and set up
+        RoadManager.traffic_light_states for them. The lane is the first
+        assigned lane of the light that is in the lane graph, otherwise the
+        closest lane as for traffic signs.
+        """
+        osi_lights = list(gt.traffic_light)
+        assigned_lanes = [
+            next((self.lane_graph.index_of(id.value) for id in osi_light.classification.assigned_lane_id
+                  if self.lane_graph.index_of(id.value) is not None), NO_LANE)
+            for osi_light in osi_lights]
+        closest_lanes, road_s = self._locate([osi_light.base for osi_light in osi_lights],
+                                             np.array(assigned_lanes, dtype=np.int64))
+        self.road_manager.traffic_light_states = TrafficLightStates(
+            [osi_light.id.value for osi_light in osi_lights])
+        self.road_manager.traffic_light_states.update(gt)
+        for slot, (osi_light, light_road_s, lane_index) in enumerate(
+                zip(osi_lights, road_s.tolist(), closest_lanes.tolist())):
+            lane = self.lane_graph.node_at(lane_index)
+            if lane is None:
+                print(f'WARNING: Could not assign traffic light {osi_light.id.value} to a lane')
                 continue
-            projection = lane.data.project_onto_centerline(position)
-            if not lane_check_sign_orientation(lane, orientation, projection):
+            road = self.road_manager.get_road(lane)
+            if road is None:
+                print(f'WARNING: Could not assign traffic light {osi_light.id.value} to a road')
                 continue
-            distance = np.linalg.norm(position - projection.projected_point)
-            if distance < closest_distance:
-                closest_lane = lane
-                closest_distance = distance
-        return closest_lane
+            road.traffic_lights.append(RoadTrafficLight(
+                road_id=road.road_id,
+                road_s=(light_road_s, road.total_distance),
+                closest_lane=lane,
+                traffic_light_id=osi_light.id.value,
+                slot=slot,
+            ))
+        for road in self.road_manager.roads:
+            road.index_traffic_lights()
+
+    def _locate(self, bases: list[BaseStationary], lanes: Optional[np.ndarray] = None) \
+            -> tuple[np.ndarray, np.ndarray]:
+        """
+        Lane index (NO_LANE if none was found) and road s of stationary
+        objects. Objects without a lane in lanes are assigned to the closest
+        lane they face.
+        """
+        positions = np.array([osi_vector_to_ndarray(base.position) for base in bases]).reshape(-1, 3)
+        orientations = np.array([[base.orientation.yaw, base.orientation.pitch, base.orientation.roll]
+                                 for base in bases]).reshape(-1, 3)
+        if lanes is None:
+            lanes = np.full(len(bases), NO_LANE, dtype=np.int64)
+        unknown = lanes == NO_LANE
+        lanes[unknown] = self._find_closest_lanes(positions[unknown], orientations[unknown],
+                                                  max_distance=MAX_SIGN_DISTANCE)
+        road_s = np.full(len(bases), np.nan)
+        found = lanes != NO_LANE
+        road_s[found], _, _ = self.road_manager.project_onto_sections(lanes[found], positions[found])
+        return lanes, road_s
+
+    def _find_closest_lanes(self, positions: np.ndarray, orientations: np.ndarray,
+                            max_distance: float = MAX_SIGN_DISTANCE) -> np.ndarray:
+        """
+        For every sign (position and yaw/pitch/roll) the index of the closest
+        lane the sign faces, NO_LANE if there is none closer than
+        max_distance. A sign faces a lane if the reverse direction of the
+        closest centerline segment, rotated by the sign orientation, is within
+        SIGN_MAX_ANGLE of SIGN_VIEW_NORMAL. All signs are handled in one batch,
+        only lanes with a centerline segment within max_distance are candidates.
+        """
+        graph = self.lane_graph
+        closest_lanes = np.full(len(positions), NO_LANE, dtype=np.int64)
+        pair_sign, pair_segment = graph.segment_grid(max_distance).within(positions)
+        if len(pair_sign) == 0:
+            return closest_lanes
+        # one pair per sign and candidate lane, ordered by sign and then by lane
+        pairs = np.unique(pair_sign * len(graph) + graph.segment_lanes[pair_segment])
+        pair_sign, pair_lane = np.divmod(pairs, len(graph))
+
+        segment, progress = closest_projected_points(
+            positions[pair_sign], graph.centerline_points,
+            graph.centerline_indptr[pair_lane], graph.centerline_indptr[pair_lane + 1])
+        start = graph.centerline_points[segment]
+        v = graph.centerline_points[segment + 1] - start
+        projected = start + progress[:, np.newaxis] * v
+        distance = np.linalg.norm(positions[pair_sign] - projected, axis=1)
+
+        lane_reverse_direction = np.einsum(
+            "ijk,ik->ij", rotation_matrices(*orientations.T)[pair_sign], -v)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cosine = (lane_reverse_direction @ SIGN_VIEW_NORMAL
+                      / (np.linalg.norm(lane_reverse_direction, axis=1) * np.linalg.norm(SIGN_VIEW_NORMAL)))
+            faces_sign = np.arccos(cosine) <= SIGN_MAX_ANGLE
+        distance[~faces_sign | ~(distance < max_distance)] = np.inf
+
+        best = group_argmin(distance, np.flatnonzero(np.diff(pair_sign, prepend=-1)))
+        found = np.isfinite(distance[best])
+        closest_lanes[pair_sign[best[found]]] = pair_lane[best[found]]
+        return closest_lanes
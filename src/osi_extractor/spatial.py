@@ -0,0 +1,139 @@
+import itertools
+import math
+from collections import defaultdict
+
+import numpy as np
+
+from .geometry import group_argmin
+
+
+class PointGrid:
+    """
+    Uniform grid (spatial hash) over a fixed set of points.
+
+    Points are bucketed by the cell they fall into, so finding all points
+    near a query point only looks at the few cells overlapping the query
+    radius instead of at every point.
+    """
+    def __init__(self, points: np.ndarray, cell_size: float):
+        self.points = points
+        self._point_lists: list[list[float]] = points.tolist()
+        self._cell_size = cell_size
+        self._cells: dict[tuple[int, ...], list[int]] = defaultdict(list)
+        cells = np.floor(points / cell_size).astype(np.int64)
+        for i, cell in enumerate(map(tuple, cells.tolist())):
+            self._cells[cell].append(i)
+
+    def query(self, point: np.ndarray, radius: float) -> list[int]:
+        """
+        Return the indices (in ascending order) of all points whose
+        euclidean distance to point is at most radius.
+        """
+        # plain python arithmetic: numpy overhead dominates for single points
+        coordinates = point.tolist()
+        cell_ranges = (range(math.floor((c - radius) / self._cell_size),
+                             math.floor((c + radius) / self._cell_size) + 1)
+                       for c in coordinates)
+        candidates: list[int] = []
+        for cell in itertools.product(*cell_ranges):
+            candidates.extend(self._cells.get(cell, ()))
+        candidates.sort()
+        radius_squared = radius * radius
+        return [i for i in candidates
+                if sum((a - b) ** 2 for a, b in zip(self._point_lists[i], coordinates))
+                <= radius_squared]
+
+
+class SegmentGrid:
+    """
+    Uniform grid over a fixed set of line segments in the x/y plane, for
+    nearest segment queries on large batches of points.
+
+    Every segment is registered in all cells its bounding box, grown by
+    max_distance, overlaps. All segments within max_distance of a point are
+    therefore registered in the cell of the point itself, so a batch query
+    is a single vectorized cell lookup per point.
+    """
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, max_distance: float):
+        self._starts = starts[:, :2]
+        self._ends = ends[:, :2]
+        self._max_distance = max_distance
+        self._cell_size = max_distance
+        lower = np.floor((np.minimum(self._starts, self._ends) - max_distance)
+                         / self._cell_size).astype(np.int64)
+        upper = np.floor((np.maximum(self._starts, self._ends) + max_distance)
+                         / self._cell_size).astype(np.int64)
+        extent = upper - lower + 1
+        counts = extent[:, 0] * extent[:, 1]
+        segments = np.repeat(np.arange(len(starts)), counts)
+        offsets = np.zeros(len(starts), dtype=np.int64)
+        np.cumsum(counts[:-1], out=offsets[1:])
+        local = np.arange(len(segments)) - offsets[segments]
+        cells = lower[segments] + np.stack(
+            [local % extent[segments, 0], local // extent[segments, 0]], axis=1)
+        self._lowest_cell = cells.min(axis=0) if len(cells) else np.zeros(2, dtype=np.int64)
+        self._cell_extent = (cells.max(axis=0) - self._lowest_cell + 1 if len(cells)
+                             else np.zeros(2, dtype=np.int64))
+        keys = self._cell_keys(cells)
+        order = np.argsort(keys, kind="stable")
+        self._keys, first = np.unique(keys[order], return_index=True)
+        self._indptr = np.append(first, len(keys))
+        self._segments = segments[order]
+
+    def _cell_keys(self, cells: np.ndarray) -> np.ndarray:
+        relative = cells - self._lowest_cell
+        inside = np.all((relative >= 0) & (relative < self._cell_extent), axis=1)
+        return np.where(inside, relative[:, 0] * self._cell_extent[1] + relative[:, 1], -1)
+
+    def _candidate_pairs(self, points: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # (point, segment) pairs of every point with the segments registered in
+        # its cell, grouped by point, and the squared distance of every pair
+        points = points[:, :2]
+        keys = self._cell_keys(np.floor(points / self._cell_size).astype(np.int64))
+        slots = np.zeros(len(points), dtype=np.int64)
+        counts = np.zeros(len(points), dtype=np.int64)
+        if len(self._keys):
+            slots = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+            found = (keys >= 0) & (self._keys[slots] == keys)
+            counts[found] = self._indptr[slots[found] + 1] - self._indptr[slots[found]]
+        pair_point = np.repeat(np.arange(len(points)), counts)
+        pair_offsets = np.zeros(len(points), dtype=np.int64)
+        np.cumsum(counts[:-1], out=pair_offsets[1:])
+        pair_segment = self._segments[self._indptr[slots[pair_point]] + np.arange(len(pair_point))
+                                      - pair_offsets[pair_point]]
+
+        start = self._starts[pair_segment]
+        v = self._ends[pair_segment] - start
+        d = points[pair_point] - start
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.clip(np.einsum("ij,ij->i", v, d) / np.einsum("ij,ij->i", v, v), 0.0, 1.0)
+        offset = d - np.expand_dims(np.nan_to_num(t), axis=-1) * v
+        return pair_point, pair_segment, np.einsum("ij,ij->i", offset, offset)
+
+    def within(self, points: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        All (point, segment) pairs with a distance of at most max_distance,
+        as two index arrays ordered by point and then by segment.
+        """
+        pair_point, pair_segment, distance_squared = self._candidate_pairs(points)
+        in_range = distance_squared <= self._max_distance ** 2
+        return pair_point[in_range], pair_segment[in_range]
+
+    def nearest(self, points: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        For every point return the index of the closest segment within
+        max_distance (-1 if there is none) and the distance to it (inf if
+        there is none).
+        """
+        pair_point, pair_segment, distance_squared = self._candidate_pairs(points)
+        nearest_segment = np.full(len(points), -1, dtype=np.int64)
+        distance = np.full(len(points), np.inf)
+        if len(pair_point):
+            # closest pair of every point, ties keep the lower segment index
+            group_starts = np.flatnonzero(np.diff(pair_point, prepend=-1))
+            best = group_argmin(distance_squared, group_starts)
+            in_range = distance_squared[best] <= self._max_distance ** 2
+            points_in_range = pair_point[best[in_range]]
+            nearest_segment[points_in_range] = pair_segment[best[in_range]]
+            distance[points_in_range] = np.sqrt(distance_squared[best[in_range]])
+        return nearest_segment, distance
@@ -9,7 +9,7 @@ class Speed:
     def __init__(self, x_mps: float, y_mps: float, z_mps: float):
         self._velocity_x_mps = x_mps
         self._velocity_y_mps = y_mps
-        self._velocity_z_mps - z_mps
+        self._velocity_z_mps = z_mps
 
     @staticmethod
     def from_osi_velocity(velocity: Vector3d) -> 'Speed':
@@ -1,6 +1,10 @@
-import sys
+import bisect
+import heapq
+import math
+from dataclasses import dataclass
 from typing import Optional
 
+import numpy as np
 import osi3.osi_lane_pb2 as lane_pb2
 import osi3.osi_trafficsign_pb2 as sign_pb2
 
@@ -20,28 +24,95 @@ SPEED_SIGNS = {TYPE_SPEED_LIMIT_BEGIN,
                TYPE_SPEED_LIMIT_ZONE_END}
 
 
-def calculate_speedlimit(road: Road, mo_road_s: tuple[float, float], ignore_exit_speed_signs: bool) \
-        -> Optional[int]:
-    # max integer
-    latest_speedlimit: int = sys.maxsize
-    latest_road_s = float("-inf")
-    for current_signal in road.signals:
+@dataclass(frozen=True)
+class SpeedLimitTable:
+    """
+    Piecewise constant speed limit along a road: limits[i] applies from road
+    s starts[i] (inclusive) up to starts[i + 1], before starts[0] there is
+    no speed limit.
+    """
+    starts: list[float]
+    limits: list[Optional[int]]
+
+    def lookup(self, road_s: float) -> Optional[int]:
+        i = bisect.bisect_right(self.starts, road_s) - 1
+        return self.limits[i] if i >= 0 else None
+
+    def lookup_many(self, road_s: np.ndarray) -> np.ndarray:
+        """Vectorized lookup, positions without a speed limit are NaN."""
+        limits = np.array([np.nan] + [np.nan if limit is None else limit for limit in self.limits])
+        return limits[np.searchsorted(self.starts, road_s, side="right")]
+
+
+def compile_speedlimits(road: Road):
+    """
+    Compile the speed signs of the road into one SpeedLimitTable for each
+    value of ignore_exit_speed_signs. Must be called again whenever
+    road.signals changes.
+    """
+    # (road s, order of the sign, speed limit, last road s the sign applies to)
+    signs: list[tuple[float, int, Optional[int], float]] = []
+    for order, current_signal in enumerate(road.signals):
         sign_classification = current_signal.osi_signal.main_sign.classification
         if sign_classification.type not in SPEED_SIGNS:
             continue
-        if latest_road_s < current_signal.road_s[0] <= mo_road_s[0]:
-            if current_signal.closest_lane.data.lane_subtype == LaneSubtype.EXIT:
-                if ignore_exit_speed_signs:
-                    continue
-                else:
-                    s_of_exit_end = road.calculate_s_of_exit_end(current_signal.closest_lane)
-                    if s_of_exit_end is None:
-                        continue
-                    if s_of_exit_end < mo_road_s[0]:
-                        continue
-            latest_road_s = current_signal.road_s[0]
-            if sign_classification in (TYPE_SPEED_LIMIT_END, TYPE_SPEED_LIMIT_ZONE_END):
-                latest_speedlimit = sys.maxsize
-            else:
-                latest_speedlimit = int(sign_classification.value.value)
-    return latest_speedlimit if latest_speedlimit < sys.maxsize else None
+        if sign_classification.type in (TYPE_SPEED_LIMIT_END, TYPE_SPEED_LIMIT_ZONE_END):
+            limit = None
+        else:
+            limit = int(sign_classification.value.value)
+        end = math.inf
+        if current_signal.closest_lane.data.lane_subtype == LaneSubtype.EXIT:
+            # speed signs on an exit lane only apply up to the end of the exit
+            end = road.calculate_s_of_exit_end(current_signal.closest_lane)
+            if end is None:
+                continue
+        signs.append((current_signal.road_s[0], order, limit, end))
+    signs.sort()
+    road.speed_limit_tables = {
+        True: _compile_table([sign for sign in signs if sign[3] == math.inf]),
+        False: _compile_table(signs),
+    }
+
+
+def _compile_table(signs: list[tuple[float, int, Optional[int], float]]) -> SpeedLimitTable:
+    # The limit at s is set by the last sign before s that still applies
+    # (the first one in road.signals order for signs at the same s). Sweep
+    # over all points where this can change, the signs that apply are kept
+    # in a heap ordered by s, signs that no longer apply are dropped lazily.
+    breakpoints = sorted({sign[0] for sign in signs}
+                         | {math.nextafter(sign[3], math.inf) for sign in signs if sign[3] < math.inf})
+    starts: list[float] = []
+    limits: list[Optional[int]] = []
+    applying: list[tuple[float, int, Optional[int], float]] = []
+    next_sign = 0
+    for breakpoint in breakpoints:
+        while next_sign < len(signs) and signs[next_sign][0] <= breakpoint:
+            road_s, order, limit, end = signs[next_sign]
+            heapq.heappush(applying, (-road_s, order, limit, end))
+            next_sign += 1
+        while applying and applying[0][3] < breakpoint:
+            heapq.heappop(applying)
+        limit = applying[0][2] if applying else None
+        if not limits or limit != limits[-1]:
+            starts.append(breakpoint)
+            limits.append(limit)
+    return SpeedLimitTable(starts, limits)
+
+
+def speed_limit_table(road: Road, ignore_exit_speed_signs: bool) -> SpeedLimitTable:
+    if not road.speed_limit_tables:
+        compile_speedlimits(road)
+    return road.speed_limit_tables[ignore_exit_speed_signs]
+
+
+def calculate_speedlimit(road: Road, mo_road_s: tuple[float, float], ignore_exit_speed_signs: bool) \
+        -> Optional[int]:
+    return speed_limit_table(road, ignore_exit_speed_signs).lookup(mo_road_s[0])
+
+
+def calculate_speedlimits(road: Road, road_s: np.ndarray, ignore_exit_speed_signs: bool) -> np.ndarray:
+    """
+    Vectorized calculate_speedlimit for many s coordinates on the same road.
+    Positions without a speed limit are NaN.
+    """
+    return speed_limit_table(road, ignore_exit_speed_signs).lookup_many(road_s)
@@ -1,103 +1,214 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Optional
+import threading
+from collections.abc import Sequence
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import TYPE_CHECKING, Callable, Iterable, Optional
 
 import numpy as np
 from osi3.osi_common_pb2 import Dimension3d, Vector3d, Orientation3d
 from osi3.osi_object_pb2 import MovingObject
-from osi3.osi_trafficlight_pb2 import TrafficLight
 
 import osi_extractor.speedlimit_logic as speedlimit_logic
 from .deprecated_handler import get_all_assigned_lane_ids
-from .geometry import angle_of_segment, osi_vector_to_ndarray
+from .geometry import ProjectionResult, angle_of_segment, osi_vector_to_ndarray
 from .lane import LaneBoundaryMarkingType, LaneSubtype, LaneType
-from .lanegraph import LaneGraph, NeighboringLaneSignal
-from .road import Road, RoadManager, RoadSignal
+from .lanegraph import NO_LANE, LaneGraph, NeighboringLaneSignal
+from .road import NO_ROAD, Road, RoadManager, RoadSignal, RoadTrafficLight
 from .speed import Speed
+from .traffic_lights import TrafficLightFrame, TrafficLightState
+
+if TYPE_CHECKING:
+    from .events import LaneEvent
+    from .surroundings import Surroundings
 
 YAW_IS_ALREADY_RELATIVE = True  # TODO: decide on where to set such flags
 
 
-@dataclass(init=False)
 class RoadState:
-    curvature: float
-    curvature_change: float
-    lane_width: float
-    lane_position: float
-    distance_to_lane_end: NeighboringLaneSignal[float]
-    distance_to_ramp: NeighboringLaneSignal[float]
-    distance_to_next_exit: Optional[float]
-    lane_type: NeighboringLaneSignal[tuple[LaneType, LaneSubtype]]
-    left_lane_marking: LaneBoundaryMarkingType
-    right_lane_marking: LaneBoundaryMarkingType
-    road_z: float
-    road_angle: float
-    relative_object_heading_angle: float
-    # road_topography: ?
-    road_on_highway: bool
-    road_on_junction: bool
-    same_road_as_ego: bool
-    speed_limit: Optional[int] = None  # Or more info?
-    traffic_signs: list[RoadSignal] = None  # Based on sensor?
-    traffic_lights: list[TrafficLight] = None # Based on sensor?
+    """
+    Road related state of a moving object. Fields are computed on first
+    access and then kept for the frame, fields listed in eager_fields are
+    computed right away. repr and == cover all FIELDS, so they compute
+    every field.
+    """
+    FIELDS = (
+        "curvature", "curvature_change", "lane_width", "lane_position", "distance_to_lane_end",
+        "distance_to_ramp", "distance_to_next_exit", "lane_type", "left_lane_marking", "right_lane_marking",
+        "road_z", "road_angle", "relative_object_heading_angle", "road_on_highway", "road_on_junction",
+        "same_road_as_ego", "speed_limit", "traffic_signs", "traffic_lights", "next_traffic_light",
+        "distance_to_traffic_light",
+    )
+    # fields that are the same everywhere on a lane (the markings per
+    # boundary piece), they can be taken over from a previous frame
+    REUSABLE_FIELDS = (
+        "lane_type", "left_lane_marking", "right_lane_marking", "road_on_highway", "road_on_junction",
+        "traffic_signs", "traffic_lights",
+    )
 
     # if ego_road_id is None, the state object will assume that this moving object is the ego vehicle
-    def __init__(self, lane_graph: LaneGraph, mos: MovingObjectState, road: Road, ego_road_id: 'int | None'):
-        current_position = osi_vector_to_ndarray(mos.location)
-        current_lane_id = mos.lane_ids[0]
-        current_lane_data = lane_graph.get_lane_data(current_lane_id)
-        if current_lane_data is None:
+    def __init__(self, lane_graph: LaneGraph, mos: MovingObjectState, road: Road, ego_road_id: 'int | None',
+                 eager_fields: Iterable[str] = (), previous: Optional[RoadState] = None,
+                 traffic_lights: Optional[TrafficLightFrame] = None):
+        self._lane_graph = lane_graph
+        self._road = road
+        self._ego_road_id = ego_road_id
+        self._current_position = osi_vector_to_ndarray(mos.location)
+        self._current_lane_id = mos.lane_ids[0]
+        self._road_s = mos.road_s
+        self._object_yaw = mos.orientation.yaw
+        # the lights of the frame this state is built for, not of the frame next_traffic_light is read in
+        self._traffic_lights = (traffic_lights if traffic_lights is not None
+                                else road._road_manager.traffic_light_states.frame)
+        self._current_lane_data = lane_graph.get_lane_data(self._current_lane_id)
+        if self._current_lane_data is None:
             raise RuntimeError(f"Moving object {mos.simulator_id} is on lane"
-                               f" {current_lane_id} which is not meant for driving")
-        centerline_projection = current_lane_data.project_onto_centerline(
-            current_position,
-        )
-        self.curvature = current_lane_data.curvature.get_road_curvature(
-            centerline_projection.segment_index, centerline_projection.segment_progress)
-        self.curvature_change = current_lane_data.curvature.get_road_curvature_change(
-            centerline_projection.segment_index
-        )
-        self.distance_to_lane_end = lane_graph.distance_to_lane_end(
-            current_lane_id,
-            current_position,
-        )
-        self.distance_to_next_exit = lane_graph.distance_to_next_exit(
-            current_lane_id,
-            current_position,
+                               f" {self._current_lane_id} which is not meant for driving")
+        # previous must be the state of the same object on the same lane
+        self.reused_fields = 0
+        if previous is not None:
+            for field in RoadState.REUSABLE_FIELDS:
+                if field in previous.__dict__:
+                    self.__dict__[field] = previous.__dict__[field]
+                    self.reused_fields += 1
+        for field in eager_fields:
+            if field not in RoadState.FIELDS:
+                raise ValueError(f"Unknown road state field {field}")
+            getattr(self, field)
+
+    # as the former dataclass: over all FIELDS, which computes the ones not accessed yet
+    def __repr__(self) -> str:
+        return f"RoadState({', '.join(f'{field}={getattr(self, field)!r}' for field in RoadState.FIELDS)})"
+
+    def __eq__(self, other: object) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in RoadState.FIELDS)
+
+    __hash__ = None
+
+    @cached_property
+    def _centerline_projection(self) -> ProjectionResult:
+        return self._current_lane_data.project_onto_centerline(self._current_position)
+
+    @cached_property
+    def curvature(self) -> float:
+        return self._current_lane_data.curvature.get_road_curvature(
+            self._centerline_projection.segment_index, self._centerline_projection.segment_progress)
+
+    @cached_property
+    def curvature_change(self) -> float:
+        return self._current_lane_data.curvature.get_road_curvature_change(
+            self._centerline_projection.segment_index
         )
-        self.distance_to_ramp = lane_graph.distance_to_ramp(
-            current_lane_id,
-            current_position,
+
+    @cached_property
+    def distance_to_lane_end(self) -> NeighboringLaneSignal[float]:
+        return self._lane_graph.distance_to_lane_end(
+            self._current_lane_id,
+            self._current_position,
         )
-        lane_boundary_left, lane_boundary_right = (
-            current_lane_data.boundary_points_for_position(current_position)
+
+    @cached_property
+    def distance_to_next_exit(self) -> Optional[float]:
+        return self._lane_graph.distance_to_next_exit(
+            self._current_lane_id,
+            self._current_position,
         )
-        self.lane_width = np.linalg.norm(lane_boundary_left - lane_boundary_right)
-        self.lane_position = (
-            np.linalg.norm(current_position - lane_boundary_left) / self.lane_width
+
+    @cached_property
+    def distance_to_ramp(self) -> NeighboringLaneSignal[float]:
+        return self._lane_graph.distance_to_ramp(
+            self._current_lane_id,
+            self._current_position,
         )
-        self.lane_type = lane_graph.neighbor_lane_types(current_lane_id)
-        self.left_lane_marking = current_lane_data.get_lane_boundary_marking_for_position(current_position, left=True)
-        self.right_lane_marking = current_lane_data.get_lane_boundary_marking_for_position(current_position, left=False)
-        self.road_on_junction = current_lane_data.lane_type == LaneType.INTERSECTION
-        _, _, self.road_z = centerline_projection.projected_point
-        self.road_angle = angle_of_segment(
-            current_lane_data.centerline_matrix, centerline_projection.segment_index)
+
+    @cached_property
+    def _lane_boundary_points(self) -> tuple[np.ndarray, np.ndarray]:
+        return self._current_lane_data.boundary_points_for_position(self._current_position)
+
+    @cached_property
+    def lane_width(self) -> float:
+        lane_boundary_left, lane_boundary_right = self._lane_boundary_points
+        return np.linalg.norm(lane_boundary_left - lane_boundary_right)
+
+    @cached_property
+    def lane_position(self) -> float:
+        lane_boundary_left, _ = self._lane_boundary_points
+        return np.linalg.norm(self._current_position - lane_boundary_left) / self.lane_width
+
+    @cached_property
+    def lane_type(self) -> NeighboringLaneSignal[tuple[LaneType, LaneSubtype]]:
+        return self._lane_graph.neighbor_lane_types(self._current_lane_id)
+
+    @cached_property
+    def left_lane_marking(self) -> LaneBoundaryMarkingType:
+        return self._current_lane_data.get_lane_boundary_marking_for_position(self._current_position, left=True)
+
+    @cached_property
+    def right_lane_marking(self) -> LaneBoundaryMarkingType:
+        return self._current_lane_data.get_lane_boundary_marking_for_position(self._current_position, left=False)
+
+    @cached_property
+    def road_on_junction(self) -> bool:
+        return self._current_lane_data.lane_type == LaneType.INTERSECTION
+
+    @cached_property
+    def road_z(self) -> float:
+        _, _, road_z = self._centerline_projection.projected_point
+        return road_z
+
+    @cached_property
+    def road_angle(self) -> float:
+        return angle_of_segment(
+            self._current_lane_data.centerline_matrix, self._centerline_projection.segment_index)
+
+    @cached_property
+    def relative_object_heading_angle(self) -> float:
         if YAW_IS_ALREADY_RELATIVE:
-            self.relative_object_heading_angle = mos.orientation.yaw
-        else:
-            self.relative_object_heading_angle = (
-                mos.orientation.yaw - self.road_angle + np.pi) % (2*np.pi) - np.pi
-        self.road_on_highway = road.on_highway
-        if ego_road_id is None:
-            self.same_road_as_ego = True
-        else:
-            self.same_road_as_ego = road.road_id == ego_road_id
+            return self._object_yaw
+        return (self._object_yaw - self.road_angle + np.pi) % (2*np.pi) - np.pi
+
+    @cached_property
+    def road_on_highway(self) -> bool:
+        return self._road.on_highway
+
+    @cached_property
+    def same_road_as_ego(self) -> bool:
+        if self._ego_road_id is None:
+            return True
+        return self._road.road_id == self._ego_road_id
+
+    @cached_property
+    def speed_limit(self) -> Optional[int]:
         ignore_exit_speed_signs = self.road_on_highway and self.lane_type.current_lane[1] != LaneSubtype.EXIT
-        self.speed_limit = speedlimit_logic.calculate_speedlimit(road, mos.road_s, ignore_exit_speed_signs)
-        self.traffic_signs = road.signals
-        self.traffic_lights = None # TODO should remove this
+        return speedlimit_logic.calculate_speedlimit(self._road, self._road_s, ignore_exit_speed_signs)
+
+    @cached_property
+    def traffic_signs(self) -> list[RoadSignal]:  # Based on sensor?
+        return self._road.signals
+
+    @cached_property
+    def traffic_lights(self) -> list[RoadTrafficLight]:  # Based on sensor?
+        return self._road.traffic_lights
+
+    @cached_property
+    def _next_traffic_light(self) -> tuple[Optional[RoadTrafficLight], Optional[float]]:
+        return self._road.next_traffic_light(self._lane_graph.node(self._current_lane_id), self._road_s[0])
+
+    @cached_property
+    def next_traffic_light(self) -> Optional[TrafficLightState]:
+        next_traffic_light, _ = self._next_traffic_light
+        if next_traffic_light is None:
+            return None
+        return self._traffic_lights.state(next_traffic_light.slot)
+
+    @cached_property
+    def distance_to_traffic_light(self) -> Optional[float]:
+        _, distance = self._next_traffic_light
+        return distance
 
 
 @dataclass(init=False)
@@ -110,7 +221,7 @@ class MovingObjectState:
     acceleration: Vector3d
     orientation: Orientation3d
     lane_ids: list[int]
-    road_id: Optional[int]
+    road_id: Optional[int]  # None outside the region of interest as well, which does not mean another road
     road_s: Optional[tuple[float, float]]
     road_state: Optional[RoadState]
     indicator_signal: int
@@ -125,7 +236,10 @@ class MovingObjectState:
     service_vehicle_illumination: int
 
     # if ego_road_id is None, the state object will assume that this moving object is the ego vehicle
-    def __init__(self, mo: MovingObject, lane_graph: LaneGraph, road_manager: RoadManager, ego_road_id: 'int | None'):
+    def __init__(self, mo: MovingObject, lane_graph: LaneGraph, road_manager: RoadManager, ego_road_id: 'int | None',
+                 road_state_fields: Iterable[str] = (), road_context: bool = True,
+                 previous_road_state: Optional[RoadState] = None,
+                 traffic_lights: Optional[TrafficLightFrame] = None):
         self.simulator_id = mo.id.value
         self.object_type = mo.type
         self.dimensions = mo.base.dimension
@@ -146,36 +260,43 @@ class MovingObjectState:
         self.emergency_vehicle_illumination = light_state.emergency_vehicle_illumination
         self.service_vehicle_illumination = light_state.service_vehicle_illumination
 
-        if len(self.lane_ids) == 0 or lane_graph._nodes.get(self.lane_ids[0]) == None:
-            self.road_id = None
-            self.road_s = None
-            self.road_state = None
+        self.road_id = None
+        self.road_s = None
+        self.road_state = None
+        lane_graph_node = lane_graph.node(self.lane_ids[0]) if len(self.lane_ids) > 0 else None
+        if lane_graph_node is None:
+            # without a known lane there is no road angle, the yaw stays as in the ground truth
             return
+        has_centerline = lane_graph_node.data.centerline_matrix.shape[0] > 0
 
-        lane_graph_node = lane_graph._nodes[self.lane_ids[0]]
-        road_of_lane = road_manager.get_road(lane_graph_node)
-        if road_of_lane is None:
-            self.road_id = None
-            self.road_s = None
-            self.road_state = None
-            return
-        self.road_id = road_of_lane.road_id
-        if lane_graph_node.data.centerline_matrix.shape[0] <= 0:
-            self.road_s = None
-            self.road_state = None
-            return
-        self.road_s = road_of_lane.object_road_s(
-            lane_graph_node, osi_vector_to_ndarray(self.location))
-        self.road_state = RoadState(lane_graph, self, road_of_lane, ego_road_id)
-        if YAW_IS_ALREADY_RELATIVE:
-            self.orientation.yaw = (
-                self.orientation.yaw + self.road_state.road_angle + 2*np.pi) % (2*np.pi)
+        # objects outside the region of interest only get the kinematic fields and the absolute yaw
+        road_of_lane = road_manager.get_road(lane_graph_node) if road_context else None
+        if road_of_lane is not None:
+            self.road_id = road_of_lane.road_id
+            if has_centerline:
+                self.road_s = road_of_lane.object_road_s(
+                    lane_graph_node, osi_vector_to_ndarray(self.location))
+                self.road_state = RoadState(lane_graph, self, road_of_lane, ego_road_id, road_state_fields,
+                                            previous_road_state, traffic_lights)
+        if YAW_IS_ALREADY_RELATIVE and has_centerline:
+            if self.road_state is not None:
+                road_angle = self.road_state.road_angle
+            else:
+                projection = lane_graph_node.data.project_onto_centerline(osi_vector_to_ndarray(self.location))
+                road_angle = angle_of_segment(lane_graph_node.data.centerline_matrix, projection.segment_index)
+            self.orientation.yaw = (self.orientation.yaw + road_angle + 2*np.pi) % (2*np.pi)
 
 
 @dataclass
 class StationaryObstacle:
     dimensions: Dimension3d
     location: Vector3d
+    simulator_id: Optional[int] = None
+    lane_id: Optional[int] = None  # the lane with the closest centerline
+    road_id: Optional[int] = None
+    road_s: Optional[float] = None
+    t: Optional[float] = None  # lateral offset from the road reference line
+    blocks_lane: bool = False  # reaches into the lane lane_id
 
 
 @dataclass
@@ -183,3 +304,311 @@ class State:
     moving_objects: list[MovingObjectState]
     stationary_obstacles: list[StationaryObstacle]
     host_vehicle_id: int
+    events: list[LaneEvent] = field(default_factory=list)  # set by the extractor's LaneEventDetector
+    # leaders, followers and neighbours, built by create_state, create_multi_ego_states,
+    # IncrementalStateBuilder and ProgressiveState.complete; ColumnarState has none
+    surroundings: Optional[Surroundings] = None
+    # obstacles blocking a lane, by lane id and sorted by road s
+    obstacles_by_lane: dict[int, list[StationaryObstacle]] = field(default_factory=dict)
+
+
+class EgoRoadState:
+    """RoadState of an object seen from another ego vehicle, only same_road_as_ego differs."""
+    __slots__ = ("_road_state", "same_road_as_ego")
+
+    def __init__(self, road_state: RoadState, same_road_as_ego: bool):
+        self._road_state = road_state
+        self.same_road_as_ego = same_road_as_ego
+
+    def __getattr__(self, name: str):
+        return getattr(self._road_state, name)
+
+
+class EgoMovingObjectState:
+    """MovingObjectState seen from another ego vehicle, see EgoRoadState."""
+    __slots__ = ("_state", "road_state")
+
+    def __init__(self, state: MovingObjectState, ego_road_id: Optional[int]):
+        self._state = state
+        self.road_state = None if state.road_state is None else EgoRoadState(
+            state.road_state, ego_road_id is None or state.road_id == ego_road_id)
+
+    def __getattr__(self, name: str):
+        return getattr(self._state, name)
+
+
+class EgoView(Sequence):
+    """
+    State.moving_objects of one ego vehicle over objects shared by all egos:
+    the ego first, then the other objects in their original order. Other
+    objects are wrapped on access, so a view costs no memory per object.
+    """
+    def __init__(self, moving_objects: list[MovingObjectState], ego_row: int):
+        self._objects = moving_objects
+        self._ego_row = ego_row
+        self._ego_road_id = moving_objects[ego_row].road_id
+
+    def __len__(self) -> int:
+        return len(self._objects)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Index {index} out of range for {len(self)} moving objects")
+        if index == 0:
+            return self._objects[self._ego_row]
+        row = index - 1 if index <= self._ego_row else index
+        return EgoMovingObjectState(self._objects[row], self._ego_road_id)
+
+
+MOVING_OBJECT_DTYPE = np.dtype([
+    ("simulator_id", np.int64),
+    ("object_type", np.int32),
+    ("dimensions", np.float64, 3),  # length, width, height
+    ("location", np.float64, 3),
+    ("velocity", np.float64, 3),
+    ("acceleration", np.float64, 3),
+    ("orientation", np.float64, 3),  # yaw, pitch, roll
+    ("indicator_signal", np.int32),
+    ("brake_light", np.int32),
+    ("front_fog_light", np.int32),
+    ("rear_fog_light", np.int32),
+    ("head_light", np.int32),
+    ("high_beam", np.int32),
+    ("reversing_light", np.int32),
+    ("license_plate_illumination_rear", np.int32),
+    ("emergency_vehicle_illumination", np.int32),
+    ("service_vehicle_illumination", np.int32),
+    ("lane_id", np.int64),  # first assigned lane, NO_LANE if there is none
+    ("road_id", np.int64),  # NO_ROAD if the object is not on a road
+    ("road_s", np.float64),  # NaN if the object is not on a road
+    ("road_length", np.float64),
+    ("lane_position", np.float64),
+    ("speed_limit", np.float64),  # NaN if there is no speed limit
+])
+
+
+class MovingObjectRow:
+    """
+    Lazy view of one object of a ColumnarState with the attribute names of
+    MovingObjectState. Values are read from the state array on access.
+    """
+    __slots__ = ("_objects", "_row")
+
+    def __init__(self, objects: np.ndarray, row: int):
+        self._objects = objects
+        self._row = row
+
+    def _get(self, field: str):
+        return self._objects[field][self._row]
+
+    @property
+    def simulator_id(self) -> int:
+        return int(self._get("simulator_id"))
+
+    @property
+    def object_type(self) -> int:
+        return int(self._get("object_type"))
+
+    @property
+    def dimensions(self) -> np.ndarray:
+        return self._get("dimensions")
+
+    @property
+    def location(self) -> np.ndarray:
+        return self._get("location")
+
+    @property
+    def velocity(self) -> Speed:
+        return Speed(*self._get("velocity").tolist())
+
+    @property
+    def acceleration(self) -> np.ndarray:
+        return self._get("acceleration")
+
+    @property
+    def orientation(self) -> np.ndarray:
+        return self._get("orientation")
+
+    @property
+    def lane_ids(self) -> list[int]:
+        lane_id = int(self._get("lane_id"))
+        return [lane_id] if lane_id != NO_LANE else []
+
+    @property
+    def road_id(self) -> Optional[int]:
+        road_id = int(self._get("road_id"))
+        return road_id if road_id != NO_ROAD else None
+
+    @property
+    def road_s(self) -> Optional[tuple[float, float]]:
+        road_s = float(self._get("road_s"))
+        return (road_s, float(self._get("road_length"))) if not np.isnan(road_s) else None
+
+    @property
+    def lane_position(self) -> Optional[float]:
+        lane_position = float(self._get("lane_position"))
+        return lane_position if not np.isnan(lane_position) else None
+
+    @property
+    def speed_limit(self) -> Optional[int]:
+        speed_limit = float(self._get("speed_limit"))
+        return int(speed_limit) if not np.isnan(speed_limit) else None
+
+    @property
+    def indicator_signal(self) -> int:
+        return int(self._get("indicator_signal"))
+
+    @property
+    def brake_light(self) -> int:
+        return int(self._get("brake_light"))
+
+    @property
+    def front_fog_light(self) -> int:
+        return int(self._get("front_fog_light"))
+
+    @property
+    def rear_fog_light(self) -> int:
+        return int(self._get("rear_fog_light"))
+
+    @property
+    def head_light(self) -> int:
+        return int(self._get("head_light"))
+
+    @property
+    def high_beam(self) -> int:
+        return int(self._get("high_beam"))
+
+    @property
+    def reversing_light(self) -> int:
+        return int(self._get("reversing_light"))
+
+    @property
+    def license_plate_illumination_rear(self) -> int:
+        return int(self._get("license_plate_illumination_rear"))
+
+    @property
+    def emergency_vehicle_illumination(self) -> int:
+        return int(self._get("emergency_vehicle_illumination"))
+
+    @property
+    def service_vehicle_illumination(self) -> int:
+        return int(self._get("service_vehicle_illumination"))
+
+
+@dataclass
+class ColumnarState:
+    """
+    State with all moving objects in one structured array (see
+    MOVING_OBJECT_DTYPE), the ego vehicle is in row 0. Rows can be read as
+    MovingObjectRow views, e.g. state[0] or by iterating moving_objects.
+    There are no Surroundings and no obstacles_by_lane, use create_state
+    where leaders and followers are needed.
+    """
+    objects: np.ndarray
+    stationary_obstacles: list[StationaryObstacle]
+    host_vehicle_id: int
+
+    def __len__(self) -> int:
+        return len(self.objects)
+
+    def __getitem__(self, row: int) -> MovingObjectRow:
+        if not -len(self.objects) <= row < len(self.objects):
+            raise IndexError(f"Row {row} out of range for {len(self.objects)} moving objects")
+        return MovingObjectRow(self.objects, row % len(self.objects))
+
+    @property
+    def moving_objects(self) -> list[MovingObjectRow]:
+        return [MovingObjectRow(self.objects, row) for row in range(len(self.objects))]
+
+    def row_of(self, simulator_id: int) -> Optional[MovingObjectRow]:
+        rows = np.flatnonzero(self.objects["simulator_id"] == simulator_id)
+        return MovingObjectRow(self.objects, int(rows[0])) if len(rows) > 0 else None
+
+
+class ProgressiveState:
+    """
+    State that is available as soon as the ego vehicle is built. Every
+    other moving object has a Future that is completed by build_remaining
+    (usually run on a background thread) or by the first moving_object
+    call for it, whichever comes first. Use asyncio.wrap_future to await
+    one from a coroutine.
+
+    build must only use inputs of its own frame, objects may be built after
+    the next frame was read.
+    """
+    def __init__(self, ego: MovingObjectState, other_ids: list[int],
+                 build: Callable[[int], MovingObjectState],
+                 stationary_obstacles: list[StationaryObstacle], host_vehicle_id: int,
+                 obstacles_by_lane: Optional[dict[int, list[StationaryObstacle]]] = None,
+                 create_surroundings: Optional[Callable[[list[MovingObjectState]], Surroundings]] = None):
+        self.ego = ego
+        self.stationary_obstacles = stationary_obstacles
+        self.host_vehicle_id = host_vehicle_id
+        self.obstacles_by_lane = obstacles_by_lane if obstacles_by_lane is not None else {}
+        # build(i) creates the state of the object with id other_ids[i]
+        self._build = build
+        self._create_surroundings = create_surroundings
+        self._rows: dict[int, int] = {id: row for row, id in enumerate(other_ids)}
+        # created on first use, keeps the ego path free of per object work
+        self._futures: dict[int, Future] = {}
+        self._claim_lock = threading.Lock()
+        self._cancelled = False
+        self._remaining: Optional[Future] = None
+
+    def future(self, simulator_id: int) -> Future:
+        if simulator_id not in self._rows:
+            raise KeyError(f"No moving object with id {simulator_id}")
+        with self._claim_lock:
+            return self._futures.setdefault(simulator_id, Future())
+
+    def moving_object(self, simulator_id: int) -> MovingObjectState:
+        if simulator_id == self.ego.simulator_id:
+            return self.ego
+        self._build_object(simulator_id)
+        return self._futures[simulator_id].result()
+
+    def build_remaining(self):
+        """Build all objects nobody asked for yet, stops early after cancel_remaining."""
+        for simulator_id in self._rows:
+            if self._cancelled:
+                return
+            self._build_object(simulator_id)
+
+    def start_remaining(self, executor: Executor):
+        """Run build_remaining on executor."""
+        self._remaining = executor.submit(self.build_remaining)
+
+    def cancel_remaining(self, wait: bool = False):
+        """
+        Stop build_remaining, objects are still built on request. An object
+        that is being built is finished; with wait the call returns only
+        after that, so no background work of this state is left.
+        """
+        self._cancelled = True
+        remaining = self._remaining
+        if remaining is not None and not remaining.cancel() and wait:
+            remaining.result()
+
+    def complete(self) -> State:
+        """The full State as create_state builds it, remaining objects are built on the calling thread."""
+        for simulator_id in self._rows:
+            self._build_object(simulator_id)
+        moving_objects = [self.ego] + [self._futures[simulator_id].result() for simulator_id in self._rows]
+        surroundings = self._create_surroundings(moving_objects) if self._create_surroundings is not None else None
+        return State(moving_objects, self.stationary_obstacles, self.host_vehicle_id,
+                     surroundings=surroundings, obstacles_by_lane=self.obstacles_by_lane)
+
+    def _build_object(self, simulator_id: int):
+        future = self.future(simulator_id)
+        with self._claim_lock:
+            if future.running() or future.done():
+                return
+            future.set_running_or_notify_cancel()
+        try:
+            future.set_result(self._build(self._rows[simulator_id]))
+        except Exception as e:
+            future.set_exception(e)
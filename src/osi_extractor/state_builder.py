@@ -1,34 +1,351 @@
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from functools import cache
+from typing import Iterable, Optional
+
+import numpy as np
 from osi3.osi_groundtruth_pb2 import GroundTruth
 from osi3.osi_object_pb2 import MovingObject
 
-from .lanegraph import LaneGraph
-from .road import RoadManager
-from .state import MovingObjectState, State, StationaryObstacle
+import osi_extractor.speedlimit_logic as speedlimit_logic
+from .deprecated_handler import get_all_assigned_lane_ids
+from .geometry import closest_projected_points
+from .lane import LaneSubtype
+from .lanegraph import NO_LANE, LaneGraph
+from .region_of_interest import RegionOfInterest
+from .road import NO_ROAD, RoadManager
+from .state import (MOVING_OBJECT_DTYPE, YAW_IS_ALREADY_RELATIVE, ColumnarState, EgoView, MovingObjectState,
+                    ProgressiveState, RoadState, State, StationaryObstacle)
+from .surroundings import Surroundings
 
 
-def create_state(ground_truth: GroundTruth, lane_graph: LaneGraph, road_manager: RoadManager, ego_id: int):
+def create_state(ground_truth: GroundTruth, lane_graph: LaneGraph, road_manager: RoadManager, ego_id: int,
+                 road_state_fields: Iterable[str] = (), region_of_interest: Optional[RegionOfInterest] = None):
+    """
+    State of all moving objects. RoadState fields are computed on first
+    access, the ones in road_state_fields (see RoadState.FIELDS) right away.
+    Objects outside region_of_interest have no road_id, road_s and
+    road_state, their yaw is converted like that of all other objects. A
+    road_id of None therefore does not tell that an object is on another
+    road than the ego, only objects with a road_state do.
+    """
+    road_manager.traffic_light_states.update(ground_truth)
     m_o_list = _create_moving_object_states(ground_truth, lane_graph,
-                                            road_manager, ego_id)
-    s_o_list = _create_static_obstacle_states(ground_truth)
-    return State(m_o_list, s_o_list, ground_truth.host_vehicle_id.value)
+                                            road_manager, ego_id, road_state_fields, region_of_interest)
+    s_o_list = _create_static_obstacle_states(ground_truth, road_manager)
+    obstacles_by_lane = _obstacles_by_lane(s_o_list)
+    return State(m_o_list, s_o_list, ground_truth.host_vehicle_id.value,
+                 surroundings=Surroundings(m_o_list, lane_graph, road_manager, obstacles_by_lane),
+                 obstacles_by_lane=obstacles_by_lane)
+
+
+def create_multi_ego_states(ground_truth: GroundTruth, lane_graph: LaneGraph, road_manager: RoadManager,
+                            ego_ids: Iterable[int], road_state_fields: Iterable[str] = (),
+                            region_of_interest: Optional[RegionOfInterest] = None) -> dict[int, State]:
+    """
+    One State per ego vehicle, all built from one set of MovingObjectStates.
+    The views only differ in the order of moving_objects and in
+    road_state.same_road_as_ego. With a region of interest, objects get
+    road context if they are inside the region of any ego.
+    """
+    road_manager.traffic_light_states.update(ground_truth)
+    osi_objects = list(ground_truth.moving_object)
+    rows = {o.id.value: row for row, o in enumerate(osi_objects)}
+    ego_ids = list(ego_ids)
+    for ego_id in ego_ids:
+        if ego_id not in rows:
+            raise RuntimeError(
+                f"Could not find ego vehicle (expected id: {ego_id})")
+    inside = np.zeros(len(osi_objects), dtype=bool) if region_of_interest is not None \
+        else np.ones(len(osi_objects), dtype=bool)
+    if region_of_interest is not None:
+        for ego_id in ego_ids:
+            inside |= region_of_interest.select(osi_objects[rows[ego_id]], osi_objects, lane_graph, road_manager)
+        inside[[rows[ego_id] for ego_id in ego_ids]] = True
+    m_o_list = [MovingObjectState(o, lane_graph, road_manager, None, road_state_fields, road_context)
+                for o, road_context in zip(osi_objects, inside.tolist())]
+    s_o_list = _create_static_obstacle_states(ground_truth, road_manager)
+    obstacles_by_lane = _obstacles_by_lane(s_o_list)
+    surroundings = Surroundings(m_o_list, lane_graph, road_manager, obstacles_by_lane)
+    return {ego_id: State(EgoView(m_o_list, rows[ego_id]), s_o_list, ground_truth.host_vehicle_id.value,
+                          surroundings=surroundings, obstacles_by_lane=obstacles_by_lane)
+            for ego_id in ego_ids}
+
+
+def create_progressive_state(ground_truth: GroundTruth, lane_graph: LaneGraph, road_manager: RoadManager,
+                             ego_id: int, road_state_fields: Iterable[str] = (),
+                             region_of_interest: Optional[RegionOfInterest] = None,
+                             executor: Optional[Executor] = None) -> ProgressiveState:
+    """
+    As create_state, but only the ego vehicle is built right away. The
+    other objects are built on request or, if an executor is given, in the
+    background by ProgressiveState.build_remaining. Surroundings are built
+    by ProgressiveState.complete.
+    """
+    # everything of this frame that build needs is captured here, objects
+    # may be built after the next frame updated the road manager
+    traffic_lights = road_manager.traffic_light_states.update(ground_truth)
+    ego_object, *other_objects = _ego_first(ground_truth, ego_id)
+    ego_state = MovingObjectState(ego_object, lane_graph, road_manager, None, road_state_fields,
+                                  traffic_lights=traffic_lights)
+
+    @cache
+    def inside() -> list[bool]:
+        if region_of_interest is None:
+            return [True] * len(other_objects)
+        return region_of_interest.select(ego_object, other_objects, lane_graph, road_manager).tolist()
+
+    def build(row: int) -> MovingObjectState:
+        return MovingObjectState(other_objects[row], lane_graph, road_manager, ego_state.road_id,
+                                 road_state_fields, inside()[row], traffic_lights=traffic_lights)
+
+    s_o_list = _create_static_obstacle_states(ground_truth, road_manager)
+    obstacles_by_lane = _obstacles_by_lane(s_o_list)
+    state = ProgressiveState(
+        ego_state, [o.id.value for o in other_objects], build, s_o_list, ground_truth.host_vehicle_id.value,
+        obstacles_by_lane,
+        lambda moving_objects: Surroundings(moving_objects, lane_graph, road_manager, obstacles_by_lane))
+    if executor is not None:
+        state.start_remaining(executor)
+    return state
+
+
+def create_columnar_state(ground_truth: GroundTruth, lane_graph: LaneGraph, road_manager: RoadManager,
+                          ego_id: int) -> ColumnarState:
+    """
+    The moving objects of create_state in one array, see ColumnarState.
+    Unlike create_state there are no road states and no surroundings.
+    """
+    road_manager.traffic_light_states.update(ground_truth)
+    objects = np.array([_moving_object_row(o) for o in _ego_first(ground_truth, ego_id)],
+                       dtype=MOVING_OBJECT_DTYPE)
+    _locate_moving_objects(objects, lane_graph, road_manager)
+    s_o_list = _create_static_obstacle_states(ground_truth, road_manager)
+    return ColumnarState(objects, s_o_list, ground_truth.host_vehicle_id.value)
+
+
+DEFAULT_MOVEMENT_THRESHOLD = 1.0
+
+
+@dataclass
+class ReuseMetrics:
+    frames: int = 0
+    objects: int = 0  # objects with a road state
+    reused: int = 0  # objects whose road state started from the previous frame
+    reused_fields: int = 0
+
+    @property
+    def reuse_ratio(self) -> float:
+        return self.reused / self.objects if self.objects > 0 else 0.0
+
+
+@dataclass
+class _ObjectHistory:
+    lane_ids: list[int]
+    anchor: np.ndarray  # position at the last computation from scratch
+    road_state: Optional[RoadState]
+
+
+class IncrementalStateBuilder:
+    """
+    create_state for consecutive frames. The road state of an object takes
+    over RoadState.REUSABLE_FIELDS computed in the previous frame, unless
+    its lanes changed, it moved more than movement_threshold since those
+    fields were computed or the lane graph was replaced. All other fields
+    are computed for the new position. On lanes with several boundary
+    pieces the markings can lag by up to movement_threshold.
+    """
+    def __init__(self, movement_threshold: float = DEFAULT_MOVEMENT_THRESHOLD,
+                 road_state_fields: Iterable[str] = (), region_of_interest: Optional[RegionOfInterest] = None):
+        self.movement_threshold = movement_threshold
+        self.road_state_fields = tuple(road_state_fields)
+        self.region_of_interest = region_of_interest
+        self.metrics = ReuseMetrics()
+        self._lane_graph: Optional[LaneGraph] = None
+        self._history: dict[int, _ObjectHistory] = {}
+
+    def create_state(self, ground_truth: GroundTruth, lane_graph: LaneGraph, road_manager: RoadManager,
+                     ego_id: int) -> State:
+        road_manager.traffic_light_states.update(ground_truth)
+        if lane_graph is not self._lane_graph:
+            self._lane_graph = lane_graph
+            self._history = {}
+        history: dict[int, _ObjectHistory] = {}
+        ego_object, *other_objects = _ego_first(ground_truth, ego_id)
+        ego_state = self._create_moving_object_state(ego_object, lane_graph, road_manager, None, True, history)
+        inside = ([True] * len(other_objects) if self.region_of_interest is None
+                  else self.region_of_interest.select(ego_object, other_objects, lane_graph, road_manager).tolist())
+        m_o_list = [ego_state] + [
+            self._create_moving_object_state(o, lane_graph, road_manager, ego_state.road_id, road_context, history)
+            for o, road_context in zip(other_objects, inside)]
+        # objects that left the scene are dropped here
+        self._history = history
+        self.metrics.frames += 1
+        s_o_list = _create_static_obstacle_states(ground_truth, road_manager)
+        obstacles_by_lane = _obstacles_by_lane(s_o_list)
+        return State(m_o_list, s_o_list, ground_truth.host_vehicle_id.value,
+                     surroundings=Surroundings(m_o_list, lane_graph, road_manager, obstacles_by_lane),
+                     obstacles_by_lane=obstacles_by_lane)
+
+    def _create_moving_object_state(self, mo: MovingObject, lane_graph: LaneGraph, road_manager: RoadManager,
+                                    ego_road_id: Optional[int], road_context: bool,
+                                    history: dict[int, _ObjectHistory]) -> MovingObjectState:
+        position = np.array([mo.base.position.x, mo.base.position.y, mo.base.position.z])
+        lane_ids = get_all_assigned_lane_ids(mo)
+        previous = self._history.get(mo.id.value)
+        if (previous is None or previous.road_state is None or previous.lane_ids != lane_ids
+                or np.linalg.norm(position - previous.anchor) > self.movement_threshold):
+            previous = None
+        mos = MovingObjectState(mo, lane_graph, road_manager, ego_road_id, self.road_state_fields, road_context,
+                                previous.road_state if previous is not None else None)
+        history[mo.id.value] = _ObjectHistory(
+            lane_ids, previous.anchor if previous is not None else position, mos.road_state)
+        if mos.road_state is not None:
+            self.metrics.objects += 1
+            self.metrics.reused += previous is not None
+            self.metrics.reused_fields += mos.road_state.reused_fields
+        return mos
+
+
+def _ego_first(ground_truth: GroundTruth, ego_id: int) -> list[MovingObject]:
+    ego_object: 'MovingObject | None' = next(
+        (o for o in ground_truth.moving_object if o.id.value == ego_id), None)
+    if ego_object is None:
+        raise RuntimeError(
+            f"Could not find ego vehicle (expected id: {ego_id})")
+    return [ego_object] + [o for o in ground_truth.moving_object if o.id.value != ego_id]
+
 
 def _create_moving_object_states(
     ground_truth: GroundTruth,
     lane_graph: LaneGraph,
     road_manager: RoadManager,
     ego_id: int,
+    road_state_fields: Iterable[str] = (),
+    region_of_interest: Optional[RegionOfInterest] = None,
 ):
-    ego_object: 'MovingObject | None' = next(
-        (o for o in ground_truth.moving_object if o.id.value == ego_id), None)
-    if ego_object is None:
-        raise RuntimeError(
-            f"Could not find ego vehicle (expected id: {ego_id})")
-    ego_state = MovingObjectState(ego_object, lane_graph, road_manager, None)
+    ego_object, *other_objects = _ego_first(ground_truth, ego_id)
+    ego_state = MovingObjectState(ego_object, lane_graph, road_manager, None, road_state_fields)
     ego_road_id = ego_state.road_id
-    return [ego_state] + [MovingObjectState(o, lane_graph, road_manager, ego_road_id)
-                          for o in ground_truth.moving_object
-                          if o.id.value != ego_id]
+    inside = ([True] * len(other_objects) if region_of_interest is None
+              else region_of_interest.select(ego_object, other_objects, lane_graph, road_manager).tolist())
+    return [ego_state] + [MovingObjectState(o, lane_graph, road_manager, ego_road_id, road_state_fields, road_context)
+                          for o, road_context in zip(other_objects, inside)]
+
+
+def _moving_object_row(mo: MovingObject) -> tuple:
+    # one tuple per object in MOVING_OBJECT_DTYPE order, the road columns are filled in by _locate_moving_objects
+    base = mo.base
+    light_state = mo.vehicle_classification.light_state
+    lane_ids = get_all_assigned_lane_ids(mo)
+    return (
+        mo.id.value,
+        mo.type,
+        (base.dimension.length, base.dimension.width, base.dimension.height),
+        (base.position.x, base.position.y, base.position.z),
+        (base.velocity.x, base.velocity.y, base.velocity.z),
+        (base.acceleration.x, base.acceleration.y, base.acceleration.z),
+        (base.orientation.yaw, base.orientation.pitch, base.orientation.roll),
+        light_state.indicator_state,
+        light_state.brake_light_state,
+        light_state.front_fog_light,
+        light_state.rear_fog_light,
+        light_state.head_light,
+        light_state.high_beam,
+        light_state.reversing_light,
+        light_state.license_plate_illumination_rear,
+        light_state.emergency_vehicle_illumination,
+        light_state.service_vehicle_illumination,
+        lane_ids[0] if len(lane_ids) > 0 else NO_LANE,
+        NO_ROAD,
+        np.nan,
+        np.nan,
+        np.nan,
+        np.nan,
+    )
+
+
+def _locate_moving_objects(objects: np.ndarray, lane_graph: LaneGraph, road_manager: RoadManager):
+    """
+    Batched road part of MovingObjectState: road id, road s, lane position,
+    speed limit and (if YAW_IS_ALREADY_RELATIVE) absolute yaw of all objects.
+    As there, the yaw is converted for every object on a lane of the graph,
+    objects without a known lane keep the yaw of the ground truth.
+    """
+    lanes = lane_graph.indices_of(objects["lane_id"].tolist())
+    in_graph = np.flatnonzero(lanes != NO_LANE)
+    graph_indptr = lane_graph.centerline_indptr
+    centerline_points = lane_graph.centerline_points
+    with_centerline = in_graph[graph_indptr[lanes[in_graph] + 1] > graph_indptr[lanes[in_graph]]]
+    if YAW_IS_ALREADY_RELATIVE and len(with_centerline) > 0:
+        # every object on a known lane, as MovingObjectState does, not only the located ones
+        centerline_lanes = lanes[with_centerline]
+        vertex, _ = closest_projected_points(
+            objects["location"][with_centerline], centerline_points,
+            graph_indptr[centerline_lanes], graph_indptr[centerline_lanes + 1])
+        projected = vertex >= 0
+        direction = centerline_points[vertex[projected] + 1] - centerline_points[vertex[projected]]
+        road_angle = np.arctan2(direction[:, 0], direction[:, 1])  # as geometry.angle_of_segment
+        yaw = objects["orientation"][with_centerline[projected], 0]
+        objects["orientation"][with_centerline[projected], 0] = (yaw + road_angle + 2*np.pi) % (2*np.pi)
+
+    lane_road_ids = road_manager.lane_road_ids
+    on_road = in_graph[lane_road_ids[lanes[in_graph]] != NO_ROAD]
+    objects["road_id"][on_road] = lane_road_ids[lanes[on_road]]
+    located = on_road[graph_indptr[lanes[on_road] + 1] > graph_indptr[lanes[on_road]]]
+    if len(located) == 0:
+        return
+    lanes = lanes[located]
+    roads = objects["road_id"][located]
+    positions = objects["location"][located]
+
+    road_s, _, _ = road_manager.project_onto_sections(lanes, positions)
+    objects["road_s"][located] = road_s
+    objects["road_length"][located] = road_manager.road_lengths[roads]
+
+    boundary_points = []
+    left_indptr, left_points, right_indptr, right_points = lane_graph.boundaries
+    for indptr, points in ((left_indptr, left_points), (right_indptr, right_points)):
+        vertex, progress = closest_projected_points(positions, points, indptr[lanes], indptr[lanes + 1])
+        start = points[np.maximum(vertex, 0)]
+        end = points[np.minimum(np.maximum(vertex, 0) + 1, len(points) - 1)]
+        boundary_points.append(np.where(
+            (vertex >= 0)[:, np.newaxis], start + progress[:, np.newaxis] * (end - start), np.nan))
+    left, right = boundary_points
+    with np.errstate(divide="ignore", invalid="ignore"):
+        objects["lane_position"][located] = (np.linalg.norm(positions - left, axis=1)
+                                             / np.linalg.norm(left - right, axis=1))
+
+    ignore_exit_speed_signs = (road_manager.road_on_highway[roads]
+                               & (lane_graph.lane_subtypes[lanes] != LaneSubtype.EXIT.value))
+    groups = np.unique(np.stack([roads, ignore_exit_speed_signs]), axis=1)
+    for road_id, ignore in groups.T.tolist():
+        selected = np.flatnonzero((roads == road_id) & (ignore_exit_speed_signs == ignore))
+        objects["speed_limit"][located[selected]] = speedlimit_logic.calculate_speedlimits(
+            road_manager.roads[road_id], road_s[selected], bool(ignore))
+
+
+def _create_static_obstacle_states(ground_truth: GroundTruth, road_manager: RoadManager) -> list[StationaryObstacle]:
+    osi_objects = list(ground_truth.stationary_object)
+    locations = road_manager.locate_stationary_objects(
+        [o.id.value for o in osi_objects],
+        np.array([(o.base.position.x, o.base.position.y, o.base.position.z) for o in osi_objects]))
+    obstacles = []
+    for o, location in zip(osi_objects, locations):
+        if location.road_id == NO_ROAD:
+            obstacles.append(StationaryObstacle(o.base.dimension, o.base.position, o.id.value))
+            continue
+        obstacles.append(StationaryObstacle(
+            o.base.dimension, o.base.position, o.id.value, location.lane_id, location.road_id, location.s,
+            location.t, location.lane_distance - o.base.dimension.width / 2 < location.lane_width / 2))
+    return obstacles
 
 
-def _create_static_obstacle_states(ground_truth: GroundTruth):
-    return [StationaryObstacle(o.base.dimension, o.base.position) for o in ground_truth.stationary_object]
+def _obstacles_by_lane(obstacles: list[StationaryObstacle]) -> dict[int, list[StationaryObstacle]]:
+    by_lane: dict[int, list[StationaryObstacle]] = {}
+    for obstacle in obstacles:
+        if obstacle.blocks_lane:
+            by_lane.setdefault(obstacle.lane_id, []).append(obstacle)
+    for lane_obstacles in by_lane.values():
+        lane_obstacles.sort(key=lambda obstacle: obstacle.road_s)
+    return by_lane
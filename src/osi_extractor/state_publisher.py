@@ -0,0 +1,439 @@
+import json
+import os
+import selectors
+import socket
+import stat
+import struct
+from dataclasses import dataclass
+from typing import Optional, Union
+
+import numpy as np
+
+from .road import NO_ROAD
+from .state import MOVING_OBJECT_DTYPE, ColumnarState
+
+# a frame or subscription is a uint32 length followed by that many bytes
+LENGTH = struct.Struct("<I")
+# frame number, ego id, host vehicle id, keyframe, number of removed ids, number of field blocks
+FRAME_HEADER = struct.Struct("<qqqBIH")
+# field index in Subscription.fields, number of objects
+BLOCK_HEADER = struct.Struct("<HI")
+MAX_PENDING_BYTES = 2**22  # subscribers with more unsent bytes skip frames
+RECEIVE_SIZE = 2**16
+
+Address = Union[str, tuple[str, int]]  # path of a Unix domain socket or TCP host and port
+
+
+@dataclass(frozen=True)
+class Subscription:
+    """
+    What a subscriber receives: the fields of MOVING_OBJECT_DTYPE in fields
+    (all if None, simulator_id is always included) of the objects within
+    max_distance of the ego vehicle and, with same_road_as_ego, on the road
+    of the ego vehicle. The ego vehicle is always included.
+    """
+    fields: Optional[tuple[str, ...]] = None
+    max_distance: Optional[float] = None
+    same_road_as_ego: bool = False
+
+    def __post_init__(self):
+        if self.fields is not None:
+            for field in self.fields:
+                if field not in MOVING_OBJECT_DTYPE.names:
+                    raise ValueError(f"Unknown moving object field {field}")
+            object.__setattr__(self, "fields", tuple(field for field in self.fields if field != "simulator_id"))
+            if len(self.fields) == 0:
+                # frames only carry field blocks, an empty one would never announce an object
+                raise ValueError("Subscription needs at least one field besides simulator_id")
+
+    @property
+    def encoded_fields(self) -> tuple[str, ...]:
+        if self.fields is None:
+            return MOVING_OBJECT_DTYPE.names[1:]
+        return self.fields
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype([(field, MOVING_OBJECT_DTYPE.fields[field][0])
+                         for field in ("simulator_id",) + self.encoded_fields])
+
+    def to_bytes(self) -> bytes:
+        return json.dumps({"fields": self.fields, "max_distance": self.max_distance,
+                           "same_road_as_ego": self.same_road_as_ego}).encode()
+
+    @staticmethod
+    def from_bytes(data: bytes) -> "Subscription":
+        request = json.loads(data.decode())
+        fields = request.get("fields")
+        return Subscription(tuple(fields) if fields is not None else None, request.get("max_distance"),
+                            bool(request.get("same_road_as_ego", False)))
+
+    def select(self, objects: np.ndarray) -> np.ndarray:
+        """Mask of the rows of a ColumnarState array (ego in row 0) this subscription receives."""
+        inside = np.ones(len(objects), dtype=bool)
+        if len(objects) == 0:
+            return inside
+        if self.max_distance is not None:
+            offsets = objects["location"][:, :2] - objects["location"][0, :2]
+            inside &= np.einsum("ij,ij->i", offsets, offsets) <= self.max_distance ** 2
+        if self.same_road_as_ego and objects["road_id"][0] != NO_ROAD:
+            inside &= objects["road_id"] == objects["road_id"][0]
+        inside[0] = True
+        return inside
+
+
+def _row_bytes(objects: np.ndarray) -> np.ndarray:
+    # objects as one row of raw bytes each: copying rows and comparing them
+    # is much faster than with the structured rows, and NaN equals itself
+    objects = np.ascontiguousarray(objects, dtype=MOVING_OBJECT_DTYPE)
+    return objects.view(np.uint8).reshape(len(objects), MOVING_OBJECT_DTYPE.itemsize)
+
+
+class _Group:
+    """
+    Subscribers with the same subscription. The delta to the previous frame
+    is encoded once for all of them; subscribers that joined or skipped a
+    frame get a keyframe, also encoded at most once per frame.
+    """
+    def __init__(self, subscription: Subscription):
+        self.subscription = subscription
+        self.subscribers: list[_Subscriber] = []
+        self._ids = np.zeros(0, dtype=np.int64)  # sorted
+        self._rows = np.zeros((0, MOVING_OBJECT_DTYPE.itemsize), dtype=np.uint8)  # of _ids, see _row_bytes
+        self._header: Optional[tuple[int, int, int]] = None  # of the latest frame
+        self._keyframe: Optional[bytes] = None
+        # byte ranges of the encoded fields in a row
+        self._fields = [(MOVING_OBJECT_DTYPE.fields[field][1],
+                         MOVING_OBJECT_DTYPE.fields[field][1] + MOVING_OBJECT_DTYPE.fields[field][0].itemsize)
+                        for field in subscription.encoded_fields]
+
+    def publish(self, frame: int, state: ColumnarState):
+        selected = self.subscription.select(state.objects)
+        selected_ids = state.objects["simulator_id"][selected]
+        order = np.argsort(selected_ids, kind="stable")
+        ids = selected_ids[order]
+        rows = _row_bytes(state.objects)[np.flatnonzero(selected)[order]]
+        header = (frame, int(state.objects["simulator_id"][0]) if len(state.objects) > 0 else 0,
+                  state.host_vehicle_id)
+        delta = None
+        for subscriber in self.subscribers:
+            if subscriber.synced and len(subscriber.pending) <= MAX_PENDING_BYTES:
+                if delta is None:
+                    delta = self._encode(header, ids, rows, self._ids, self._rows)
+                subscriber.pending += delta
+            else:
+                subscriber.synced = False
+        self._ids, self._rows, self._header, self._keyframe = ids, rows, header, None
+        for subscriber in self.subscribers:
+            self.catch_up(subscriber)
+
+    def catch_up(self, subscriber: "_Subscriber"):
+        """Queue a keyframe of the latest frame for a subscriber that missed frames, once it has room."""
+        if subscriber.synced or self._header is None or len(subscriber.pending) > MAX_PENDING_BYTES:
+            return
+        if self._keyframe is None:
+            self._keyframe = self._encode(self._header, self._ids, self._rows, None, None)
+        subscriber.pending += self._keyframe
+        subscriber.synced = True
+
+    def _encode(self, header: tuple[int, int, int], ids: np.ndarray, rows: np.ndarray,
+                previous_ids: Optional[np.ndarray], previous_rows: Optional[np.ndarray]) -> bytes:
+        if previous_ids is None or len(previous_ids) == 0:
+            removed = np.zeros(0, dtype=np.int64)
+            changed = np.arange(len(ids))
+            is_new = np.ones(len(ids), dtype=bool)
+            previous = None
+        else:
+            removed = np.setdiff1d(previous_ids, ids, assume_unique=True)
+            matches = np.minimum(np.searchsorted(previous_ids, ids), len(previous_ids) - 1)
+            is_new = previous_ids[matches] != ids
+            # whole rows first, the fields are only compared for rows that changed
+            row_changed = is_new.copy()
+            row_changed[~is_new] = (rows[~is_new] != previous_rows[matches[~is_new]]).any(axis=1)
+            changed = np.flatnonzero(row_changed)
+            is_new = is_new[changed]
+            previous = previous_rows[matches[changed]]
+        current = rows[changed]
+        blocks = []
+        for index, (start, end) in enumerate(self._fields if len(changed) > 0 else ()):
+            if previous is None:
+                field_changed = is_new
+            else:
+                field_changed = is_new | (current[:, start:end] != previous[:, start:end]).any(axis=1)
+            if not field_changed.any():
+                continue
+            changed_ids = ids[changed[field_changed]]
+            blocks.append(BLOCK_HEADER.pack(index, len(changed_ids)))
+            blocks.append(changed_ids.tobytes())
+            blocks.append(np.ascontiguousarray(current[field_changed, start:end]).tobytes())
+        payload = b"".join([FRAME_HEADER.pack(*header, previous_ids is None, len(removed), len(blocks) // 3),
+                            removed.astype(np.int64).tobytes()] + blocks)
+        return LENGTH.pack(len(payload)) + payload
+
+
+class _Subscriber:
+    def __init__(self, connection: socket.socket):
+        self.connection = connection
+        self.received = bytearray()  # until the subscription is complete
+        self.group: Optional[_Group] = None
+        self.pending = bytearray()
+        self.synced = False  # received the previous frame of its group
+
+
+class StatePublisher:
+    """
+    Serves ColumnarStates to local subscribers (see StateSubscriber) over a
+    Unix domain socket (address is a path) or TCP (address is host and
+    port). Frames carry only the objects and fields that changed since the
+    previous frame of the subscriber, so their size and encoding time grow
+    with the change and not with the scenario.
+
+    Everything runs on the thread calling publish and poll: publish also
+    accepts new subscribers and sends what the sockets take, poll does the
+    same between frames. A subscriber that does not keep up skips frames
+    and continues with a keyframe.
+    """
+    def __init__(self, address: Address):
+        self.address = address
+        self.frame = 0
+        self._groups: dict[Subscription, _Group] = {}
+        self._subscribers: dict[socket.socket, _Subscriber] = {}
+        self._listener: Optional[socket.socket] = None
+        self._selector: Optional[selectors.BaseSelector] = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, *args) -> bool:
+        self.close()
+        return exc_type is None
+
+    def open(self):
+        family = socket.AF_UNIX if isinstance(self.address, str) else socket.AF_INET
+        if family == socket.AF_UNIX:
+            self._remove_stale_socket()
+        listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            listener.bind(self.address)
+        except OSError:
+            listener.close()
+            raise
+        # from here on close releases the listener and, for Unix sockets, its path
+        self._listener = listener
+        self._listener.listen()
+        self._listener.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+
+    def close(self):
+        """Release what open created, also after a failed open or a second close."""
+        if self._selector is not None:
+            for connection in list(self._subscribers):
+                self._remove(connection)
+            self._selector.close()
+            self._selector = None
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+            if isinstance(self.address, str) and os.path.exists(self.address):
+                os.unlink(self.address)
+
+    def _remove_stale_socket(self):
+        # the path of a publisher that crashed before close, nobody accepts on it
+        try:
+            if not stat.S_ISSOCK(os.stat(self.address).st_mode):
+                return
+        except FileNotFoundError:
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(self.address)
+            except ConnectionRefusedError:
+                os.unlink(self.address)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, state: ColumnarState) -> int:
+        self.poll(0)
+        self.frame += 1
+        for group in self._groups.values():
+            group.publish(self.frame, state)
+        self._flush()
+        return self.frame
+
+    def poll(self, timeout: Optional[float] = 0):
+        for key, events in self._selector.select(timeout):
+            if key.fileobj is self._listener:
+                self._accept()
+                continue
+            if events & selectors.EVENT_READ:
+                self._receive(key.fileobj)
+        self._flush()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self._listener.accept()
+            except BlockingIOError:
+                return
+            connection.setblocking(False)
+            self._subscribers[connection] = _Subscriber(connection)
+            self._selector.register(connection, selectors.EVENT_READ)
+
+    def _receive(self, connection: socket.socket):
+        subscriber = self._subscribers.get(connection)
+        if subscriber is None:
+            return
+        try:
+            data = connection.recv(RECEIVE_SIZE)
+        except BlockingIOError:
+            return
+        except ConnectionError:
+            data = b""
+        if len(data) == 0:
+            self._remove(connection)
+            return
+        if subscriber.group is not None:
+            return  # nothing is expected after the subscription
+        subscriber.received += data
+        if len(subscriber.received) < LENGTH.size:
+            return
+        length, = LENGTH.unpack_from(subscriber.received)
+        if len(subscriber.received) < LENGTH.size + length:
+            return
+        try:
+            subscription = Subscription.from_bytes(bytes(subscriber.received[LENGTH.size:LENGTH.size + length]))
+        except ValueError as error:
+            print(f"WARNING: Invalid subscription: {error}")
+            self._remove(connection)
+            return
+        group = self._groups.get(subscription)
+        if group is None:
+            group = self._groups[subscription] = _Group(subscription)
+        group.subscribers.append(subscriber)
+        subscriber.group = group
+        group.catch_up(subscriber)
+
+    def _flush(self):
+        for connection, subscriber in list(self._subscribers.items()):
+            if len(subscriber.pending) == 0:
+                continue
+            try:
+                sent = connection.send(subscriber.pending)
+            except BlockingIOError:
+                continue
+            except OSError:
+                self._remove(connection)
+                continue
+            del subscriber.pending[:sent]
+            if subscriber.group is not None:
+                subscriber.group.catch_up(subscriber)
+            # wait for the socket to take more only while something is left
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if len(subscriber.pending) > 0 else 0)
+            if self._selector.get_key(connection).events != events:
+                self._selector.modify(connection, events)
+
+    def _remove(self, connection: socket.socket):
+        subscriber = self._subscribers.pop(connection)
+        if subscriber.group is not None:
+            subscriber.group.subscribers.remove(subscriber)
+            if len(subscriber.group.subscribers) == 0:
+                del self._groups[subscriber.group.subscription]
+        self._selector.unregister(connection)
+        connection.close()
+
+
+class StateSubscriber:
+    """
+    Receives the frames of a StatePublisher and applies them to a local
+    copy. receive blocks for the next frame and returns the objects in
+    subscription.dtype, the ego vehicle in row 0. Stationary obstacles are
+    not published.
+    """
+    def __init__(self, address: Address, subscription: Subscription = Subscription()):
+        self.address = address
+        self.subscription = subscription
+        self.frame = 0
+        self.received_bytes = 0
+        self._dtype = subscription.dtype
+        self._ids = np.zeros(0, dtype=np.int64)  # sorted
+        self._objects = np.zeros(0, dtype=self._dtype)
+        self.socket: Optional[socket.socket] = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, *args) -> bool:
+        self.close()
+        return exc_type is None
+
+    def open(self):
+        family = socket.AF_UNIX if isinstance(self.address, str) else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.connect(self.address)
+        request = self.subscription.to_bytes()
+        self.socket.sendall(LENGTH.pack(len(request)) + request)
+
+    def close(self):
+        self.socket.close()
+
+    def fileno(self) -> int:
+        return self.socket.fileno()
+
+    def _read(self, n: int) -> bytes:
+        data = bytearray()
+        while len(data) < n:
+            chunk = self.socket.recv(n - len(data))
+            if len(chunk) == 0:
+                raise ConnectionError("State publisher closed the connection")
+            data += chunk
+        return bytes(data)
+
+    def receive(self) -> ColumnarState:
+        length, = LENGTH.unpack(self._read(LENGTH.size))
+        payload = self._read(length)
+        self.received_bytes += LENGTH.size + length
+        frame, ego_id, host_vehicle_id, keyframe, removed_count, block_count = FRAME_HEADER.unpack_from(payload)
+        offset = FRAME_HEADER.size
+        if keyframe:
+            self._ids = np.zeros(0, dtype=np.int64)
+            self._objects = np.zeros(0, dtype=self._dtype)
+        removed = np.frombuffer(payload, np.int64, removed_count, offset)
+        offset += 8 * removed_count
+        if removed_count > 0:
+            kept = ~np.isin(self._ids, removed)
+            self._ids, self._objects = self._ids[kept], self._objects[kept]
+        fields = self.subscription.encoded_fields
+        for _ in range(block_count):
+            index, count = BLOCK_HEADER.unpack_from(payload, offset)
+            offset += BLOCK_HEADER.size
+            ids = np.frombuffer(payload, np.int64, count, offset)
+            offset += 8 * count
+            new_ids = np.setdiff1d(ids, self._ids, assume_unique=True)
+            if len(new_ids) > 0:
+                self._add(new_ids)
+            field_dtype = self._dtype.fields[fields[index]][0]
+            values = np.frombuffer(payload, field_dtype.base, count * field_dtype.itemsize // field_dtype.base.itemsize,
+                                   offset).reshape((count,) + field_dtype.shape)
+            offset += count * field_dtype.itemsize
+            self._objects[fields[index]][np.searchsorted(self._ids, ids)] = values
+        self.frame = frame
+        ego_rows = np.flatnonzero(self._ids == ego_id)
+        order = np.arange(len(self._ids))
+        if len(ego_rows) > 0:
+            order = np.concatenate((ego_rows, np.delete(order, ego_rows[0])))
+        return ColumnarState(self._objects[order], [], host_vehicle_id)
+
+    def _add(self, new_ids: np.ndarray):
+        objects = np.zeros(len(new_ids), dtype=self._dtype)
+        objects["simulator_id"] = new_ids
+        ids = np.concatenate((self._ids, new_ids))
+        order = np.argsort(ids, kind="stable")
+        self._ids = ids[order]
+        self._objects = np.concatenate((self._objects, objects))[order]
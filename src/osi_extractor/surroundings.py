@@ -0,0 +1,191 @@
+import bisect
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from .lanegraph import NO_LANE, LaneGraph
+from .road import NO_ROAD, RoadManager
+from .state import MovingObjectState, StationaryObstacle
+
+SURROUNDING_MAX_DISTANCE = 200.0  # how far leaders and followers are searched for
+MAX_LANE_HOPS = 4  # successor / predecessor lanes searched beyond the current one
+
+
+@dataclass
+class SurroundingVehicle:
+    state: MovingObjectState
+    gap: float  # bumper to bumper along the road
+    relative_speed: float  # speed of state minus speed of the reference object
+
+
+class Surroundings:
+    """
+    Objects of a state sorted by road s per lane and per road. Leaders are
+    ahead in the driving direction of the lane, on the same lane or on its
+    successors within the same road (followers likewise behind, through
+    predecessors). Objects without road coordinates are not indexed.
+
+    ttc and thw hold the time to collision and time headway to the leader
+    for every row of the state: inf without a leader (or if the gap does
+    not close for ttc), NaN for objects that are not indexed.
+    """
+    def __init__(self, moving_objects: list[MovingObjectState], lane_graph: LaneGraph, road_manager: RoadManager,
+                 obstacles_by_lane: Optional[dict[int, list[StationaryObstacle]]] = None):
+        self._objects = moving_objects
+        self._obstacles_by_lane: dict[int, tuple[list[float], list[StationaryObstacle]]] = {
+            lane_graph.index_of(lane_id): ([obstacle.road_s for obstacle in obstacles], obstacles)
+            for lane_id, obstacles in (obstacles_by_lane or {}).items() if lane_graph.index_of(lane_id) is not None}
+        self._lane_graph = lane_graph
+        self._road_manager = road_manager
+        self._rows: dict[int, int] = {mo.simulator_id: row for row, mo in enumerate(moving_objects)}
+        n = len(moving_objects)
+        self._lane = lane_graph.indices_of(mo.lane_ids[0] if mo.road_s is not None else NO_LANE
+                                           for mo in moving_objects)
+        self._s = np.array([mo.road_s[0] if mo.road_s is not None else np.nan for mo in moving_objects],
+                           dtype=np.float64)
+        self._speed = np.array([mo.velocity.total_mps for mo in moving_objects], dtype=np.float64)
+        self._length = np.array([mo.dimensions.length for mo in moving_objects], dtype=np.float64)
+        indexed = np.flatnonzero((self._lane != NO_LANE) & ~np.isnan(self._s))
+        self._direction = np.ones(n, dtype=np.int64)
+        self._direction[indexed] = np.where(road_manager.lane_against_road[self._lane[indexed]], -1, 1)
+
+        # rows sorted by lane and road s, per lane a slice of that order
+        order = indexed[np.lexsort((self._s[indexed], self._lane[indexed]))]
+        lane_starts = np.flatnonzero(np.diff(self._lane[order], prepend=-2))
+        lane_ends = np.append(lane_starts[1:], len(order))
+        self._by_lane: dict[int, tuple[list[float], list[int]]] = {
+            int(self._lane[order[start]]): (self._s[order[start:end]].tolist(), order[start:end].tolist())
+            for start, end in zip(lane_starts.tolist(), lane_ends.tolist())}
+        roads = road_manager.lane_road_ids[self._lane[indexed]]
+        road_order = np.lexsort((self._s[indexed], roads))
+        road_starts = np.flatnonzero(np.diff(roads[road_order], prepend=NO_ROAD - 1))
+        road_ends = np.append(road_starts[1:], len(road_order))
+        self._by_road: dict[int, tuple[list[float], list[int]]] = {
+            int(roads[road_order[start]]): (self._s[indexed[road_order[start:end]]].tolist(),
+                                            indexed[road_order[start:end]].tolist())
+            for start, end in zip(road_starts.tolist(), road_ends.tolist())}
+
+        self.leader_rows = np.full(n, -1, dtype=np.int64)
+        # the next object in the sorted order of the same lane, in the driving direction
+        same_lane_next = np.append(self._lane[order[1:]] == self._lane[order[:-1]], False)
+        same_lane_previous = np.insert(same_lane_next[:-1], 0, False)
+        along = self._direction[order] > 0
+        take_next = along & same_lane_next
+        take_previous = ~along & same_lane_previous
+        self.leader_rows[order[take_next]] = order[np.flatnonzero(take_next) + 1]
+        self.leader_rows[order[take_previous]] = order[np.flatnonzero(take_previous) - 1]
+        too_far = np.abs(self._s[order] - self._s[self.leader_rows[order]]) > SURROUNDING_MAX_DISTANCE
+        self.leader_rows[order[(take_next | take_previous) & too_far]] = -1
+        # the first (last) object of a lane looks further on the successor lanes
+        for row in order[~(take_next | take_previous)].tolist():
+            leader = self._search(row, self._lane[row], ahead=True, first_lane_done=True)
+            if leader is not None:
+                self.leader_rows[row] = leader
+
+        has_leader = self.leader_rows >= 0
+        leader_rows = self.leader_rows[has_leader]
+        gap = np.full(n, np.inf)
+        gap[has_leader] = (np.abs(self._s[leader_rows] - self._s[has_leader])
+                           - (self._length[leader_rows] + self._length[has_leader]) / 2)
+        closing = np.zeros(n)
+        closing[has_leader] = self._speed[has_leader] - self._speed[leader_rows]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.ttc = np.where(has_leader & (closing > 0), gap / closing, np.inf)
+            self.thw = np.where(has_leader & (self._speed > 0), gap / self._speed, np.inf)
+        not_indexed = np.ones(n, dtype=bool)
+        not_indexed[indexed] = False
+        self.ttc[not_indexed] = np.nan
+        self.thw[not_indexed] = np.nan
+
+    def leader(self, mo: MovingObjectState) -> Optional[SurroundingVehicle]:
+        row = self._rows[mo.simulator_id]
+        return self._surrounding(row, int(self.leader_rows[row]))
+
+    def follower(self, mo: MovingObjectState) -> Optional[SurroundingVehicle]:
+        row = self._rows[mo.simulator_id]
+        if self._lane[row] == NO_LANE:
+            return None
+        return self._surrounding(row, self._search(row, self._lane[row], ahead=False))
+
+    def neighbours(self, mo: MovingObjectState, lane_offset: int) \
+            -> tuple[Optional[SurroundingVehicle], Optional[SurroundingVehicle]]:
+        """
+        Leader and follower on the lane lane_offset lanes to the left
+        (positive) or right (negative) of the object's lane.
+        """
+        row = self._rows[mo.simulator_id]
+        lane = int(self._lane[row])
+        neighbour = self._lane_graph.left_lanes if lane_offset > 0 else self._lane_graph.right_lanes
+        for _ in range(abs(lane_offset)):
+            if lane == NO_LANE:
+                break
+            lane = int(neighbour[lane])
+        if lane == NO_LANE:
+            return None, None
+        return (self._surrounding(row, self._search(row, lane, ahead=True)),
+                self._surrounding(row, self._search(row, lane, ahead=False)))
+
+    def next_obstacle(self, mo: MovingObjectState) -> Optional[tuple[StationaryObstacle, float]]:
+        """
+        The closest obstacle blocking the object's lane (or its successors on
+        the same road) ahead of it and the distance from the object's
+        front to the obstacle's centre.
+        """
+        row = self._rows[mo.simulator_id]
+        lane = int(self._lane[row])
+        if lane == NO_LANE:
+            return None
+        s = self._s[row]
+        forward = self._direction[row] > 0
+        road_id = self._road_manager.lane_road_ids[lane]
+        for _ in range(MAX_LANE_HOPS + 1):
+            obstacle_s, obstacles = self._obstacles_by_lane.get(lane, ([], []))
+            i = bisect.bisect_right(obstacle_s, s) if forward else bisect.bisect_left(obstacle_s, s) - 1
+            if 0 <= i < len(obstacles) and abs(obstacle_s[i] - s) <= SURROUNDING_MAX_DISTANCE:
+                return obstacles[i], float(abs(obstacle_s[i] - s) - self._length[row] / 2)
+            lane = int(self._lane_graph.successor_lanes[lane])
+            if lane == NO_LANE or self._road_manager.lane_road_ids[lane] != road_id:
+                return None
+        return None
+
+    def on_road(self, road_id: int, s_min: float, s_max: float) -> list[MovingObjectState]:
+        """Objects on a road with s_min <= road s <= s_max, sorted by road s."""
+        road_s, rows = self._by_road.get(road_id, ([], []))
+        return [self._objects[row] for row in
+                rows[bisect.bisect_left(road_s, s_min):bisect.bisect_right(road_s, s_max)]]
+
+    def _search(self, row: int, lane: int, ahead: bool, first_lane_done: bool = False) -> Optional[int]:
+        # closest object ahead of (behind) row on lane or the lanes following (preceding) it on the same road
+        s = self._s[row]
+        forward = (self._direction[row] > 0) == ahead
+        road_id = self._road_manager.lane_road_ids[lane]
+        # on a lane driven the other way than the object's own lane (e.g. the
+        # neighbour on a two-way road) the successors lie behind the object
+        along_lane = ahead == ((self._direction[row] < 0) == self._road_manager.lane_against_road[lane])
+        next_lane = self._lane_graph.successor_lanes if along_lane else self._lane_graph.predecessor_lanes
+        for hop in range(MAX_LANE_HOPS + 1):
+            if hop > 0 or not first_lane_done:
+                lane_s, rows = self._by_lane.get(lane, ([], []))
+                if forward:
+                    i = bisect.bisect_right(lane_s, s)
+                    while i < len(rows) and rows[i] == row:
+                        i += 1
+                    if i < len(rows) and lane_s[i] - s <= SURROUNDING_MAX_DISTANCE:
+                        return rows[i]
+                else:
+                    i = bisect.bisect_left(lane_s, s) - 1
+                    while i >= 0 and rows[i] == row:
+                        i -= 1
+                    if i >= 0 and s - lane_s[i] <= SURROUNDING_MAX_DISTANCE:
+                        return rows[i]
+            lane = int(next_lane[lane])
+            if lane == NO_LANE or self._road_manager.lane_road_ids[lane] != road_id:
+                return None
+        return None
+
+    def _surrounding(self, row: int, other: Optional[int]) -> Optional[SurroundingVehicle]:
+        if other is None or other < 0:
+            return None
+        gap = abs(self._s[other] - self._s[row]) - (self._length[other] + self._length[row]) / 2
+        return SurroundingVehicle(self._objects[other], float(gap), float(self._speed[other] - self._speed[row]))
@@ -0,0 +1,96 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from osi3.osi_groundtruth_pb2 import GroundTruth
+
+
+@dataclass(frozen=True)
+class TrafficLightState:
+    traffic_light_id: int
+    color: int  # TrafficLight.Classification.Color
+    mode: int  # TrafficLight.Classification.Mode
+    counter: float
+
+
+class TrafficLightFrame:
+    """
+    Colours, modes and counters of all traffic lights in one frame, by slot
+    of TrafficLightStates. A frame is never changed after it was created,
+    states built from it keep their lights when later frames arrive.
+    """
+    def __init__(self, ids: np.ndarray, colors: np.ndarray, modes: np.ndarray, counters: np.ndarray):
+        self.ids = ids
+        self.colors = colors
+        self.modes = modes
+        self.counters = counters
+
+    def state(self, slot: int) -> TrafficLightState:
+        return TrafficLightState(
+            traffic_light_id=int(self.ids[slot]),
+            color=int(self.colors[slot]),
+            mode=int(self.modes[slot]),
+            counter=float(self.counters[slot]),
+        )
+
+
+class TrafficLightStates:
+    """
+    Dynamic state of the traffic lights of a map.
+
+    The set of lights (and their lane and road assignment) is fixed per
+    map, every light gets a slot in the state arrays. A frame only updates
+    the colour, mode and counter arrays, no geometry is involved. Every
+    update replaces frame with a new TrafficLightFrame instead of writing
+    into the arrays of the previous one.
+    """
+    def __init__(self, traffic_light_ids: list[int]):
+        self.slots: dict[int, int] = {id: slot for slot, id in enumerate(traffic_light_ids)}
+        self.ids = np.array(traffic_light_ids, dtype=np.int64)
+        self.frame = TrafficLightFrame(
+            self.ids,
+            np.zeros(len(traffic_light_ids), dtype=np.int64),  # COLOR_UNKNOWN
+            np.zeros(len(traffic_light_ids), dtype=np.int64),  # MODE_UNKNOWN
+            np.full(len(traffic_light_ids), np.nan),
+        )
+
+    @property
+    def colors(self) -> np.ndarray:
+        return self.frame.colors
+
+    @property
+    def modes(self) -> np.ndarray:
+        return self.frame.modes
+
+    @property
+    def counters(self) -> np.ndarray:
+        return self.frame.counters
+
+    def update(self, gt: GroundTruth) -> TrafficLightFrame:
+        slots = []
+        colors = []
+        modes = []
+        counters = []
+        for traffic_light in gt.traffic_light:
+            slot = self.slots.get(traffic_light.id.value)
+            if slot is None:
+                continue
+            classification = traffic_light.classification
+            slots.append(slot)
+            colors.append(classification.color)
+            modes.append(classification.mode)
+            counters.append(classification.counter)
+        frame = TrafficLightFrame(self.ids, self.frame.colors.copy(), self.frame.modes.copy(),
+                                  self.frame.counters.copy())
+        frame.colors[slots] = colors
+        frame.modes[slots] = modes
+        frame.counters[slots] = counters
+        self.frame = frame
+        return frame
+
+    def state(self, slot: int) -> TrafficLightState:
+        return self.frame.state(slot)
+
+    def state_of(self, traffic_light_id: int) -> Optional[TrafficLightState]:
+        slot = self.slots.get(traffic_light_id)
+        return self.state(slot) if slot is not None else None